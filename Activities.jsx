@@ -7,6 +7,7 @@ const Activities = () => {
     const [activities, setActivities] = useState([]);
     const [selectedActivity, setSelectedActivity] = useState(null);
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
 
     useEffect(() => {
         fetchActivities();
@@ -16,7 +17,8 @@ const Activities = () => {
         setLoading(true);
         try {
             const res = await axios.get('/api/activities');
-            setActivities(res.data);
+            setActivities(res.data.items);
+            setNextCursor(res.data.next_cursor);
         } catch (err) {
             console.warn("Activities API offline, showing cached ledger.");
             setActivities([
@@ -29,6 +31,12 @@ const Activities = () => {
         }
     };
 
+    const loadMore = async () => {
+        const res = await axios.get('/api/activities', { params: { cursor: nextCursor } });
+        setActivities(prev => [...prev, ...res.data.items]);
+        setNextCursor(res.data.next_cursor);
+    };
+
     const handleSelect = async (id) => {
         try {
             const res = await axios.get(`/api/explain/${id}`);
@@ -100,7 +108,7 @@ const Activities = () => {
                                         whileHover={{ backgroundColor: 'rgba(255,255,255,0.02)' }}
                                         initial={{ opacity: 0, y: 10 }}
                                         animate={{ opacity: 1, y: 0 }}
-                                        transition={{ delay: i * 0.05 }}
+                                        transition={{ delay: Math.min(i, 20) * 0.05 }}
                                     >
                                         <td>{new Date(a.date).toLocaleDateString()}</td>
                                         <td style={{ fontWeight: 600 }}>{a.description}</td>
@@ -117,6 +125,11 @@ const Activities = () => {
                             </tbody>
                         </table>
                     </div>
+                    {nextCursor && (
+                        <div style={{ padding: '1.5rem', borderTop: '1px solid var(--border)', textAlign: 'center' }}>
+                            <button className="btn-primary" onClick={loadMore}>Load more</button>
+                        </div>
+                    )}
                 </motion.div>
 
                 <AnimatePresence>
@@ -9,9 +9,9 @@ const Scenario = () => {
     const [result, setResult] = useState(null);
 
     useEffect(() => {
-        axios.get('/api/activities').then(res => {
-            setActivities(res.data);
-            if (res.data.length > 0) setSelectedId(res.data[0].id);
+        axios.get('/api/activities', { params: { limit: 1000 } }).then(res => {
+            setActivities(res.data.items);
+            if (res.data.items.length > 0) setSelectedId(res.data.items[0].id);
         });
     }, []);
 
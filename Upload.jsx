@@ -25,8 +25,28 @@ const Upload = ({ onUploadSuccess }) => {
             const res = await axios.post('/api/upload', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
-            setStatus('success');
             setMessage(res.data.message);
+
+            // Ingestion runs as a background job; poll until it finishes
+            let job = (await axios.get(`/api/jobs/${res.data.job_id}`)).data;
+            while (job.status === 'queued' || job.status === 'running') {
+                setMessage(`Processing... ${Math.round(job.progress * 100)}% (${job.rows_processed} rows)`);
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                job = (await axios.get(`/api/jobs/${res.data.job_id}`)).data;
+            }
+            if (job.status === 'failed') {
+                setStatus('error');
+                setMessage(job.error || 'Upload failed. Please check CSV formatting.');
+                return;
+            }
+
+            setStatus('success');
+            const skipped = [
+                job.rows_duplicate ? `${job.rows_duplicate} duplicate rows skipped` : null,
+                job.rows_rejected ? `${job.rows_rejected} rows rejected` : null,
+            ].filter(Boolean);
+            setMessage(`Successfully processed ${job.rows_processed} activities`
+                + (skipped.length ? ` (${skipped.join(', ')})` : ''));
             setTimeout(() => {
                 if (onUploadSuccess) onUploadSuccess();
             }, 1500);
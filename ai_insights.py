@@ -0,0 +1,240 @@
+"""
+Executive summaries for POST /insights/ai.
+
+LLM calls run on a small thread pool, off the event loop, and their results are cached
+by a fingerprint of the category totals, so an unchanged ledger never pays for a second
+call. Concurrent requests for the same fingerprint share one in-flight generation, and
+a token bucket caps LLM calls per minute. Callers over the limit, or hit by an LLM error
+or timeout, get the smart-simulation summary, which is computed once per ledger version
+(and refreshed as soon as an upload job completes).
+
+The LLM is Gemini when GEMINI_API_KEY is set. INSIGHTS_LLM=stub swaps in a local stub
+that sleeps INSIGHTS_STUB_LATENCY seconds per call, for load tests; set_llm() injects
+any callable taking a prompt and returning text.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import analytics, database, rollups
+
+CONCURRENCY = int(os.getenv("INSIGHTS_CONCURRENCY", "2"))
+RATE_PER_MINUTE = float(os.getenv("INSIGHTS_RATE_PER_MINUTE", "30"))  # 0 = unlimited
+TIMEOUT = float(os.getenv("INSIGHTS_TIMEOUT", "30"))
+CACHE_SIZE = int(os.getenv("INSIGHTS_CACHE_SIZE", "128"))
+STUB_LATENCY = float(os.getenv("INSIGHTS_STUB_LATENCY", "2.0"))
+
+NO_DATA = "No data available to analyze. Please upload your emission records."
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` calls, with bursts of up to that many."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        if self.per_minute <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_executor = ThreadPoolExecutor(max_workers=max(CONCURRENCY, 1), thread_name_prefix="insights")
+_limiter = RateLimiter(RATE_PER_MINUTE)
+_results = OrderedDict()  # fingerprint -> generated content (touched on the event loop only)
+_inflight = {}  # fingerprint -> asyncio.Task
+_ledger_state = None  # (ledger version, category totals, fingerprint, simulation text)
+_llm = None
+_gemini_model = None
+
+counters = {"llm_calls": 0, "cache_hits": 0, "coalesced": 0, "rate_limited": 0, "timeouts": 0, "errors": 0}
+
+
+def fingerprint(category_totals):
+    items = sorted((k, round(v or 0.0, 6)) for k, v in category_totals.items())
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()[:16]
+
+
+def build_prompt(category_totals):
+    total_co2 = sum(category_totals.values())
+    # Construct a data context for the AI
+    context = f"Total CO2: {total_co2} tCO2e.\n"
+    context += "Breakdown:\n"
+    for cat, val in category_totals.items():
+        context += f"- {cat}: {val} tCO2e\n"
+
+    return f"""
+    You are the Chief Sustainability Officer for an enterprise. Analyze this carbon footprint data:
+    {context}
+
+    Write a concise, professional executive summary.
+    1. State the critical hotspot.
+    2. Provide 1 high-impact strategic action.
+    3. Provide 1 immediate quick-win.
+    4. Project the future trend if no action is taken.
+
+    Format with bold headers like **Executive Summary**, **Critical Hotspot**, etc. Keep it under 200 words.
+    """
+
+
+def simulate(category_totals):
+    """The smart-simulation summary used without (or instead of) an LLM."""
+    total_co2 = sum(category_totals.values())
+    top_cat = max(category_totals, key=category_totals.get)
+    top_val = category_totals[top_cat]
+    percentage = (top_val / total_co2 * 100) if total_co2 > 0 else 0
+
+    response_text = f"**Executive Summary:**\n"
+    response_text += f"Your organization's total carbon footprint is currently **{total_co2:.2f} tCO2e**.\n\n"
+    response_text += f"**Critical Hotspot Identified:**\n"
+    response_text += f"The **{top_cat}** sector matches **{percentage:.1f}%** of your total emissions.\n"
+
+    if top_cat == 'transport':
+        response_text += "• **Strategic Action:** Transitioning last-mile logistics to EV could reduce this by up to 18%.\n"
+        response_text += "• **Immediate Win:** Optimize route planning to decrease fuel consumption by ~5%.\n"
+    elif top_cat == 'energy':
+        response_text += "• **Strategic Action:** Procure Renewable Energy Certificates (RECs) for your main facilities.\n"
+        response_text += "• **Immediate Win:** Audit HVAC systems in HQ; 10% reduction typically found in idle-time management.\n"
+    elif top_cat == 'supply_chain':
+        response_text += "• **Strategic Action:** Engage top 5 suppliers for Tier 1 emission data transparency.\n"
+        response_text += "• **Immediate Win:** Switch to local sourcing for high-volume, low-margin materials.\n"
+    else:
+        response_text += "• **Recommendation:** Conduct a granular audit of this sector to identify specific outlier activities.\n"
+
+    response_text += "\n**Projected Trajectory:**\n"
+    response_text += "Based on current trends, Q4 emissions are projected to rise by 4.2% unless mitigation strategies are deployed immediately."
+    return response_text
+
+
+def ledger_state(db):
+    """(category totals, fingerprint, simulation text) for the current ledger version."""
+    global _ledger_state
+    version = rollups.current_version(db)
+    state = _ledger_state
+    if state is None or state[0] != version:
+        totals = dict(analytics.category_totals(db))
+        state = _ledger_state = (version, totals, fingerprint(totals), simulate(totals) if totals else NO_DATA)
+    return state[1:]
+
+
+def refresh():
+    """Precompute the ledger state after a write (JobRunner calls this when a job completes)."""
+    try:
+        with database.SessionLocal() as db:
+            ledger_state(db)
+    except Exception as e:
+        print(f"Insight precompute failed: {e}")
+
+
+def _gemini(prompt):
+    global _gemini_model
+    if _gemini_model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        _gemini_model = genai.GenerativeModel('gemini-pro')
+    return _gemini_model.generate_content(prompt).text
+
+
+def stub_llm(prompt):
+    """Offline stand-in for Gemini with a fixed latency."""
+    time.sleep(STUB_LATENCY)
+    return f"**Executive Summary:**\nStub insight {hashlib.sha256(prompt.encode()).hexdigest()[:8]}."
+
+
+def get_llm():
+    """The configured LLM callable, or None to always use the simulation."""
+    if _llm is not None:
+        return _llm
+    if os.getenv("INSIGHTS_LLM") == "stub":
+        return stub_llm
+    if os.getenv("GEMINI_API_KEY"):
+        return _gemini
+    return None
+
+
+def set_llm(llm):
+    """Swap the LLM (e.g. a stub in tests); cached results from the previous one are dropped."""
+    global _llm
+    _llm = llm
+    _results.clear()
+
+
+async def _run(llm, key, prompt):
+    counters["llm_calls"] += 1
+    content = await asyncio.get_running_loop().run_in_executor(_executor, llm, prompt)
+    _results[key] = content
+    while len(_results) > CACHE_SIZE:
+        _results.popitem(last=False)
+    return content
+
+
+def _finished(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # retrieved here so a failure nobody awaited is not logged as unhandled
+
+
+async def generate(category_totals, key, fallback):
+    """Summary for these totals: cached, shared with an in-flight call, fresh from the LLM, or `fallback`."""
+    llm = get_llm()
+    if llm is None:
+        return fallback
+
+    content = _results.get(key)
+    if content is not None:
+        _results.move_to_end(key)
+        counters["cache_hits"] += 1
+        return content
+
+    task = _inflight.get(key)
+    if task is not None and task.get_loop() is not asyncio.get_running_loop():
+        task = None  # started under another event loop (e.g. a TestClient used without `with`)
+    if task is not None:
+        counters["coalesced"] += 1
+    elif not _limiter.try_acquire():
+        counters["rate_limited"] += 1
+        return fallback
+    else:
+        task = asyncio.ensure_future(_run(llm, key, build_prompt(category_totals)))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finished(key, t))
+
+    try:
+        # shield: a caller timing out must not cancel the call other callers are waiting on
+        return await asyncio.wait_for(asyncio.shield(task), TIMEOUT)
+    except asyncio.TimeoutError:
+        counters["timeouts"] += 1
+        print(f"LLM call timed out after {TIMEOUT}s - Falling back to simulation.")
+    except Exception as e:
+        counters["errors"] += 1
+        print(f"Gemini API Error: {e} - Falling back to simulation.")
+    return fallback
+
+
+def stats():
+    llm = get_llm()
+    names = {None: "simulation", _gemini: "gemini", stub_llm: "stub"}
+    return {
+        "llm": names.get(llm, "custom"),
+        "cached": len(_results),
+        "in_flight": len(_inflight),
+        "concurrency": CONCURRENCY,
+        "rate_per_minute": RATE_PER_MINUTE,
+        **counters,
+    }
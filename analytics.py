@@ -0,0 +1,192 @@
+"""
+Shared aggregation queries for /summary, /insights and /insights/ai.
+
+Whole-ledger totals are read from the rollup tables (see rollups.py). A date range is
+split into the whole calendar months it covers and the partial months at its edges. The
+whole months are read from the per-month rollups: the frozen ones for closed periods (see
+periods.py), the live ones otherwise. Only the edges touch row data. They are answered
+from the columnar snapshot (see columnar.py) when it is enabled and current, and otherwise by a GROUP
+BY over `activities` that the (activity_type, date) and date indexes keep within the edge
+days. A multi-year trend therefore costs one small read per month, whatever the size of
+the ledger. No path hydrates Activity objects.
+"""
+from datetime import datetime
+
+from sqlalchemy import func
+
+import columnar, models, periods
+from rollups import month_expr, month_key
+
+
+def _date_filtered(query, start=None, end=None):
+    if start is not None:
+        query = query.filter(models.Activity.date >= start)
+    if end is not None:
+        query = query.filter(models.Activity.date < end)
+    return query
+
+
+def _month_floor(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def _split_range(start, end):
+    """
+    Split [start, end) into whole calendar months and the partial months at its edges.
+    Returns ((first, last) or None, edges): first/last are 'YYYY-MM' with last exclusive,
+    either is None when the range is open on that side, and edges are [start, end) pairs.
+    """
+    first = None
+    if start is not None:
+        first = _month_floor(start)
+        if first < start:
+            first = periods.month_start(periods.next_month(month_key(first)))
+    last = _month_floor(end) if end is not None else None
+    if first is not None and last is not None and first >= last:
+        return None, [(start, end)]
+
+    edges = []
+    if first is not None and start < first:
+        edges.append((start, first))
+    if last is not None and last < end:
+        edges.append((last, end))
+    return (month_key(first), month_key(last)), edges
+
+
+def _month_rows(db, first=None, last=None):
+    """
+    (activity_type, month, total_co2e) for the whole months in [first, last): the frozen
+    totals for closed months, the live rollups for open ones.
+    """
+    closed_through = periods.closed_through(db)
+    boundary = periods.next_month(closed_through) if closed_through else None  # first open month
+    parts = []
+    if boundary is not None and (first is None or first < boundary):
+        parts.append((models.PeriodRollup, first, boundary if last is None else min(last, boundary)))
+    if boundary is None or last is None or last > boundary:
+        lo = first if boundary is None else (boundary if first is None else max(first, boundary))
+        parts.append((models.CategoryMonthRollup, lo, last))
+
+    rows = []
+    for model, lo, hi in parts:
+        query = db.query(model.activity_type, model.month, model.total_co2e).filter(model.activity_count > 0)
+        if lo is not None:
+            query = query.filter(model.month >= lo)
+        if hi is not None:
+            query = query.filter(model.month < hi)
+        rows.extend(query.all())
+    return rows
+
+
+def _scan_category_totals(db, start, end):
+    snapshot = columnar.snapshot(db)
+    if snapshot is not None:
+        return snapshot.category_totals(start, end)
+    total = func.coalesce(func.sum(models.Activity.co2e), 0.0)
+    return (
+        _date_filtered(db.query(models.Activity.activity_type, total), start, end)
+        .group_by(models.Activity.activity_type)
+        .all()
+    )
+
+
+def _scan_monthly_totals(db, start, end):
+    snapshot = columnar.snapshot(db)
+    if snapshot is not None:
+        return snapshot.monthly_totals(start, end)
+    month = month_expr(models.Activity.date, db.get_bind().dialect.name)
+    return (
+        _date_filtered(db.query(month, func.coalesce(func.sum(models.Activity.co2e), 0.0)), start, end)
+        .group_by(month)
+        .all()
+    )
+
+
+def category_totals(db, start=None, end=None):
+    """[(activity_type, total_co2e)] ordered from largest to smallest."""
+    if start is None and end is None:
+        rows = (
+            db.query(models.CategoryRollup.activity_type, models.CategoryRollup.total_co2e)
+            .filter(models.CategoryRollup.activity_count > 0)
+            .order_by(models.CategoryRollup.total_co2e.desc())
+            .all()
+        )
+        return [(activity_type, value) for activity_type, value in rows]
+
+    months, edges = _split_range(start, end)
+    totals = {}
+    if months is not None:
+        for activity_type, _, value in _month_rows(db, *months):
+            totals[activity_type] = totals.get(activity_type, 0.0) + value
+    for edge_start, edge_end in edges:
+        for activity_type, value in _scan_category_totals(db, edge_start, edge_end):
+            totals[activity_type] = totals.get(activity_type, 0.0) + value
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def monthly_totals(db, start=None, end=None):
+    """[(YYYY-MM, total_co2e)] in chronological order."""
+    if start is None and end is None:
+        rows = (
+            db.query(models.MonthRollup.month, models.MonthRollup.total_co2e)
+            .filter(models.MonthRollup.activity_count > 0)
+            .order_by(models.MonthRollup.month)
+            .all()
+        )
+        return [(m, value) for m, value in rows]
+
+    months, edges = _split_range(start, end)
+    totals = {}
+    if months is not None:
+        for _, m, value in _month_rows(db, *months):
+            totals[m] = totals.get(m, 0.0) + value
+    for edge_start, edge_end in edges:
+        for m, value in _scan_monthly_totals(db, edge_start, edge_end):
+            totals[m] = totals.get(m, 0.0) + value
+    return sorted(totals.items())
+
+
+def top_activities(db, limit=5, start=None, end=None):
+    """
+    [(description, co2e)] of the largest emitters, served by the co2e index. Within a date
+    range the columnar snapshot picks them, since SQLite would rather sort the whole range.
+    """
+    snapshot = columnar.snapshot(db) if start is not None or end is not None else None
+    if snapshot is not None:
+        ids = snapshot.top_ids(limit, start, end)
+        if not ids:
+            return []
+        rows = (
+            db.query(models.Activity.description, models.Activity.co2e)
+            .filter(models.Activity.id.in_(ids))
+            .order_by(models.Activity.co2e.desc())
+            .all()
+        )
+        return [(description, co2e) for description, co2e in rows]
+
+    rows = (
+        _date_filtered(db.query(models.Activity.description, models.Activity.co2e), start, end)
+        .order_by(models.Activity.co2e.desc())
+        .limit(limit)
+        .all()
+    )
+    return [(description, co2e) for description, co2e in rows]
+
+
+def summary(db, start=None, end=None):
+    """Dashboard payload: total, category distribution, hotspots and monthly trend."""
+    categories = category_totals(db, start, end)
+    if not categories:
+        return {
+            "total_co2e": 0.0,
+            "category_distribution": [],
+            "hotspots": [],
+            "trend_data": []
+        }
+
+    return {
+        "total_co2e": sum(value for _, value in categories),
+        "category_distribution": [{"name": k, "value": v} for k, v in categories],
+        "hotspots": [{"description": d, "co2e": c} for d, c in top_activities(db, 5, start, end)],
+        "trend_data": [{"date": m, "co2e": v} for m, v in monthly_totals(db, start, end)],
+    }
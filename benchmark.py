@@ -0,0 +1,964 @@
+"""
+EcoLedger performance benchmarks.
+
+Usage:
+    python benchmark.py classify [--sizes 1000 100000 1000000]
+    python benchmark.py model [--sizes 10000 100000]
+    python benchmark.py aggregate [--sizes 10000 100000 1000000]
+    python benchmark.py scenario [--sizes 1000000] [--scenarios 200]
+    python benchmark.py factors [--sizes 100000 1000000]
+    python benchmark.py recalc [--sizes 100000 1000000]
+    python benchmark.py columnar [--sizes 100000 1000000]
+    python benchmark.py insights [--requests 20] [--latency 1.0]
+    python benchmark.py concurrency [--url postgresql://...] [--writers 4] [--readers 8] [--baseline]
+    python benchmark.py http [--rows 100000] [--duration 30] [--readers 16] [--app-dir OTHER_CHECKOUT]
+    python benchmark.py startup [--runs 5]
+    python benchmark.py suite [--sizes 10000 100000] [--output benchmark_results.json] [--threshold 0.25] [--save-baseline]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Suffixes mixed into synthetic descriptions so repeated patterns are not byte-identical
+SUFFIXES = ["", " - Q1", " - Q2", " - US East", " - EU West", " (monthly)", " - HQ", " - Site 4"]
+
+
+def load_training_descriptions():
+    with open(os.path.join(SCRIPT_DIR, 'training_data.csv'), newline='') as f:
+        return [row['description'] for row in csv.DictReader(f)]
+
+
+def synthetic_descriptions(n, seed=42):
+    """Scale the training_data.csv descriptions up to n rows."""
+    rng = random.Random(seed)
+    base = load_training_descriptions()
+    return [rng.choice(base) + rng.choice(SUFFIXES) for _ in range(n)]
+
+
+def load_training_rows():
+    with open(os.path.join(SCRIPT_DIR, 'training_data.csv'), newline='') as f:
+        return [(row['description'], row['label']) for row in csv.DictReader(f)]
+
+
+def synthetic_activity_rows(n, seed=42, start=datetime(2021, 1, 1), days=3 * 365):
+    """Yield n already-classified activity rows spread over `days` days."""
+    import factors
+
+    rng = random.Random(seed)
+    base = load_training_rows()
+    registry = factors.get_registry()
+    for _ in range(n):
+        description, activity_type = rng.choice(base)
+        quantity = round(rng.uniform(1, 5000), 2)
+        i = registry.default_index(activity_type)
+        yield {
+            "description": description + rng.choice(SUFFIXES),
+            "quantity": quantity,
+            "unit": registry.unit[i],
+            "date": start + timedelta(days=rng.randrange(days)),
+            "activity_type": activity_type,
+            "co2e": quantity * float(registry.factor[i]),
+            "confidence_score": registry.confidence[i],
+            "factor_key": registry.keys[i],
+            "factor_version": registry.versions[i],
+        }
+
+
+def build_ledger(n, directory, batch_size=50_000):
+    """Create a migrated SQLite ledger with n synthetic activities; returns a sessionmaker."""
+    from sqlalchemy import create_engine, insert, text
+    from sqlalchemy.orm import sessionmaker
+    import migrations, models, rollups
+
+    engine = create_engine(f"sqlite:///{os.path.join(directory, f'ledger_{n}.db')}")
+    migrations.migrate(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        batch = []
+        for row in synthetic_activity_rows(n):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                db.execute(insert(models.Activity), batch)
+                rollups.record_rows(db, batch)
+                batch = []
+        if batch:
+            db.execute(insert(models.Activity), batch)
+            rollups.record_rows(db, batch)
+        db.execute(text("ANALYZE"))  # let the planner see the new indexes' selectivity
+        db.commit()
+    return Session
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def _report(label, n, elapsed):
+    rate = n / elapsed if elapsed > 0 else float('inf')
+    print(f"{label:<28} {n:>10,} rows  {elapsed:>9.3f} s  {rate:>14,.0f} rows/s")
+
+
+def bench_classify(args):
+    import utils
+
+    model, version = utils.get_classifier(), utils.model_info()["version"]
+    for n in args.sizes:
+        descriptions = synthetic_descriptions(n)
+        if model is not None:
+            _report("model (batch)", n, _timed(lambda d: utils.classify_activities(d, use_cache=False), descriptions))
+            utils.classification_cache.clear()
+            _report("model (batch, cold cache)", n, _timed(utils.classify_activities, descriptions))
+            _report("model (batch, warm cache)", n, _timed(utils.classify_activities, descriptions))
+            if n <= args.per_row_limit:
+                _report("model (per row, uncached)", n, _timed(
+                    lambda d: [utils.classify_activities([x], use_cache=False)[0] for x in d], descriptions))
+
+        utils.set_classifier(None)
+        try:
+            _report("heuristic (batch)", n, _timed(lambda d: utils.classify_activities(d, use_cache=False), descriptions))
+        finally:
+            utils.set_classifier(model, version)
+
+
+def bench_model(args):
+    """
+    TF-IDF + LogisticRegression (train_model.py) vs HashingVectorizer + SGDClassifier
+    (online_model.py): training time, model file size, held-out accuracy and predict
+    latency, plus what the online model takes to learn a batch of corrections.
+    Training sets are training_data.csv as is, then scaled up to each size.
+    """
+    import joblib
+    import online_model, train_model
+
+    with open(os.path.join(SCRIPT_DIR, 'training_data.csv'), newline='') as f:
+        rows = [(row['description'], row['label']) for row in csv.DictReader(f)]
+    rng = random.Random(42)
+    rng.shuffle(rows)
+    cut = len(rows) * 4 // 5
+    train_rows, test_rows = rows[:cut], rows[cut:]
+    test_x, test_y = [d for d, _ in test_rows], [l for _, l in test_rows]
+    batch = synthetic_descriptions(5000)
+    builders = {
+        "tfidf+logreg": lambda X, y: train_model.build_pipeline().fit(X, y),
+        "hashing+sgd": online_model.train,
+    }
+
+    for n in [None] + args.sizes:
+        sample = train_rows if n is None else [
+            (description + rng.choice(SUFFIXES), label)
+            for description, label in (rng.choice(train_rows) for _ in range(n))
+        ]
+        X, y = [d for d, _ in sample], [l for _, l in sample]
+        for name, build in builders.items():
+            started = time.perf_counter()
+            model = build(X, y)
+            train_seconds = time.perf_counter() - started
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "model.joblib")
+                joblib.dump(model, path)
+                size_kb = os.path.getsize(path) / 1024
+            accuracy = statistics.mean(p == t for p, t in zip(model.predict(test_x), test_y))
+            single = _percentile([_timed(model.predict_proba, [test_x[i % len(test_x)]]) for i in range(200)], 50)
+            line = (
+                f"{name:<13} {len(sample):>9,} samples  train {train_seconds * 1000:>9.1f} ms  size {size_kb:>8.1f} KB"
+                f"  accuracy {accuracy:>6.1%}  predict 1 {single * 1000:>5.2f} ms"
+                f"  5,000 {_timed(model.predict_proba, batch) * 1000:>7.1f} ms"
+            )
+            if hasattr(model, "partial_fit"):
+                corrections = sample[:1000]
+                elapsed = _timed(lambda: model.partial_fit(
+                    [d for d, _ in corrections], [l for _, l in corrections], online_model.EPOCHS))
+                line += f"  learn {len(corrections):,} corrections {elapsed * 1000:.1f} ms"
+            print(line)
+
+
+def _orm_summary(db):
+    """The pre-rollup /summary: hydrate every Activity and aggregate in Python."""
+    import models
+
+    activities = db.query(models.Activity).all()
+    dist, trends = {}, {}
+    for a in activities:
+        dist[a.activity_type] = dist.get(a.activity_type, 0) + a.co2e
+    for a in activities:
+        month = a.date.strftime('%Y-%m')
+        trends[month] = trends.get(month, 0) + a.co2e
+    hotspots = sorted(activities, key=lambda x: x.co2e, reverse=True)[:5]
+    return sum(a.co2e for a in activities), dist, hotspots, sorted(trends.items())
+
+
+def _orm_category_totals(db):
+    """The pre-aggregation /insights and /insights/ai path."""
+    import models
+
+    totals = {}
+    for a in db.query(models.Activity).all():
+        totals[a.activity_type] = totals.get(a.activity_type, 0) + a.co2e
+    return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+
+def bench_aggregate(args):
+    import analytics, columnar
+
+    columnar.ENABLED = False  # date-range paths measured against SQL here; see `columnar`
+    year = datetime(2022, 1, 1), datetime(2023, 1, 1)
+    span = datetime(2021, 3, 15), datetime(2023, 9, 20)  # whole months from rollups, edge days scanned
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            Session = build_ledger(n, directory)
+            with Session() as db:
+                cases = [
+                    ("summary (ORM, before)", _orm_summary),
+                    ("summary (SQL)", analytics.summary),
+                    ("summary 1y range (SQL)", lambda s: analytics.summary(s, *year)),
+                    ("summary 30-month range (SQL)", lambda s: analytics.summary(s, *span)),
+                    ("category totals (ORM, before)", _orm_category_totals),
+                    ("category totals (SQL)", analytics.category_totals),
+                ]
+                for label, fn in cases:
+                    db.expunge_all()
+                    _report_latency(label, n, _timed(fn, db))
+
+
+def synthetic_scenarios(count, seed=42):
+    """Mixed rule sets: partial EV shifts, quantity cuts and recategorizations."""
+    import schemas
+
+    rng = random.Random(seed)
+    categories = ["Transport", "Energy", "Procurement", "Cloud Services"]
+    result = []
+    for i in range(count):
+        rules = [
+            schemas.ScenarioRule(category="Transport", share=rng.choice([0.1, 0.3, 0.5]), new_factor=0.05),
+            schemas.ScenarioRule(category=rng.choice(categories), quantity_multiplier=rng.uniform(0.7, 0.95)),
+            schemas.ScenarioRule(category="Energy", start_date=datetime(2022, 1, 1).date(), new_type="Cloud Services"),
+        ]
+        result.append(schemas.BatchScenario(name=f"scenario-{i}", rules=rules[:rng.randint(1, 3)]))
+    return result
+
+
+def bench_scenario(args):
+    import scenarios
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            Session = build_ledger(n, directory)
+            batch = synthetic_scenarios(args.scenarios)
+            with Session() as db:
+                started = time.perf_counter()
+                columns = scenarios.LedgerColumns.load(db)
+                _report_latency("load ledger columns", n, time.perf_counter() - started)
+            started = time.perf_counter()
+            for scenario in batch:
+                scenarios.simulate(columns, scenario)
+            _report_latency(f"simulate {len(batch)} scenarios", n, time.perf_counter() - started)
+
+
+def _traced(fn, *args):
+    """(seconds, peak traced Python allocations in MB); memory-mapped pages are not counted."""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        elapsed = _timed(fn, *args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def bench_factors(args):
+    import factors, ingest, utils
+
+    registry = factors.get_registry()
+    units = ["km", "miles", "liters", "kWh", "MWh", "therms", "$", "USD", "GB", "TB", "items"]
+    regions = [None, None, "US", "GB", "DE"]
+    labels = [label for _, label in load_training_rows()]
+    rng = random.Random(42)
+    for n in args.sizes:
+        rows = [
+            (rng.choice(labels), rng.choice(units), rng.choice(regions),
+             rng.randrange(2020, 2025), round(rng.uniform(1, 5000), 2))
+            for _ in range(n)
+        ]
+
+        def per_row(rows):
+            # The pre-registry path: a factor lookup, formula and notes formatted for every row
+            out = []
+            for activity_type, unit, _, _, quantity in rows:
+                co2e, factor, source, formula, confidence, unit_applied = utils.compute_emissions(activity_type, quantity)
+                out.append((co2e, formula, f"Calculated for {quantity} {unit}"))
+            return out
+
+        def batched(rows):
+            out = []
+            for start in range(0, len(rows), ingest.BATCH_SIZE):
+                types, batch_units, batch_regions, years, quantities = zip(*rows[start:start + ingest.BATCH_SIZE])
+                index, multiplier = registry.resolve(types, batch_units, years, batch_regions)
+                out.append((registry.co2e(quantities, index, multiplier).tolist(), registry.keys[index].tolist()))
+            return out
+
+        _report("per row (default factor)", n, _timed(per_row, rows))
+        _report("registry.resolve (batched)", n, _timed(batched, rows))
+
+
+def bench_recalc(args):
+    import threading
+    import analytics, columnar, database, factors, recalculate
+    from sqlalchemy.orm import sessionmaker
+
+    with tempfile.TemporaryDirectory() as directory:
+        columnar.STORE_DIR = os.path.join(directory, "columnar")
+        with open(factors.FACTORS_PATH, newline='') as f:
+            base = list(csv.DictReader(f))
+
+        def registry_with(rows):
+            path = os.path.join(directory, "factors.csv")
+            with open(path, "w", newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=factors.FACTOR_HEADERS)
+                writer.writeheader()
+                writer.writerows(rows)
+            return factors.FactorRegistry.load(path)
+
+        changed = [dict(r, factor="0.45") if r["category"] == "Procurement" else r for r in base]
+        added = changed + [dict(base[0], category="Energy", unit="kWh", region="US", year="2024", factor="0.36")]
+
+        for n in args.sizes:
+            build_ledger(n, directory)
+            engine = database.make_engine(f"sqlite:///{os.path.join(directory, f'ledger_{n}.db')}")
+            Session = sessionmaker(bind=engine)
+            columnar.sync(engine)
+
+            def reset_state(db):
+                db.execute(recalculate.applied.delete())
+
+            cases = [
+                ("nothing changed", registry_with(base), None),
+                ("Procurement factor edited", registry_with(changed), None),
+                ("US 2024 Energy factor added", registry_with(added), None),
+                ("full (never reconciled)", registry_with(base), reset_state),
+            ]
+            for label, registry, prepare in cases:
+                if prepare is not None:
+                    with Session() as db:
+                        prepare(db)
+                        db.commit()
+
+                # A dashboard reader running throughout: its worst latency shows any blocking
+                latencies, done = [], threading.Event()
+
+                def reader():
+                    with Session() as db:
+                        while not done.is_set():
+                            started = time.perf_counter()
+                            analytics.summary(db)
+                            db.rollback()
+                            latencies.append(time.perf_counter() - started)
+
+                thread = threading.Thread(target=reader)
+                thread.start()
+                stats = recalculate.recalculate(engine, registry=registry)
+                done.set()
+                thread.join()
+                print(f"{label:<30} {n:>10,} rows  {stats['elapsed_seconds']:>8.2f} s  "
+                      f"{stats['rows_scanned']:>10,} scanned  {stats['rows_updated']:>10,} updated  "
+                      f"reads p99 {_percentile(latencies, 99) * 1000:.1f} ms (max {max(latencies) * 1000:.1f} ms)")
+            engine.dispose()
+
+
+def bench_columnar(args):
+    import analytics, columnar
+
+    year = datetime(2022, 1, 1), datetime(2023, 1, 1)
+    span = datetime(2021, 3, 15), datetime(2023, 9, 20)  # whole months from rollups, edge days scanned
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            Session = build_ledger(n, directory)
+            columnar.STORE_DIR = os.path.join(directory, f"columnar-{n}")
+            with Session() as db:
+                _report_latency("initial columnar sync", n, _timed(columnar.sync, db.get_bind()))
+
+                def sql(fn):
+                    def run(s):
+                        columnar.ENABLED = False
+                        try:
+                            return fn(s)
+                        finally:
+                            columnar.ENABLED = True
+                    return run
+
+                cases = [
+                    ("category totals (ORM, before)", _orm_category_totals),
+                    ("1y category totals (SQL)", sql(lambda s: analytics.category_totals(s, *year))),
+                    ("1y category totals (columnar)", lambda s: analytics.category_totals(s, *year)),
+                    ("1y monthly totals (columnar)", lambda s: analytics.monthly_totals(s, *year)),
+                    ("30-month summary (SQL)", sql(lambda s: analytics.summary(s, *span))),
+                    ("30-month summary (columnar)", lambda s: analytics.summary(s, *span)),
+                ]
+                for label, fn in cases:
+                    db.expunge_all()
+                    elapsed, peak = _traced(fn, db)
+                    print(f"{label:<32} {n:>10,} rows  {elapsed * 1000:>10.1f} ms  {peak:>8.1f} MB peak")
+
+
+def bench_insights(args):
+    """Concurrent /insights/ai calls against a stub LLM with injected latency."""
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi.testclient import TestClient
+
+    os.environ.setdefault("INGEST_WORKERS", "0")
+    os.environ.setdefault("MODEL_WARMUP", "0")
+    import ai_insights, database, main, models
+
+    calls = []
+
+    def stub(prompt):
+        calls.append(prompt)
+        time.sleep(args.latency)
+        return f"stub insight #{len(calls)}"
+
+    ai_insights.set_llm(stub)
+    with tempfile.TemporaryDirectory() as directory:
+        Session = build_ledger(10_000, directory)
+
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        async_engine = database.make_engine(database.async_url(Session.kw["bind"].url), create=create_async_engine)
+        AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def override_db():
+            async with AsyncSession() as db:
+                yield db
+
+        main.app.dependency_overrides[database.get_async_db] = override_db
+        os.chdir(directory)  # the startup hook migrates ./ecoledger.db; keep it in the scratch directory
+        client = TestClient(main.app)
+        client.__enter__()  # one event loop for every request, as under uvicorn
+
+        def burst(label):
+            before = len(calls)
+            with ThreadPoolExecutor(max_workers=args.requests + 1) as pool:
+                futures = [pool.submit(_timed, client.post, "/insights/ai") for _ in range(args.requests)]
+                time.sleep(args.latency / 4)
+                # A cheap request made while generation is in flight: stays fast if the loop is free
+                probe_started = time.perf_counter()
+                client.get("/cache/insights")
+                probe = time.perf_counter() - probe_started
+                slowest = max(f.result() for f in futures)
+            print(f"{label:<32} {args.requests:>4} requests  slowest {slowest * 1000:>8.1f} ms  "
+                  f"{len(calls) - before} LLM calls  concurrent GET {probe * 1000:.1f} ms")
+
+        burst("cold (coalesced)")
+        burst("warm (cached)")
+        with Session() as db:
+            db.add(models.Activity(description="Diesel top-up", quantity=50, unit="liters", activity_type="Transport",
+                                   co2e=134.0, confidence_score="High", date=datetime(2023, 6, 1)))
+            db.commit()
+        burst("after a ledger write")
+        print(ai_insights.stats())
+        client.__exit__(None, None, None)
+        main.app.dependency_overrides.clear()
+        os.chdir(SCRIPT_DIR)
+
+
+def synthetic_csv_lines(n, seed=42):
+    """Header plus n upload-shaped CSV lines (date, description, quantity, unit), without line endings."""
+    yield "date,description,quantity,unit"
+    for row in synthetic_activity_rows(n, seed=seed):
+        description = row["description"].replace('"', '""')
+        yield f'{row["date"]:%Y-%m-%d},"{description}",{row["quantity"]},{row["unit"]}'
+
+
+def synthetic_csv(n, seed=42):
+    """An upload-shaped CSV of n synthetic rows, as bytes."""
+    return ("\n".join(synthetic_csv_lines(n, seed)) + "\n").encode()
+
+
+def write_synthetic_csv(path, n, seed=42):
+    """synthetic_csv written line by line to `path`, for ledgers too large to hold in memory."""
+    with open(path, "w", newline="") as f:
+        for line in synthetic_csv_lines(n, seed):
+            f.write(line + "\n")
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+
+def _load_writer(url, baseline, seeds, rows, batch_size):
+    """One upload worker process for bench_concurrency; returns (rows written, errors)."""
+    import io
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import database, ingest
+
+    engine = create_engine(url) if baseline else database.make_engine(url)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    written, errors = 0, []
+    for seed in seeds:
+        try:
+            with Session() as db:
+                reader, header_map = ingest.open_reader(io.BytesIO(synthetic_csv(rows, seed=seed)))
+                for parsed, _, _ in ingest.iter_batches(reader, header_map, batch_size):
+                    written += ingest.write_batch(db, parsed)
+                    db.commit()
+        except Exception as e:
+            errors.append(f"write: {type(e).__name__}: {str(e).splitlines()[0]}")
+    engine.dispose()
+    return written, errors
+
+
+def bench_concurrency(args):
+    """
+    Upload worker processes (committing batch by batch, like ingestion jobs) racing
+    dashboard reads from threads of this process, against --url (default: a scratch SQLite
+    file). --baseline uses a plain engine without the pool and SQLite settings from
+    database.py, for comparison.
+    """
+    import multiprocessing
+    import threading
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import analytics, database, ledger, migrations
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or f"sqlite:///{os.path.join(directory, 'load.db')}"
+        engine = create_engine(url) if args.baseline else database.make_engine(url)
+        migrations.migrate(engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+
+        errors, read_latencies = [], []
+        writing = threading.Event()
+        writing.set()
+
+        def reader():
+            while writing.is_set():
+                try:
+                    with Session() as db:
+                        started = time.perf_counter()
+                        analytics.summary(db)
+                        ledger.fetch_page(db, limit=100, category="Transport")
+                        read_latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors.append(f"read: {type(e).__name__}: {str(e).splitlines()[0]}")
+                time.sleep(args.think)
+
+        readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+        pool = ProcessPoolExecutor(max_workers=args.writers, mp_context=multiprocessing.get_context("spawn"))
+        started = time.perf_counter()
+        futures = [
+            pool.submit(_load_writer, url, args.baseline, range(i, args.writers * args.uploads, args.writers),
+                        args.rows, args.batch_size)
+            for i in range(args.writers)
+        ]
+        for t in readers:
+            t.start()
+        written = 0
+        for f in futures:
+            rows, write_errors = f.result()
+            written += rows
+            errors.extend(write_errors)
+        elapsed = time.perf_counter() - started
+        writing.clear()
+        for t in readers:
+            t.join()
+        pool.shutdown()
+        engine.dispose()
+
+    print(f"{engine.dialect.name} ({'baseline engine' if args.baseline else 'database.make_engine'})")
+    print(f"{'rows written':<32} {written:>10,}  {written / elapsed:>10,.0f} rows/s")
+    print(f"{'reads':<32} {len(read_latencies):>10,}  p50 {_percentile(read_latencies, 50) * 1000:.1f} ms"
+          f"  p99 {_percentile(read_latencies, 99) * 1000:.1f} ms")
+    print(f"{'errors':<32} {len(errors):>10,}")
+    for message in sorted(set(errors))[:5]:
+        print(f"  {message}")
+
+
+def bench_http(args):
+    """
+    p50/p99 latency of dashboard reads against a real uvicorn server while uploads are
+    streaming in. --app-dir runs another checkout of the backend (e.g. an older commit)
+    against the same workload for comparison.
+    """
+    import asyncio
+    import socket
+    import httpx
+
+    with tempfile.TemporaryDirectory() as directory:
+        Session = build_ledger(args.rows, directory)
+        url = str(Session.kw["bind"].url)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(
+            os.environ, PYTHONPATH=args.app_dir, DATABASE_URL=url, MODEL_WARMUP="0",
+            UPLOAD_DIR=os.path.join(directory, "uploads"), COLUMNAR_DIR=os.path.join(directory, "columnar"),
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base = f"http://127.0.0.1:{port}"
+        uploads = [synthetic_csv(args.upload_rows, seed=i) for i in range(4)]
+        reads = {"/summary": {}, "/activities?limit=100&category=Transport": {}, "/insights": {}}
+        latencies = {path: [] for path in list(reads) + ["POST /upload"]}
+        errors = []
+
+        async def run():
+            async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+                for _ in range(600):
+                    try:
+                        if (await client.get("/cache/classification")).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.1)
+                deadline = time.perf_counter() + args.duration
+
+                async def timed(label, request):
+                    started = time.perf_counter()
+                    try:
+                        response = await request
+                        if response.status_code >= 400:
+                            errors.append(f"{label}: HTTP {response.status_code}")
+                        latencies[label].append(time.perf_counter() - started)
+                    except httpx.HTTPError as e:
+                        errors.append(f"{label}: {type(e).__name__}")
+
+                async def reader(i):
+                    paths = list(reads)
+                    while time.perf_counter() < deadline:
+                        path = paths[i % len(paths)]
+                        i += 1
+                        await timed(path, client.get(path))
+
+                async def uploader():
+                    i = 0
+                    while time.perf_counter() < deadline:
+                        files = {"file": (f"load-{i}.csv", uploads[i % len(uploads)], "text/csv")}
+                        await timed("POST /upload", client.post("/upload", files=files))
+                        i += 1
+                        await asyncio.sleep(args.upload_interval)
+
+                await asyncio.gather(*[reader(i) for i in range(args.readers)], uploader())
+
+        try:
+            asyncio.run(run())
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"app: {args.app_dir}  ({args.rows:,} row ledger, {args.readers} readers, {args.duration}s)")
+    for label, values in latencies.items():
+        print(f"{label:<44} {len(values):>7,} req  p50 {_percentile(values, 50) * 1000:>8.1f} ms"
+              f"  p99 {_percentile(values, 99) * 1000:>8.1f} ms")
+    print(f"{'errors':<44} {len(errors):>7,}")
+    for message in sorted(set(errors))[:5]:
+        print(f"  {message}")
+
+
+# Runs in a fresh interpreter; prints one JSON object of timings in seconds
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    t2 = time.perf_counter()
+    client.get("/summary")
+    t3 = time.perf_counter()
+    main.utils.classify_activities(["Main Office Electricity"])
+    t4 = time.perf_counter()
+    main.utils.classify_activities(["Fleet Logistics - Diesel Delivery"])
+    t5 = time.perf_counter()
+print(json.dumps({
+    "import main": t1 - t0,
+    "app startup": t2 - t1,
+    "first /summary": t3 - t2,
+    "first classification": t4 - t3,
+    "second classification": t5 - t4,
+}))
+"""
+
+
+def bench_startup(args):
+    env = dict(os.environ, PYTHONPATH=SCRIPT_DIR, MODEL_WARMUP="0", INGEST_WORKERS="0")
+    runs = []
+    for _ in range(args.runs):
+        # A scratch working directory gives each run its own empty ./ecoledger.db
+        with tempfile.TemporaryDirectory() as directory:
+            out = subprocess.run(
+                [sys.executable, "-c", _STARTUP_PROBE], cwd=directory, env=env,
+                capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+    for label in runs[0]:
+        print(f"{label:<32} median {statistics.median(r[label] for r in runs) * 1000:>10.1f} ms")
+
+
+# Metrics where a lower value is better; every other metric is a rate
+_LOWER_IS_BETTER = ("_ms", "_mb")
+# Tail latencies of a few dozen requests are too noisy to fail a run on; they are reported only
+_REPORTED_ONLY = ("_p95_ms",)
+
+
+def _latencies_ms(request, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = request()
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return latencies
+
+
+def _suite_size(n, directory, requests):
+    """
+    One ledger size of the suite, run in a fresh process so the app is configured for a
+    scratch database and ru_maxrss is this size's own peak. Returns {metric: value}.
+    """
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(directory, 'suite.db')}",
+        UPLOAD_DIR=os.path.join(directory, "uploads"),
+        COLUMNAR_DIR=os.path.join(directory, "columnar"),
+        INGEST_WORKERS="0",
+        MODEL_WARMUP="0",
+    )
+    os.chdir(directory)
+    from fastapi.testclient import TestClient
+    import ingest, main, response_cache, utils
+
+    metrics = {}
+    path = os.path.join(directory, "upload.csv")
+    write_synthetic_csv(path, n)
+
+    utils.get_classifier()  # model loading is not part of the ingestion rate
+    with TestClient(main.app) as client:
+        # Ingestion through POST /upload; with INGEST_WORKERS=0 the job runs inside the request.
+        # The second upload differs by a trailing newline, so only the row-level checks skip it.
+        for label in ("ingest", "duplicate"):
+            with open(path, "rb") as f:
+                started = time.perf_counter()
+                response = client.post("/upload", files={"file": (f"{label}.csv", f, "text/csv")})
+                elapsed = time.perf_counter() - started
+            body = response.json()
+            if response.status_code >= 400 or body["status"] != "completed":
+                raise RuntimeError(f"{label} upload failed: {body}")
+            metrics[f"{label}_rows_per_second"] = round(n / elapsed, 1)
+            with open(path, "a") as f:
+                f.write("\n")
+
+        # Classification alone, uncached, in ingestion-sized batches
+        descriptions = load_training_descriptions()
+        rng = random.Random(7)
+        elapsed = 0.0
+        for start in range(0, n, ingest.BATCH_SIZE):
+            batch = [rng.choice(descriptions) + rng.choice(SUFFIXES) for _ in range(min(ingest.BATCH_SIZE, n - start))]
+            elapsed += _timed(lambda d: utils.classify_activities(d, use_cache=False), batch)
+        metrics["classify_rows_per_second"] = round(n / elapsed, 1)
+
+        def uncached(path, **params):
+            def request():
+                response_cache.cache.clear()
+                return client.get(path, params=params)
+            return request
+
+        page = client.get("/activities", params={"limit": 100}).json()["items"]
+        ids = [item["id"] for item in page]
+        endpoints = {
+            "summary": uncached("/summary"),
+            "summary_cached": lambda: client.get("/summary"),
+            "summary_range": uncached("/summary", start_date="2021-03-15", end_date="2023-09-20"),
+            "activities": uncached("/activities", limit=100),
+            "activities_filtered": uncached(
+                "/activities", limit=100, category="Transport", start_date="2022-01-01", end_date="2022-12-31"),
+            "scenario": lambda: client.post(
+                "/scenario", json={"activity_id": rng.choice(ids), "new_quantity": 10.0, "new_type": "Energy"}),
+        }
+        for name, request in endpoints.items():
+            latencies = _latencies_ms(request, requests)
+            metrics[f"{name}_p50_ms"] = round(_percentile(latencies, 50), 3)
+            metrics[f"{name}_p95_ms"] = round(_percentile(latencies, 95), 3)
+
+    metrics["peak_rss_mb"] = round(ingest._peak_memory_mb(), 1)
+    return metrics
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print each metric next to the baseline's; returns the regressions, metrics more than
+    `threshold` (a fraction) worse than the baseline at the same ledger size (p95 latencies
+    are shown but never count).
+    """
+    regressions = []
+    print(f"{'size':>10}  {'metric':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for size, metrics in results["sizes"].items():
+        for name, value in metrics.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not before or value is None:
+                continue
+            change = (value - before) / before
+            worse = change if name.endswith(_LOWER_IS_BETTER) else -change
+            flag = "  REGRESSION" if worse > threshold and not name.endswith(_REPORTED_ONLY) else ""
+            if flag:
+                regressions.append((size, name, before, value))
+            print(f"{int(size):>10,}  {name:<32} {before:>12,.2f} {value:>12,.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def bench_suite(args):
+    """
+    Ingestion, classification and read endpoint latency over synthetic ledgers of each
+    size (training_data.csv patterns scaled up). Results are written as JSON and compared
+    with --baseline; the exit status is 1 if any metric regressed by more than --threshold.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "requests": args.requests,
+        "sizes": {},
+    }
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            # A fresh pool per size, so each size runs in its own process
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                metrics = pool.submit(_suite_size, n, directory, args.requests).result()
+        results["sizes"][str(n)] = metrics
+        for name, value in metrics.items():
+            print(f"{n:>10,}  {name:<32} {value:>14,.2f}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline} (commit {baseline.get('commit')}, {baseline.get('created_at')})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline}; rerun with --save-baseline to store one")
+
+
+def _report_latency(label, n, elapsed):
+    print(f"{label:<32} {n:>10,} rows  {elapsed * 1000:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoLedger performance benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    classify = sub.add_parser("classify", help="Classification throughput")
+    classify.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    classify.add_argument("--per-row-limit", type=int, default=100_000,
+                          help="Largest size for which the one-call-per-row baseline is also timed")
+    classify.set_defaults(func=bench_classify)
+
+    model = sub.add_parser("model", help="TF-IDF + LogisticRegression vs online HashingVectorizer + SGDClassifier")
+    model.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                       help="Training set sizes beyond training_data.csv itself")
+    model.set_defaults(func=bench_model)
+
+    aggregate = sub.add_parser("aggregate", help="/summary and /insights aggregation latency, before vs after")
+    aggregate.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    aggregate.set_defaults(func=bench_aggregate)
+
+    scenario = sub.add_parser("scenario", help="Batch scenario simulation throughput")
+    scenario.add_argument("--sizes", type=int, nargs="+", default=[1_000_000])
+    scenario.add_argument("--scenarios", type=int, default=200)
+    scenario.set_defaults(func=bench_scenario)
+
+    factors_ = sub.add_parser("factors", help="Emission factor resolution: per row vs batched registry lookups")
+    factors_.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    factors_.set_defaults(func=bench_factors)
+
+    recalc = sub.add_parser("recalc", help="Recalculation after emission factor edits, with a concurrent reader")
+    recalc.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    recalc.set_defaults(func=bench_recalc)
+
+    columnar_ = sub.add_parser("columnar", help="Date-range aggregation: ORM vs SQL vs memory-mapped columns")
+    columnar_.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    columnar_.set_defaults(func=bench_columnar)
+
+    insights = sub.add_parser("insights", help="/insights/ai coalescing and caching against a slow stub LLM")
+    insights.add_argument("--requests", type=int, default=20)
+    insights.add_argument("--latency", type=float, default=1.0, help="Seconds the stub LLM sleeps per call")
+    insights.set_defaults(func=bench_insights)
+
+    concurrency = sub.add_parser("concurrency", help="Concurrent uploads and dashboard reads against one database")
+    concurrency.add_argument("--url", help="Database URL (default: a scratch SQLite file)")
+    concurrency.add_argument("--writers", type=int, default=4)
+    concurrency.add_argument("--readers", type=int, default=8)
+    concurrency.add_argument("--uploads", type=int, default=2, help="Uploads per writer")
+    concurrency.add_argument("--rows", type=int, default=20_000, help="Rows per upload")
+    concurrency.add_argument("--batch-size", type=int, default=5_000)
+    concurrency.add_argument("--think", type=float, default=0.01, help="Seconds each reader waits between reads")
+    concurrency.add_argument("--baseline", action="store_true", help="Plain create_engine(url), no pool/WAL tuning")
+    concurrency.set_defaults(func=bench_concurrency)
+
+    http = sub.add_parser("http", help="Read latency under concurrent uploads against a uvicorn server")
+    http.add_argument("--rows", type=int, default=100_000, help="Rows in the ledger before the run")
+    http.add_argument("--duration", type=float, default=30)
+    http.add_argument("--readers", type=int, default=16, help="Concurrent dashboard clients")
+    http.add_argument("--upload-rows", type=int, default=20_000)
+    http.add_argument("--upload-interval", type=float, default=2.0, help="Seconds between uploads")
+    http.add_argument("--app-dir", default=SCRIPT_DIR, help="Backend checkout to serve")
+    http.set_defaults(func=bench_http)
+
+    startup = sub.add_parser("startup", help="Import time and first-request latency in a fresh process")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    suite = sub.add_parser("suite", help="Ingestion, classification and endpoint latency, compared with a baseline")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                       help="Ledger sizes (rows); the generator scales to 10,000,000")
+    suite.add_argument("--requests", type=int, default=50, help="Requests per endpoint and size")
+    suite.add_argument("--output", default="benchmark_results.json")
+    suite.add_argument("--baseline", default=os.path.join(SCRIPT_DIR, "benchmark_baseline.json"))
+    suite.add_argument("--threshold", type=float, default=0.25,
+                       help="Fraction by which a metric may be worse than the baseline before it fails the run")
+    suite.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Parameters per IN (...) lookup against the persistent tier (SQLite's default limit is 999)
+_SQLITE_CHUNK = 500
+
+
+def normalize_description(description):
+    """Case- and whitespace-insensitive cache key for a description."""
+    if description is None:
+        return ""
+    return " ".join(str(description).lower().split())
+
+
+def file_version(path):
+    """Short content hash of a model file, used as the model version in cache keys."""
+    if not path or not os.path.exists(path):
+        return "heuristic"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def purge_stale_entries(conn, model_version):
+    """Drop persisted results of every model version other than model_version."""
+    # A retrained model changes the version, so everything cached for older models is stale
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS classification_cache ("
+        " model_version TEXT NOT NULL,"
+        " description TEXT NOT NULL,"
+        " label TEXT NOT NULL,"
+        " probability REAL,"
+        " PRIMARY KEY (model_version, description))"
+    )
+    deleted = conn.execute("DELETE FROM classification_cache WHERE model_version != ?", (model_version,)).rowcount
+    conn.commit()
+    return deleted
+
+
+class ClassificationCache:
+    """
+    Bounded LRU cache of description -> (label, probability) for one model version,
+    with an optional SQLite tier that survives restarts.
+    Entries written by any other model version are purged when the persistent tier is opened.
+    """
+
+    def __init__(self, model_version, maxsize=100_000, persist_path=None):
+        self.model_version = model_version
+        self.maxsize = maxsize
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.persistent_hits = 0
+        self._conn = None
+        if persist_path:
+            self._open_persistent(persist_path)
+
+    def _open_persistent(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        purge_stale_entries(self._conn, self.model_version)
+
+    def get_many(self, keys):
+        """Return {key: (label, probability)} for cached keys; counts hits and misses."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+
+            missing = [k for k in keys if k not in found]
+            if missing and self._conn is not None:
+                stored = self._load_persistent(missing)
+                self.persistent_hits += len(stored)
+                for key, value in stored.items():
+                    self._remember(key, value)
+                found.update(stored)
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, values, model_version=None):
+        """
+        Cache {key: (label, probability)} in memory and, if enabled, on disk.
+        Results of another model version than the current one (computed while a new
+        model was swapped in) are dropped.
+        """
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            for key, value in values.items():
+                self._remember(key, value)
+            if self._conn is not None and values:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO classification_cache (model_version, description, label, probability)"
+                    " VALUES (?, ?, ?, ?)",
+                    [(self.model_version, key, label, proba) for key, (label, proba) in values.items()],
+                )
+                self._conn.commit()
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_persistent(self, keys):
+        stored = {}
+        for i in range(0, len(keys), _SQLITE_CHUNK):
+            chunk = keys[i:i + _SQLITE_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT description, label, probability FROM classification_cache"
+                f" WHERE model_version = ? AND description IN ({placeholders})",
+                [self.model_version, *chunk],
+            )
+            for description, label, proba in rows:
+                stored[description] = (label, proba)
+        return stored
+
+    def reset(self, model_version):
+        """Switch to another model version, dropping everything cached for the old one."""
+        with self._lock:
+            self.model_version = model_version
+            self._entries.clear()
+            if self._conn is not None:
+                purge_stale_entries(self._conn, model_version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM classification_cache")
+                self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model_version": self.model_version,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "persistent_hits": self.persistent_hits,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "persistent": self._conn is not None,
+            }
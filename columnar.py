@@ -0,0 +1,510 @@
+"""
+Append-only columnar snapshot of the `activities` table for analytics.
+
+Each column is a flat binary file of fixed-width values that readers open with np.memmap,
+so scanning a million-row ledger touches a few tens of MB of pages instead of building
+a million ORM objects:
+
+    id, date (int64 epoch seconds, NaT for missing), quantity, co2e (float64),
+    category, unit, confidence, region (int32 codes into the dictionaries in manifest.json)
+
+New activities are appended after each upload (`sync`); rows are only visible to readers
+once manifest.json records the new row count, and the manifest is replaced atomically.
+Ids are not committed in ascending order (concurrent ingestion jobs on PostgreSQL draw
+theirs from one sequence), so appending only ids above the last one seen could miss a
+batch that commits late. Each sync therefore also compares the number of rows up to that
+id with the snapshot and appends any missing ids, and readers decide whether to sync by
+the ledger version, which is bumped in commit order (see rollups.py).
+Deletes and changes of date, quantity or unit cannot be patched, so they mark the snapshot
+stale and the next sync rebuilds it into a fresh generation directory (readers of the old
+one are unaffected). co2e, confidence and category updates (factor recalculation, category
+corrections) are instead patched into a copy of the current generation (`patch`), which
+costs a file copy rather than a rebuild.
+
+The API imports this module at startup for its session hooks, so NumPy is only imported
+inside the functions that read or write columns.
+"""
+import asyncio
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+import database, models, rollups
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on the in-process lock only
+    fcntl = None
+
+STORE_DIR = os.getenv("COLUMNAR_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "columnar"))
+ENABLED = os.getenv("COLUMNAR_STORE", "1") == "1"
+SYNC_CHUNK = 100_000
+GAP_WINDOW = 100_000  # ids below the last one first searched for late commits; widened as needed
+IN_CHUNK = 5000  # ids per IN (...) when fetching late commits (SQLite caps bound parameters)
+
+NAT = -2 ** 63  # NumPy's NaT as int64 (np.iinfo(np.int64).min)
+
+COLUMNS = {
+    "id": "int64",
+    "date": "int64",
+    "quantity": "float64",
+    "co2e": "float64",
+    "category": "int32",
+    "unit": "int32",
+    "confidence": "int32",
+    "region": "int32",
+}
+DICTIONARY_COLUMNS = {
+    "category": "activity_type", "unit": "unit", "confidence": "confidence_score", "region": "region",
+}
+# Activity attributes an ORM update can change in place (see `patch`); others force a rebuild
+PATCHABLE_ATTRIBUTES = ("co2e", "confidence_score", "activity_type")
+UNPATCHABLE_ATTRIBUTES = ("date", "quantity", "unit", "region")
+
+activities = models.Activity.__table__
+
+_local_lock = threading.Lock()
+_cached = None  # (generation, rows) -> Snapshot
+
+
+def _manifest_path():
+    return os.path.join(STORE_DIR, "manifest.json")
+
+
+def _stale_path():
+    return os.path.join(STORE_DIR, "STALE")
+
+
+def _read_manifest():
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(manifest):
+    tmp = _manifest_path() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_path())
+
+
+@contextmanager
+def _writer_lock():
+    """Serialize writers across threads and worker processes."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with _local_lock:
+        with open(os.path.join(STORE_DIR, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mark_stale():
+    """Force the next sync to rebuild (after updates or deletes of existing activities)."""
+    if not ENABLED:
+        return
+    os.makedirs(STORE_DIR, exist_ok=True)
+    # A fresh token each time, so a rebuild only clears the marker it started from
+    with open(_stale_path(), "w") as f:
+        f.write(uuid.uuid4().hex)
+
+
+def _stale_token():
+    try:
+        with open(_stale_path()) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _publish(manifest, stale_token=None):
+    """
+    Swap in `manifest`, then clear the STALE marker the rebuild started from (unless it was
+    marked stale again meanwhile) and drop old generations. The one before the new
+    generation is kept: a reader may have just read its manifest and not opened it yet.
+    """
+    _write_manifest(manifest)
+    if stale_token is not None and _stale_token() == stale_token:
+        os.remove(_stale_path())
+    for name in os.listdir(STORE_DIR):
+        if name.startswith("gen-") and name[4:].isdigit() and int(name[4:]) < manifest["generation"] - 1:
+            shutil.rmtree(os.path.join(STORE_DIR, name), ignore_errors=True)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_rewrites(session, flush_context):
+    for obj in session.deleted:
+        if isinstance(obj, models.Activity):
+            session.info["columnar_stale"] = True
+            return
+    for obj in session.dirty:
+        if not isinstance(obj, models.Activity) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        if any(state.attrs[a].history.has_changes() for a in UNPATCHABLE_ATTRIBUTES):
+            session.info["columnar_stale"] = True
+            return
+        if any(state.attrs[a].history.has_changes() for a in PATCHABLE_ATTRIBUTES):
+            session.info.setdefault("columnar_patch", {})[obj.id] = (
+                obj.co2e or 0.0, obj.confidence_score, obj.activity_type
+            )
+
+
+def _is_async(db):
+    """True for the sync facade of an AsyncSession: its I/O is awaited on the event loop."""
+    return db.get_bind().dialect.is_async
+
+
+def _apply_rewrites(stale, patches):
+    if stale:
+        mark_stale()
+        return
+    try:
+        patch(list(patches), *zip(*patches.values()))
+    except Exception as e:
+        print(f"Columnar patch failed, rebuilding on the next sync: {e}")
+        mark_stale()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_rewrites_on_commit(session):
+    # Only once committed, so a concurrent sync cannot rebuild from pre-commit rows
+    patches = session.info.pop("columnar_patch", None)
+    stale = session.info.pop("columnar_stale", False)
+    if not stale and not patches:
+        return
+    if _is_async(session):
+        # The writer lock must never be taken on the event loop; `settle` awaits the result
+        loop = asyncio.get_running_loop()
+        session.info["columnar_apply"] = loop.run_in_executor(None, _apply_rewrites, stale, patches)
+    else:
+        _apply_rewrites(stale, patches)
+
+
+async def settle(session):
+    """Wait until the rewrites an AsyncSession committed have reached the snapshot."""
+    pending = session.sync_session.info.pop("columnar_apply", None)
+    if pending is not None:
+        await pending
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rewrites(session):
+    session.info.pop("columnar_stale", None)
+    session.info.pop("columnar_patch", None)
+
+
+def _encode(values, dictionary, index):
+    import numpy as np
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(dictionary)
+            dictionary.append(value)
+        codes[i] = code
+    return codes
+
+
+def _current_format(manifest):
+    """False for a snapshot written before a column was added; it is rebuilt."""
+    return set(manifest["dictionaries"]) == set(DICTIONARY_COLUMNS)
+
+
+def _new_generation(previous):
+    generation = (previous["generation"] + 1) if previous else 1
+    directory = os.path.join(STORE_DIR, f"gen-{generation}")
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    return {
+        "generation": generation,
+        "rows": 0,
+        "last_id": 0,
+        "ledger_version": None,
+        "dictionaries": {name: [] for name in DICTIONARY_COLUMNS},
+    }
+
+
+def _append(conn, stmt, manifest, directory, publish):
+    """Stream the rows `stmt` selects onto the end of the columns; returns how many were appended."""
+    import numpy as np
+    dictionaries = manifest["dictionaries"]
+    indexes = {name: {v: i for i, v in enumerate(values)} for name, values in dictionaries.items()}
+    appended = 0
+    result = conn.execution_options(stream_results=True).execute(stmt)
+    for rows in result.partitions(SYNC_CHUNK):
+        n = len(rows)
+        ids, dates, quantities, co2es, categories, units, confidences, regions = zip(*rows)
+        arrays = {
+            "id": np.array(ids, dtype=np.int64),
+            "date": np.array(dates, dtype="datetime64[s]").astype(np.int64),
+            "quantity": np.fromiter((q or 0.0 for q in quantities), dtype=np.float64, count=n),
+            "co2e": np.fromiter((c or 0.0 for c in co2es), dtype=np.float64, count=n),
+            "category": _encode(categories, dictionaries["category"], indexes["category"]),
+            "unit": _encode(units, dictionaries["unit"], indexes["unit"]),
+            "confidence": _encode(confidences, dictionaries["confidence"], indexes["confidence"]),
+            "region": _encode(regions, dictionaries["region"], indexes["region"]),
+        }
+        # Truncate anything a crashed writer appended past the committed row count
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(directory, f"{name}.bin")
+            with open(path, "ab") as f:
+                f.truncate(manifest["rows"] * np.dtype(dtype).itemsize)
+                f.write(arrays[name].astype(dtype, copy=False).tobytes())
+        manifest["rows"] += n
+        manifest["last_id"] = max(manifest["last_id"], int(arrays["id"].max()))
+        appended += n
+        if publish:
+            _write_manifest(manifest)  # publish appended rows chunk by chunk
+    return appended
+
+
+def _missing_ids(conn, manifest, directory):
+    """
+    ids up to last_id that are in `activities` but not in the snapshot: rows committed after
+    a sync had already moved past their ids. None if the snapshot holds rows the table lost.
+    """
+    import numpy as np
+    last_id = manifest["last_id"]
+    missing = conn.execute(select(func.count()).where(activities.c.id <= last_id)).scalar() - manifest["rows"]
+    if missing <= 0:
+        return None if missing < 0 else []
+
+    # Late commits are almost always recent: look just below last_id first, then widen
+    present = np.sort(np.fromfile(os.path.join(directory, "id.bin"), dtype=np.int64, count=manifest["rows"]))
+    window = GAP_WINDOW
+    while True:
+        low = max(last_id - window, 0)
+        in_window = conn.execute(
+            select(func.count()).where(activities.c.id > low, activities.c.id <= last_id)
+        ).scalar()
+        if low == 0 or in_window - (len(present) - np.searchsorted(present, low, side="right")) >= missing:
+            break
+        window *= 4
+    ids = np.fromiter(
+        conn.execute(select(activities.c.id).where(activities.c.id > low, activities.c.id <= last_id)).scalars(),
+        dtype=np.int64,
+    )
+    return np.setdiff1d(ids, present).tolist()
+
+
+def sync(engine):
+    """
+    Append activities added since the last sync, including late commits of ids below the
+    last one seen (or rebuild if the snapshot is stale).
+    """
+    if not ENABLED:
+        return None
+    with _writer_lock():
+        manifest = _sync_locked(engine)
+        if manifest is None:
+            # The table lost rows behind the session hooks' back: start over
+            mark_stale()
+            manifest = _sync_locked(engine, rebuilt=True)
+        return manifest
+
+
+def _sync_locked(engine, rebuilt=False):
+    manifest = _read_manifest()
+    stale_token = _stale_token()
+    rebuilding = manifest is None or stale_token is not None or not _current_format(manifest)
+    if rebuilding:
+        # The STALE marker stays until the new generation is published: readers keep
+        # treating the old one as behind rather than current
+        manifest = _new_generation(manifest)
+
+    directory = os.path.join(STORE_DIR, f"gen-{manifest['generation']}")
+    columns = (
+        activities.c.id, activities.c.date, activities.c.quantity, activities.c.co2e,
+        activities.c.activity_type, activities.c.unit, activities.c.confidence_score, activities.c.region,
+    )
+    with engine.connect() as conn:
+        # Read first: anything committed after this bumps the version and triggers another sync
+        ledger_version = rollups.current_version(conn)
+        stmt = select(*columns).where(activities.c.id > manifest["last_id"]).order_by(activities.c.id)
+        _append(conn, stmt, manifest, directory, publish=not rebuilding)
+
+        missing = _missing_ids(conn, manifest, directory)
+        if missing is None:
+            if not rebuilt:
+                return None
+            missing = []  # a delete raced the rebuild; its after-commit hook marks the snapshot stale
+        for start in range(0, len(missing), IN_CHUNK):
+            stmt = select(*columns).where(activities.c.id.in_(missing[start:start + IN_CHUNK]))
+            _append(conn, stmt.order_by(activities.c.id), manifest, directory, publish=False)
+
+    manifest["ledger_version"] = ledger_version
+    _publish(manifest, stale_token)
+    return manifest
+
+
+def patch(ids, co2e, confidence, category=None):
+    """
+    Apply co2e / confidence (and optionally category) updates of existing activities without
+    a rebuild: the current generation's columns are copied into a new generation, the updated
+    rows are overwritten there, and the copy is published with one manifest write. Activities
+    the snapshot does not hold yet get their new values when the next sync appends them.
+    """
+    import numpy as np
+    if not ENABLED or not len(ids):
+        return
+    with _writer_lock():
+        manifest = _read_manifest()
+        if manifest is None or os.path.exists(_stale_path()):
+            return  # the next sync rebuilds from the database anyway
+
+        previous = os.path.join(STORE_DIR, f"gen-{manifest['generation']}")
+        manifest["generation"] += 1
+        directory = os.path.join(STORE_DIR, f"gen-{manifest['generation']}")
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        rows = manifest["rows"]
+        snapshot_ids = np.fromfile(os.path.join(previous, "id.bin"), dtype=np.int64, count=rows)
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(snapshot_ids, kind="stable")  # ascending except for late commits: near-linear
+        positions = np.searchsorted(snapshot_ids[order], ids)
+        present = positions < rows
+        present[present] = snapshot_ids[order[positions[present]]] == ids[present]
+        positions = order[positions[present]]
+        updates = {"co2e": np.asarray(co2e, dtype=np.float64)[present]}
+        for name, values in (("confidence", confidence), ("category", category)):
+            if values is not None:
+                dictionary = manifest["dictionaries"][name]
+                updates[name] = _encode(
+                    np.asarray(values, dtype=object)[present], dictionary, {v: i for i, v in enumerate(dictionary)}
+                )
+
+        for name, dtype in COLUMNS.items():
+            # Only the committed rows are copied; anything past them is from a crashed writer
+            values = np.fromfile(os.path.join(previous, f"{name}.bin"), dtype=dtype, count=rows)
+            if name in updates:
+                values[positions] = updates[name]
+            values.tofile(os.path.join(directory, f"{name}.bin"))
+
+        _publish(manifest)
+
+
+class Snapshot:
+    """Read-only memory-mapped view of the committed rows of one generation."""
+
+    def __init__(self, manifest):
+        import numpy as np
+        self.rows = manifest["rows"]
+        self.generation = manifest["generation"]
+        self.dictionaries = manifest["dictionaries"]
+        directory = os.path.join(STORE_DIR, f"gen-{self.generation}")
+        for name, dtype in COLUMNS.items():
+            if self.rows:
+                array = np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r", shape=(self.rows,))
+            else:
+                array = np.empty(0, dtype=dtype)
+            setattr(self, name, array)
+
+    @property
+    def categories(self):
+        return self.dictionaries["category"]
+
+    def dates(self):
+        return self.date.view("datetime64[s]")
+
+    def date_mask(self, start=None, end=None):
+        import numpy as np
+        mask = self.date != NAT
+        if start is not None:
+            mask &= self.dates() >= np.datetime64(start, "s")
+        if end is not None:
+            mask &= self.dates() < np.datetime64(end, "s")
+        return mask
+
+    def category_totals(self, start=None, end=None):
+        """[(activity_type, total_co2e)] largest first, like analytics.category_totals."""
+        import numpy as np
+        codes, co2e = self.category, self.co2e
+        if start is not None or end is not None:
+            mask = self.date_mask(start, end)
+            codes, co2e = codes[mask], co2e[mask]
+        totals = np.bincount(codes, weights=co2e, minlength=len(self.categories))
+        present = np.bincount(codes, minlength=len(self.categories)) > 0
+        rows = [(self.categories[i], float(totals[i])) for i in np.flatnonzero(present)]
+        return sorted(rows, key=lambda r: r[1], reverse=True)
+
+    def monthly_totals(self, start=None, end=None):
+        """[(YYYY-MM, total_co2e)] in chronological order."""
+        import numpy as np
+        mask = self.date_mask(start, end)
+        months = self.dates()[mask].astype("datetime64[M]")
+        if not len(months):
+            return []
+        offsets = months.astype(np.int64)
+        base = offsets.min()
+        totals = np.bincount(offsets - base, weights=self.co2e[mask])
+        present = np.bincount(offsets - base) > 0
+        return [
+            (str(np.datetime64(int(base + i), "M")), float(totals[i]))
+            for i in np.flatnonzero(present)
+        ]
+
+    def top_ids(self, limit, start=None, end=None):
+        """ids of the `limit` largest co2e values in the date range, largest first."""
+        import numpy as np
+        positions = np.flatnonzero(self.date_mask(start, end))
+        co2e = self.co2e[positions]
+        if len(positions) > limit:
+            top = np.argpartition(-co2e, limit - 1)[:limit]
+            positions, co2e = positions[top], co2e[top]
+        return self.id[positions[np.argsort(-co2e, kind="stable")]].tolist()
+
+
+def snapshot(db):
+    """
+    The current snapshot, catching up with `activities` first if it is behind.
+    Returns None when the store is disabled, and for an AsyncSession whose snapshot is
+    behind: catching up takes the writer lock, which must not block the event loop, so
+    async endpoints call `refresh` in a thread first and fall back to SQL if a write
+    landed in between.
+    """
+    global _cached
+    if not ENABLED:
+        return None
+
+    manifest = _read_manifest()
+    behind = manifest is None or os.path.exists(_stale_path()) or not _current_format(manifest)
+    if not behind:
+        behind = rollups.current_version(db) != manifest.get("ledger_version")
+    if behind:
+        if _is_async(db):
+            return None
+        manifest = sync(db.get_bind())
+
+    key = (manifest["generation"], manifest["rows"])
+    cached = _cached
+    if cached is None or cached[0] != key:
+        try:
+            opened = Snapshot(manifest)
+        except FileNotFoundError:
+            # Two publishes since the manifest was read removed its generation: take the latest
+            manifest = _read_manifest()
+            key, opened = (manifest["generation"], manifest["rows"]), Snapshot(manifest)
+        cached = _cached = (key, opened)
+    return cached[1]
+
+
+def refresh(engine=database.engine):
+    """Catch the snapshot up with `activities` (blocking; async callers run it in a thread)."""
+    if not ENABLED:
+        return
+    with Session(engine) as db:
+        snapshot(db)
@@ -0,0 +1,309 @@
+"""
+Emission-factor registry keyed by (category, unit, region, year).
+
+Factors are read from emission_factors.csv (FACTORS_PATH) and unit conversions from
+unit_conversions.csv (UNIT_CONVERSIONS_PATH), once per process, into parallel NumPy
+columns plus a dict index. resolve() matches a whole batch of activities at once: the
+distinct (category, unit, region, year) combinations are looked up and the result is
+gathered back onto the rows, so a batch costs one pass to number the keys plus one
+lookup per distinct combination (and those are memoized across batches).
+
+An activity is matched to its category's factor for the activity's unit, converting the
+quantity when the conversion table knows the unit (miles -> km, MWh -> kWh, ...), in the
+activity's region (falling back to GLOBAL), for the latest factor year not after the
+activity's year (the earliest year for older activities). Unknown categories use the
+Procurement factors, and a unit with no factor falls back to the category's first-listed
+unit, which is how the original four factors were applied.
+
+Each factor has a version, a hash of its value, source and confidence, which activities
+record next to their factor_key so recalculate.py can find rows computed with an outdated
+factor. Formulas and calculation notes are not stored per activity; explain() derives
+them from the activity's factor_key when /explain asks.
+"""
+import bisect
+import csv
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FACTORS_PATH = os.getenv("FACTORS_PATH", os.path.join(SCRIPT_DIR, "emission_factors.csv"))
+UNIT_CONVERSIONS_PATH = os.getenv("UNIT_CONVERSIONS_PATH", os.path.join(SCRIPT_DIR, "unit_conversions.csv"))
+
+GLOBAL_REGION = "GLOBAL"
+DEFAULT_REGION = os.getenv("FACTOR_REGION", GLOBAL_REGION)  # for activities without a region
+FALLBACK_CATEGORY = "Procurement"
+
+FACTOR_HEADERS = ["category", "unit", "region", "year", "factor", "source", "confidence"]
+
+
+def unit_key(unit):
+    """Case- and whitespace-insensitive form of a unit name ('KWH ' and 'kWh' match)."""
+    return (unit or "").strip().lower()
+
+
+def factor_key(category, unit, region, year):
+    return f"{category}|{unit}|{region}|{year}"
+
+
+def factor_version(factor, source, confidence):
+    return hashlib.sha1(f"{float(factor)!r}|{source}|{confidence}".encode()).hexdigest()[:12]
+
+
+class FactorRegistry:
+    """All factors as parallel arrays (one entry per factor) plus the index used to match them."""
+
+    def __init__(self, factors, conversions=(), version=None):
+        """
+        factors: dicts with the FACTOR_HEADERS fields; conversions: (unit, to_unit, multiplier).
+        """
+        self.version = version
+        n = len(factors)
+        self.keys = np.empty(n, dtype=object)
+        self.category = np.empty(n, dtype=object)
+        self.unit = np.empty(n, dtype=object)
+        self.region = np.empty(n, dtype=object)
+        self.year = np.empty(n, dtype=np.int32)
+        self.factor = np.empty(n, dtype=np.float64)
+        self.source = np.empty(n, dtype=object)
+        self.confidence = np.empty(n, dtype=object)
+        self.versions = np.empty(n, dtype=object)  # changes whenever the factor's value, source or confidence does
+
+        self._index = {}  # factor key -> position
+        self._units = {}  # category -> unit keys, in file order (the first is the fallback)
+        self._regions = {}  # (category, unit key) -> regions, in file order
+        series = {}  # (category, unit key, region) -> [(year, position)]
+        strings = {}  # shared str objects, so repeated names are stored once
+
+        for i, row in enumerate(factors):
+            category, unit, region, source, confidence = (
+                strings.setdefault(row[name], row[name]) for name in ("category", "unit", "region", "source", "confidence")
+            )
+            year = int(row["year"])
+            key = factor_key(category, unit, region, year)
+            if key in self._index:
+                raise ValueError(f"Duplicate emission factor {key}")
+            self._index[key] = i
+            self.keys[i] = key
+            self.category[i], self.unit[i], self.region[i] = category, unit, region
+            self.year[i] = year
+            self.factor[i] = float(row["factor"])
+            self.source[i], self.confidence[i] = source, confidence
+            self.versions[i] = factor_version(self.factor[i], source, confidence)
+
+            u = unit_key(unit)
+            units = self._units.setdefault(category, [])
+            if u not in units:
+                units.append(u)
+            regions = self._regions.setdefault((category, u), [])
+            if region not in regions:
+                regions.append(region)
+            series.setdefault((category, u, region), []).append((year, i))
+
+        if FALLBACK_CATEGORY not in self._units:
+            raise ValueError(f"The factor registry needs at least one {FALLBACK_CATEGORY} factor")
+
+        self._series = {}
+        for key, entries in series.items():
+            entries.sort()
+            self._series[key] = ([y for y, _ in entries], [i for _, i in entries])
+
+        # unit key -> {to unit key: multiplier}; each conversion also works in reverse
+        self._conversions = {}
+        self._conversion_entries = {}  # "unit->to_unit" -> multiplier, as listed in the file
+        for unit, to_unit, multiplier in conversions:
+            multiplier = float(multiplier)
+            self._conversion_entries[f"{unit_key(unit)}->{unit_key(to_unit)}"] = repr(multiplier)
+            self._conversions.setdefault(unit_key(unit), {})[unit_key(to_unit)] = multiplier
+            self._conversions.setdefault(unit_key(to_unit), {}).setdefault(unit_key(unit), 1.0 / multiplier)
+
+        self._memo = {}  # (category, unit, region, year) -> (position, multiplier)
+
+    def __len__(self):
+        return len(self.factor)
+
+    @classmethod
+    def load(cls, factors_path=FACTORS_PATH, conversions_path=UNIT_CONVERSIONS_PATH):
+        digest = hashlib.sha256()
+        with open(factors_path, "rb") as f:
+            data = f.read()
+        digest.update(data)
+        reader = csv.DictReader(data.decode("utf-8-sig").splitlines())
+        missing = set(FACTOR_HEADERS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"{factors_path} is missing columns: {', '.join(sorted(missing))}")
+        factors = list(reader)
+
+        conversions = []
+        if conversions_path and os.path.exists(conversions_path):
+            with open(conversions_path, "rb") as f:
+                data = f.read()
+            digest.update(data)
+            conversions = [
+                (row["unit"], row["to_unit"], row["multiplier"])
+                for row in csv.DictReader(data.decode("utf-8-sig").splitlines())
+            ]
+        return cls(factors, conversions, version=digest.hexdigest()[:12])
+
+    def state(self):
+        """
+        {factor key: version} plus {"unit->to_unit": multiplier} for each unit conversion;
+        recalculate.py diffs this against the state the ledger was last reconciled with.
+        """
+        state = dict(zip(self.keys.tolist(), self.versions.tolist()))
+        state.update(self._conversion_entries)
+        return state
+
+    def categories_with_unit(self, unit):
+        u = unit_key(unit)
+        return {category for category, units in self._units.items() if u in units}
+
+    def index_of(self, key):
+        """Position of the factor with this key, or None if the registry no longer has it."""
+        return self._index.get(key)
+
+    def conversion(self, unit, to_unit):
+        """Multiplier from `unit` to `to_unit`, or None if the units cannot be converted."""
+        u, to = unit_key(unit), unit_key(to_unit)
+        if u == to:
+            return 1.0
+        return self._conversions.get(u, {}).get(to)
+
+    def lookup(self, category, unit, region=None, year=None):
+        """(factor position, unit multiplier) for a single activity."""
+        memo_key = (category, unit, region, year)
+        found = self._memo.get(memo_key)
+        if found is None:
+            found = self._memo[memo_key] = self._lookup(category, unit, region or DEFAULT_REGION, year)
+        return found
+
+    def _lookup(self, category, unit, region, year):
+        if category not in self._units:
+            category = FALLBACK_CATEGORY
+        units = self._units[category]
+
+        u = unit_key(unit)
+        target, multiplier = units[0], 1.0
+        if u in units:
+            target = u
+        else:
+            for to, m in self._conversions.get(u, {}).items():
+                if to in units:
+                    target, multiplier = to, m
+                    break
+
+        for candidate in (region, GLOBAL_REGION, self._regions[(category, target)][0]):
+            series = self._series.get((category, target, candidate))
+            if series is not None:
+                break
+        years, positions = series
+        pos = len(years) - 1 if year is None else max(bisect.bisect_right(years, year) - 1, 0)
+        return positions[pos], multiplier
+
+    def resolve(self, categories, units, years=None, regions=None):
+        """
+        Match a batch of activities to factors.
+        Returns (index, multiplier) arrays: each activity's factor position and the
+        conversion from the activity's unit to that factor's unit.
+        """
+        n = len(categories)
+        if regions is None:
+            regions = [None] * n
+        if years is None:
+            years = [None] * n
+
+        # Hash join: number the distinct (category, unit, region, year) keys, look each one
+        # up once, then gather the results back onto the rows with one fancy-index per column
+        distinct = {}
+        codes = np.fromiter(
+            (distinct.setdefault(key, len(distinct)) for key in zip(categories, units, regions, years)),
+            dtype=np.int64, count=n,
+        )
+        found = [self.lookup(*key) for key in distinct]
+        index = np.fromiter((i for i, _ in found), dtype=np.int64, count=len(found))
+        multiplier = np.fromiter((m for _, m in found), dtype=np.float64, count=len(found))
+        return index[codes], multiplier[codes]
+
+    def co2e(self, quantity, index, multiplier):
+        """kg CO2e for quantities in the activities' own units."""
+        return np.asarray(quantity, dtype=np.float64) * multiplier * self.factor[index]
+
+    def default_index(self, category):
+        """The factor used for `category` when nothing else is known about an activity."""
+        return self.lookup(category, None)[0]
+
+    def explain(self, activity):
+        """
+        The calculation behind an activity's co2e, as EmissionDetailResponse fields.
+        Uses the factor recorded at ingest (activity.factor_key) when the registry still has it.
+        """
+        year = activity.date.year if activity.date else None
+        notes = []
+        i = self.index_of(activity.factor_key) if activity.factor_key else None
+        if i is None:
+            if activity.factor_key:
+                notes.append(f"factor {activity.factor_key} is no longer in the registry; showing the current match")
+            i, _ = self.lookup(activity.activity_type, activity.unit, activity.region, year)
+        elif activity.factor_version and activity.factor_version != self.versions[i]:
+            notes.append("the factor has changed since co2e was computed; it is updated by the next recalculation unless its period is closed")
+
+        quantity = activity.quantity
+        factor, factor_unit = float(self.factor[i]), self.unit[i]
+        multiplier = self.conversion(activity.unit, factor_unit)
+        if multiplier is None:
+            notes.append(f"no conversion from {activity.unit!r} to {factor_unit}; quantity applied as {factor_unit}")
+            multiplier = 1.0
+
+        if multiplier == 1.0:
+            formula = f"CO2e = {quantity} {factor_unit} * {factor} kg CO2e/{factor_unit}"
+        else:
+            formula = (
+                f"CO2e = {quantity} {activity.unit} * {multiplier:g} {factor_unit}/{activity.unit}"
+                f" * {factor} kg CO2e/{factor_unit}"
+            )
+        notes.insert(0, f"Calculated for {quantity} {activity.unit} with the {self.region[i]} {self.year[i]} factor")
+        return {
+            "emission_factor": factor,
+            "factor_source": self.source[i],
+            "formula": formula,
+            "calculation_notes": "; ".join(notes),
+            "unit_applied": f"kg/{factor_unit}",
+        }
+
+
+_registry = None
+_registry_stamp = None  # modification times of the files _registry was loaded from
+_registry_lock = threading.Lock()
+
+
+def _stamp():
+    return tuple(
+        os.stat(path).st_mtime_ns if path and os.path.exists(path) else None
+        for path in (FACTORS_PATH, UNIT_CONVERSIONS_PATH)
+    )
+
+
+def get_registry():
+    """
+    The process-wide registry, loaded on first use and reloaded when either file changes,
+    so ingestion workers pick up edited factors without a restart.
+    """
+    global _registry, _registry_stamp
+    stamp = _stamp()
+    if _registry is None or stamp != _registry_stamp:
+        with _registry_lock:
+            if _registry is None or stamp != _registry_stamp:
+                _registry = FactorRegistry.load()
+                _registry_stamp = stamp
+    return _registry
+
+
+def reload():
+    """Re-read the factor files now; returns the new registry."""
+    global _registry, _registry_stamp
+    with _registry_lock:
+        _registry_stamp = _stamp()
+        _registry = FactorRegistry.load()
+    return _registry
@@ -0,0 +1,372 @@
+import codecs
+import csv
+import hashlib
+import io
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import exc, select, text
+from sqlalchemy.dialects import sqlite
+
+import metrics, models, periods, rollups, utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Bytes read from the upload per decode step, and rows classified/inserted together
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 5000
+
+REQUIRED_HEADERS = {'description', 'quantity', 'unit'}
+
+
+class IngestError(ValueError):
+    """Raised when the uploaded CSV cannot be ingested at all (bad headers, no rows)."""
+
+
+def iter_lines(stream, chunk_size=CHUNK_SIZE, encoding='utf-8-sig'):
+    """
+    Decode a binary file object chunk by chunk and yield text lines (with line endings).
+    Only one chunk plus one partial line is held in memory at a time.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _peak_memory_mb():
+    """Process-wide peak resident set size in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class RowRejected(ValueError):
+    """Raised by parse_row for a row that cannot be ingested; the message is the reason."""
+
+
+def row_hash(description, quantity, unit, date_obj):
+    """
+    Content hash of a ledger row: date, description, quantity and unit, so the same row
+    in a re-uploaded or overlapping export matches what is already stored. A row without a
+    date is hashed with the ingest day it is stored with: a recurring charge uploaded again
+    next month is a new row, and only a same-day re-upload is a duplicate.
+    """
+    content = "\x1f".join((
+        f"{date_obj:%Y-%m-%d}" if date_obj else "",
+        (description or "").strip(),
+        repr(float(quantity or 0.0)),
+        (unit or "").strip(),
+    ))
+    return hashlib.sha1(content.encode()).hexdigest()[:20]
+
+
+def parse_row(row, header_map, today, open_from=None):
+    """
+    Map a raw CSV row onto (description, quantity, unit, date, region, row_hash).
+    Rows dated before `open_from` fall in a closed period (see periods.py) and are rejected.
+    """
+    description = row.get(header_map.get('description'))
+    if description is None:
+        description = 'Unknown'  # short row
+
+    quantity_str = row.get(header_map.get('quantity'))
+    try:
+        quantity = float(quantity_str) if quantity_str else 0.0
+    except ValueError:
+        raise RowRejected(f"Invalid quantity {quantity_str!r}")
+
+    unit = row.get(header_map.get('unit'))
+    if unit is None:
+        unit = 'items'
+
+    # Handle date (optional)
+    date_key = header_map.get('date')
+    date_str = row.get(date_key) if date_key else None
+    try:
+        date_obj = datetime.strptime(date_str, '%Y-%m-%d') if date_str else today
+    except ValueError:
+        raise RowRejected(f"Invalid date {date_str!r} (expected YYYY-MM-DD)")
+    if open_from is not None and date_obj < open_from:
+        raise RowRejected(f"Period {date_obj:%Y-%m} is closed")
+
+    # Optional region column selects regional emission factors (see factors.py)
+    region_key = header_map.get('region')
+    region = (row.get(region_key) or '').strip() if region_key else ''
+
+    content_hash = row_hash(description, quantity, unit, date_obj)
+    return description, quantity, unit, date_obj, region or None, content_hash
+
+
+def open_reader(stream, chunk_size=CHUNK_SIZE):
+    """Start streaming a CSV upload; returns (reader, header_map) after validating headers."""
+    reader = csv.DictReader(iter_lines(stream, chunk_size))
+
+    # Validate CSV headers
+    if not reader.fieldnames:
+        raise IngestError("CSV file is empty or missing headers.")
+
+    # Create a map of normalized (lowercase) headers to actual headers
+    header_map = {h.lower().strip(): h for h in reader.fieldnames}
+    if not REQUIRED_HEADERS.issubset(header_map.keys()):
+        raise IngestError(f"Missing required headers (description, quantity, unit). Found: {reader.fieldnames}")
+    return reader, header_map
+
+
+def iter_batches(reader, header_map, batch_size=BATCH_SIZE, skip_rows=0, open_from=None):
+    """
+    Yield (parsed_rows, rejections, rows_consumed) for each batch of data rows.
+    rejections are (line_number, reason) pairs; the first `skip_rows` data rows are skipped
+    (used to resume a partially ingested file). Rows dated before `open_from` are rejected.
+
+    A row that appears k times in the file is numbered: its k-th copy carries the hash
+    suffixed with #k (k > 1), so it matches only the k-th copy already stored rather than
+    being dropped as a repeat of the first.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    occurrences = {}  # content hash -> copies seen so far in this file
+    parsed = []
+    rejections = []
+    consumed = 0
+    started = time.perf_counter()  # reading and parsing time of the current batch
+
+    for index, row in enumerate(reader):
+        if index < skip_rows:
+            # Already ingested, but its copies still count towards the numbering
+            try:
+                _number_copy(parse_row(row, header_map, today), occurrences)
+            except Exception:
+                pass
+            continue
+        consumed += 1
+        try:
+            parsed.append(_number_copy(parse_row(row, header_map, today, open_from), occurrences))
+        except Exception as row_error:
+            rejections.append((reader.line_num, str(row_error)))
+
+        if consumed >= batch_size:
+            metrics.observe("csv_parse", time.perf_counter() - started, consumed)
+            yield parsed, rejections, consumed
+            parsed, rejections, consumed = [], [], 0
+            started = time.perf_counter()
+
+    if consumed:
+        metrics.observe("csv_parse", time.perf_counter() - started, consumed)
+        yield parsed, rejections, consumed
+
+
+def _number_copy(parsed_row, occurrences):
+    *fields, content_hash = parsed_row
+    copy = occurrences[content_hash] = occurrences.get(content_hash, 0) + 1
+    return parsed_row if copy == 1 else (*fields, f"{content_hash}#{copy}")
+
+
+def prepare_batch(parsed):
+    """
+    Classify and compute one batch of parsed rows (CPU only, no database access).
+    Factors for the whole batch are resolved in one registry call; each row records its
+    factor_key, and the formula is only built if /explain asks for it.
+    Returns activity_rows ready for insert_batch.
+    """
+    import factors  # NumPy is loaded by the first batch rather than at API startup
+
+    descriptions, quantities, units, dates, regions, hashes = zip(*parsed)
+    with metrics.timed("classification", len(parsed)):
+        activity_types = utils.classify_activities(list(descriptions))
+
+    with metrics.timed("emission_compute", len(parsed)):
+        registry = factors.get_registry()
+        index, multiplier = registry.resolve(activity_types, units, [d.year for d in dates], regions)
+        co2e = registry.co2e(quantities, index, multiplier).tolist()
+        factor_keys = registry.keys[index].tolist()
+        factor_versions = registry.versions[index].tolist()
+        confidence = registry.confidence[index].tolist()
+
+    return [
+        {
+            "description": description,
+            "quantity": quantity,
+            "unit": unit,
+            "date": date_obj,
+            "activity_type": activity_type,
+            "co2e": row_co2e,
+            "confidence_score": row_confidence,
+            "region": region,
+            "factor_key": key,
+            "factor_version": version,
+            "row_hash": content_hash,
+        }
+        for description, quantity, unit, date_obj, region, activity_type, row_co2e, row_confidence, key, version,
+        content_hash in zip(descriptions, quantities, units, dates, regions, activity_types, co2e, confidence,
+                            factor_keys, factor_versions, hashes)
+    ]
+
+
+def existing_hashes(db, hashes):
+    """The subset of `hashes` already in the ledger, found with one IN lookup on the unique index."""
+    if not hashes:
+        return set()
+    column = models.Activity.row_hash
+    return set(db.execute(select(column).where(column.in_(list(hashes)))).scalars())
+
+
+def drop_duplicates(db, parsed):
+    """
+    The parsed rows whose content is not in the ledger yet, in file order. Copies of a row
+    repeated within the file carry numbered hashes (see iter_batches), so each is kept
+    unless its own copy is stored. This runs before classification, so a re-uploaded
+    batch costs one hash lookup.
+    """
+    with metrics.timed("dedup_lookup", len(parsed)):
+        known = existing_hashes(db, {row[-1] for row in parsed})
+    fresh = []
+    for row in parsed:
+        if row[-1] not in known:
+            known.add(row[-1])
+            fresh.append(row)
+    return fresh
+
+
+def _reserve_ids(conn, table, n):
+    """Draw n ids, in order, from the serial sequence behind table.id (PostgreSQL)."""
+    return conn.execute(
+        text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+        {"table": table.name, "n": n},
+    ).scalars().all()
+
+
+def _copy_field(value):
+    # COPY csv: an unquoted empty field is NULL, so every string is quoted (even an empty one)
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def copy_rows(conn, table, rows):
+    """COPY a list of dicts into `table` over the session's own DBAPI connection (psycopg2 or psycopg 3)."""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(_copy_field(row[c]) for c in columns))
+        buffer.write("\n")
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def insert_batch(db, activity_rows):
+    """
+    Bulk insert a prepared batch and fold it into the rollups; returns the rows inserted.
+    Activity IDs come back from a single INSERT ... RETURNING, so there is no per-row flush.
+    On PostgreSQL the IDs are reserved from the sequence up front and the rows are loaded
+    with COPY instead.
+
+    Rows should already have passed drop_duplicates. If another upload commits the same
+    content in the meantime, the unique row_hash index rejects the copies: SQLite skips
+    them with ON CONFLICT DO NOTHING, and on PostgreSQL the COPY is rolled back to a
+    savepoint and retried without the rows that are now stored.
+    """
+    if not activity_rows:
+        return 0
+    with metrics.timed("db_write", len(activity_rows)):
+        return _insert_rows(db, activity_rows)
+
+
+def _insert_rows(db, activity_rows):
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        while activity_rows:
+            try:
+                with db.begin_nested():
+                    conn = db.connection()  # emits the SAVEPOINT
+                    ids = _reserve_ids(conn, models.Activity.__table__, len(activity_rows))
+                    copy_rows(conn, models.Activity.__table__, [dict(row, id=i) for row, i in zip(activity_rows, ids)])
+                break
+            except (exc.IntegrityError, conn.dialect.dbapi.IntegrityError):
+                known = existing_hashes(db, {row["row_hash"] for row in activity_rows})
+                activity_rows = [row for row in activity_rows if row["row_hash"] not in known]
+    else:
+        inserted = set(db.execute(
+            sqlite.insert(models.Activity)
+            .on_conflict_do_nothing(index_elements=["row_hash"])
+            .returning(models.Activity.row_hash),
+            activity_rows,
+        ).scalars())
+        if len(inserted) < len(activity_rows):
+            activity_rows = [row for row in activity_rows if row["row_hash"] in inserted]
+    rollups.record_rows(db, activity_rows)
+
+    return len(activity_rows)
+
+
+def write_batch(db, parsed):
+    """Drop already stored rows, then classify, compute and bulk insert the rest; returns the rows inserted."""
+    fresh = drop_duplicates(db, parsed)
+    return insert_batch(db, prepare_batch(fresh)) if fresh else 0
+
+
+def ingest_csv(stream, db, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Stream a CSV upload into the ledger in batches.
+    The caller owns the transaction; nothing is committed here.
+    Returns ingestion stats (rows processed/duplicate/rejected, rows per second, peak memory).
+    """
+    started = time.perf_counter()
+    reader, header_map = open_reader(stream, chunk_size)
+
+    processed = 0
+    duplicate = 0
+    rejected = 0
+    seen = 0
+    for parsed, rejections, consumed in iter_batches(reader, header_map, batch_size, open_from=periods.open_from(db)):
+        seen += consumed
+        rejected += len(rejections)
+        if rejections:
+            line_number, reason = rejections[0]
+            print(f"Skipping {len(rejections)} rejected rows (first: line {line_number}: {reason})")
+        if parsed:
+            inserted = write_batch(db, parsed)
+            processed += inserted
+            duplicate += len(parsed) - inserted
+
+    if not seen:
+        raise IngestError("CSV file contains no data rows.")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows_processed": processed,
+        "rows_duplicate": duplicate,
+        "rows_rejected": rejected,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(processed / elapsed, 1) if elapsed > 0 else None,
+        "peak_memory_mb": _peak_memory_mb(),
+    }
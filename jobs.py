@@ -0,0 +1,336 @@
+"""
+Background CSV ingestion.
+
+POST /upload spools the file to UPLOAD_DIR and records a queued IngestionJob. A dispatcher
+thread hands queued jobs to a process pool, where parsing, classification and emission
+computation run outside the API process (and its GIL). Each batch commits its activities
+together with the job's progress counters and rejected rows, so a job interrupted by a
+restart resumes from the last committed row instead of starting over.
+
+Re-uploads are skipped at two levels: a file whose sha256 matches a completed job is not
+queued at all, and rows whose content hash is already in the ledger are dropped before
+classification (see ingest.drop_duplicates).
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, insert, select, update
+
+import columnar, database, ingest, metrics, models, periods
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+# 0 runs each job inline in the request that uploaded it (handy for tests and CLI use)
+WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+POLL_INTERVAL = 1.0
+# A running job whose worker has not reported progress for this long is assumed dead and requeued
+STALE_AFTER = timedelta(minutes=5)
+# A job whose worker dies this many times (e.g. OOM on a huge file) fails instead of being requeued
+MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+jobs = models.IngestionJob.__table__
+
+
+def spool(upload):
+    """Copy an UploadFile to UPLOAD_DIR and validate its headers (blocking). Returns the queued job, unsaved."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_DIR, f"{job_id}.csv")
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        for chunk in iter(lambda: upload.file.read(ingest.CHUNK_SIZE), b""):
+            digest.update(chunk)
+            out.write(chunk)
+
+    try:
+        with open(path, "rb") as f:
+            ingest.open_reader(f)
+    except Exception:
+        os.remove(path)
+        raise
+
+    return models.IngestionJob(
+        id=job_id,
+        filename=upload.filename,
+        path=path,
+        status="queued",
+        file_hash=digest.hexdigest(),
+        bytes_total=os.path.getsize(path),
+    )
+
+
+def _previous_upload(file_hash):
+    # Only completed jobs: rows of a failed or unfinished one are deduplicated row by row
+    return (
+        select(models.IngestionJob)
+        .where(models.IngestionJob.file_hash == file_hash, models.IngestionJob.status == "completed")
+        .order_by(models.IngestionJob.created_at)
+        .limit(1)
+    )
+
+
+def _mark_duplicate(job, previous):
+    """Complete `job` without ingesting it: every row was already handled by `previous`."""
+    now = datetime.utcnow()
+    os.remove(job.path)
+    job.status = "completed"
+    job.duplicate_of = previous.duplicate_of or previous.id
+    job.started_at = job.finished_at = now
+    job.bytes_processed = job.bytes_total
+    job.rows_seen = previous.rows_seen
+    job.rows_rejected = previous.rows_rejected
+    job.rows_duplicate = previous.rows_seen - previous.rows_rejected
+
+
+def enqueue(db, upload):
+    """Spool an UploadFile to disk, validate its headers and queue it. Returns the job."""
+    job = spool(upload)
+    previous = db.execute(_previous_upload(job.file_hash)).scalars().first()
+    if previous is not None:
+        _mark_duplicate(job, previous)
+    db.add(job)
+    db.commit()
+    return job
+
+
+async def enqueue_async(db, upload):
+    """enqueue() for an AsyncSession; the file copy runs on a worker thread."""
+    job = await asyncio.to_thread(spool, upload)
+    previous = (await db.execute(_previous_upload(job.file_hash))).scalars().first()
+    if previous is not None:
+        _mark_duplicate(job, previous)
+    db.add(job)
+    await db.commit()
+    return job
+
+
+def _claim(db, job_id):
+    """Atomically move a queued job to running; False if another worker got it first."""
+    now = datetime.utcnow()
+    claimed = db.execute(
+        update(jobs)
+        .where(jobs.c.id == job_id, jobs.c.status == "queued")
+        .values(
+            status="running", started_at=now, heartbeat_at=now, error=None,
+            attempts=func.coalesce(jobs.c.attempts, 0) + 1,
+        )
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+def run_job(job_id, batch_size=ingest.BATCH_SIZE):
+    """Ingest one queued job. Runs in a worker process with its own database connection."""
+    with database.SessionLocal() as db:
+        if not _claim(db, job_id):
+            return
+        job = db.get(models.IngestionJob, job_id)
+
+        try:
+            with open(job.path, "rb") as f:
+                reader, header_map = ingest.open_reader(f)
+                batches = ingest.iter_batches(
+                    reader, header_map, batch_size, skip_rows=job.rows_seen, open_from=periods.open_from(db)
+                )
+                for parsed, rejections, consumed in batches:
+                    processed = ingest.write_batch(db, parsed) if parsed else 0
+                    if rejections:
+                        db.execute(insert(models.IngestionRejection), [
+                            {"job_id": job_id, "line_number": line_number, "reason": reason}
+                            for line_number, reason in rejections
+                        ])
+                    job.rows_seen += consumed
+                    job.rows_processed += processed
+                    job.rows_duplicate = (job.rows_duplicate or 0) + len(parsed) - processed
+                    job.rows_rejected += len(rejections)
+                    job.bytes_processed = min(f.tell(), job.bytes_total)
+                    job.heartbeat_at = datetime.utcnow()
+                    with metrics.timed("db_commit", consumed):
+                        db.commit()
+                    metrics.INGESTED_ROWS.inc(processed, result="inserted")
+                    metrics.INGESTED_ROWS.inc(len(parsed) - processed, result="duplicate")
+                    metrics.INGESTED_ROWS.inc(len(rejections), result="rejected")
+
+            if not job.rows_seen:
+                raise ingest.IngestError("CSV file contains no data rows.")
+            job.status = "completed"
+            job.bytes_processed = job.bytes_total
+        except Exception as e:
+            db.rollback()
+            print(f"Ingestion job {job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        if job.status == "completed" and os.path.exists(job.path):
+            os.remove(job.path)
+
+    # Append the new activities to the analytics snapshot while they are still hot in cache
+    try:
+        columnar.sync(database.engine)
+    except Exception as e:
+        print(f"Columnar sync after job {job_id} failed: {e}")
+
+
+def _run_in_worker(job_id):
+    """run_job in a pool process; returns the metrics it recorded, for the API process to merge."""
+    run_job(job_id)
+    return metrics.drain()
+
+
+def _release(db, condition, error):
+    """Requeue the running jobs matching `condition`, or fail those out of attempts; returns how many were requeued."""
+    running = and_(jobs.c.status == "running", condition)
+    db.execute(
+        update(jobs)
+        .where(running, func.coalesce(jobs.c.attempts, 0) >= MAX_ATTEMPTS)
+        .values(status="failed", error=f"Gave up after {MAX_ATTEMPTS} attempts: {error}", finished_at=datetime.utcnow())
+    )
+    requeued = db.execute(update(jobs).where(running).values(status="queued")).rowcount
+    db.commit()
+    return requeued
+
+
+def requeue_stale(db):
+    """Return running jobs whose worker stopped reporting (crash, restart) to the queue."""
+    return _release(db, jobs.c.heartbeat_at < datetime.utcnow() - STALE_AFTER, "the worker stopped reporting progress")
+
+
+def release_crashed(db, job_id, error):
+    """A worker process died running `job_id`: requeue it at once, or fail it after MAX_ATTEMPTS."""
+    return _release(db, jobs.c.id == job_id, f"the ingestion worker crashed ({error!r})")
+
+
+def job_status(db, job_id, rejection_limit=100):
+    job = db.get(models.IngestionJob, job_id)
+    if job is None:
+        return None
+
+    elapsed = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    rejections = (
+        db.query(models.IngestionRejection.line_number, models.IngestionRejection.reason)
+        .filter(models.IngestionRejection.job_id == job_id)
+        .order_by(models.IngestionRejection.id)
+        .limit(rejection_limit)
+        .all()
+    )
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "progress": (job.bytes_processed / job.bytes_total) if job.bytes_total else 0.0,
+        "rows_processed": job.rows_processed,
+        "rows_duplicate": job.rows_duplicate or 0,
+        "rows_rejected": job.rows_rejected,
+        "duplicate_of": job.duplicate_of,
+        "rows_per_second": round(job.rows_processed / elapsed, 1) if elapsed else None,
+        "rejected_rows": [{"line_number": n, "reason": r} for n, r in rejections],
+    }
+
+
+class JobRunner:
+    """Feeds queued ingestion jobs from the database to a process pool."""
+
+    def __init__(self, workers=WORKERS, on_complete=None):
+        self.workers = workers
+        self.on_complete = on_complete  # called with the job id after each job finishes
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._in_flight = {}
+
+    def start(self):
+        if self.workers <= 0:
+            return
+        self._executor = self._new_pool()
+        self._thread = threading.Thread(target=self._loop, name="ingestion-dispatcher", daemon=True)
+        self._thread.start()
+
+    def _new_pool(self):
+        # spawn, not fork: children must not inherit the API's connection pool or threads
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        # Don't wait for a long upload to finish: an interrupted job resumes from its last
+        # committed batch once it is requeued. Workers must not outlive the API process.
+        processes = list((getattr(self._executor, "_processes", None) or {}).values())
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=5)
+
+    def submit(self, job_id):
+        """Called after a new job is queued; runs it inline when there is no pool."""
+        if self.workers <= 0:
+            run_job(job_id)
+            self._completed(job_id)
+        else:
+            self._wake.set()
+
+    def _completed(self, job_id):
+        if self.on_complete is not None:
+            try:
+                self.on_complete(job_id)
+            except Exception as e:
+                print(f"Job completion hook failed for {job_id}: {e}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._dispatch()
+            except Exception as e:
+                print(f"Ingestion dispatcher error: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _dispatch(self):
+        for job_id, future in list(self._in_flight.items()):
+            if future.done():
+                del self._in_flight[job_id]
+                if future.exception() is not None:
+                    print(f"Ingestion worker for job {job_id} crashed: {future.exception()}")
+                    with database.SessionLocal() as db:
+                        release_crashed(db, job_id, future.exception())
+                else:
+                    metrics.merge(future.result())
+                    self._completed(job_id)
+
+        free = self.workers - len(self._in_flight)
+        if free <= 0:
+            return
+        with database.SessionLocal() as db:
+            requeue_stale(db)
+            queued = (
+                db.query(models.IngestionJob.id)
+                .filter(models.IngestionJob.status == "queued", models.IngestionJob.id.notin_(list(self._in_flight)))
+                .order_by(models.IngestionJob.created_at)
+                .limit(free)
+                .all()
+            )
+        for (job_id,) in queued:
+            try:
+                self._in_flight[job_id] = self._executor.submit(_run_in_worker, job_id)
+            except BrokenProcessPool:
+                # A worker died hard (e.g. OOM); its job was requeued or failed above
+                self._executor = self._new_pool()
+                self._in_flight[job_id] = self._executor.submit(_run_in_worker, job_id)
@@ -0,0 +1,125 @@
+"""
+Activity listing for GET /activities: filtered keyset pages and NDJSON bulk export.
+
+Pages are ordered newest first on (date, id) and continue from an opaque cursor that
+encodes the last row returned, so page N costs the same as page 1 (no OFFSET scans).
+"""
+import base64
+import json
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, or_, select
+
+import models, periods
+
+activities = models.Activity.__table__
+
+# Columns served by /activities (matches schemas.ActivityResponse)
+LIST_COLUMNS = (
+    activities.c.id,
+    activities.c.date,
+    activities.c.description,
+    activities.c.quantity,
+    activities.c.unit,
+    activities.c.activity_type,
+    activities.c.co2e,
+    activities.c.confidence_score,
+)
+
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 5000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(date, activity_id):
+    raw = f"{date.isoformat()}|{activity_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date_str, activity_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date_str), int(activity_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def date_bounds(start_date=None, end_date=None, period=None):
+    """
+    Inclusive calendar-date range -> [start, end) datetimes for filtering.
+    A period ('YYYY', 'YYYY-QN' or 'YYYY-MM') narrows the range further; ValueError if malformed.
+    """
+    start = datetime.combine(start_date, time.min) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), time.min) if end_date else None
+    if period:
+        period_start, period_end = periods.bounds(period)
+        start = max(start, period_start) if start else period_start
+        end = min(end, period_end) if end else period_end
+    return start, end
+
+
+def filtered_select(category=None, start=None, end=None, confidence=None, min_co2e=None):
+    """SELECT of LIST_COLUMNS with the optional filters applied, newest first."""
+    stmt = select(*LIST_COLUMNS)
+    if category is not None:
+        stmt = stmt.where(activities.c.activity_type == category)
+    if start is not None:
+        stmt = stmt.where(activities.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(activities.c.date < end)
+    if confidence is not None:
+        stmt = stmt.where(activities.c.confidence_score == confidence)
+    if min_co2e is not None:
+        stmt = stmt.where(activities.c.co2e >= min_co2e)
+    return stmt.order_by(activities.c.date.desc(), activities.c.id.desc())
+
+
+def fetch_page(db, cursor=None, limit=100, **filters):
+    """One page of activities plus the cursor for the next one (None on the last page)."""
+    stmt = filtered_select(**filters)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        # Written out rather than as a row-value comparison so every backend can use the date index
+        stmt = stmt.where(or_(
+            activities.c.date < last_date,
+            and_(activities.c.date == last_date, activities.c.id < last_id),
+        ))
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = db.execute(stmt.limit(limit + 1)).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["date"], rows[-1]["id"])
+    return {"items": [dict(r) for r in rows], "next_cursor": next_cursor}
+
+
+def _ndjson_lines(partition):
+    lines = []
+    for row in partition:
+        item = dict(row)
+        item["date"] = item["date"].isoformat() if item["date"] else None
+        lines.append(json.dumps(item))
+    return "\n".join(lines) + "\n"
+
+
+def iter_ndjson(engine, **filters):
+    """
+    Yield every matching activity as one JSON line, streamed from the database cursor
+    in batches without building ORM objects or the full result in memory.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(filtered_select(**filters))
+        for partition in result.mappings().partitions(EXPORT_BATCH_SIZE):
+            yield _ndjson_lines(partition)
+
+
+async def aiter_ndjson(engine, **filters):
+    """iter_ndjson for an AsyncEngine."""
+    async with engine.connect() as conn:
+        result = await conn.stream(filtered_select(**filters))
+        async for partition in result.mappings().partitions(EXPORT_BATCH_SIZE):
+            yield _ndjson_lines(partition)
@@ -1,21 +1,36 @@
-from fastapi import FastAPI, Depends, UploadFile, File, HTTPException
+from fastapi import FastAPI, Depends, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-import csv
-import io
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
+import threading
 from dotenv import load_dotenv
-from datetime import datetime
-from typing import List
+from datetime import date
+from typing import List, Optional
 
+# Loaded before the app modules, which read their settings from the environment at import
 load_dotenv()
 
-import models, schemas, utils, database
-from database import engine, get_db
-
-models.Base.metadata.create_all(bind=engine)
+import models, schemas, utils, database, ingest, analytics, columnar, jobs, ledger, metrics, migrations, periods, response_cache, rollups, ai_insights
+from database import engine, async_engine, get_async_db
 
 app = FastAPI(title="EcoLedger API")
+job_runner = jobs.JobRunner(on_complete=lambda job_id: ai_insights.refresh())
+
+@app.on_event("startup")
+def startup():
+    # Schema work and model loading happen here rather than at import, so tools that only
+    # import the app (workers, CLIs, tests) start fast
+    migrations.migrate(engine)
+    job_runner.start()
+    if os.getenv("MODEL_WARMUP", "1") == "1":
+        threading.Thread(target=utils.warm_up, name="model-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    job_runner.stop()
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,170 +38,233 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-File"],
 )
+# Added last so it wraps CORS too and times the whole request
+app.add_middleware(metrics.MetricsMiddleware)
 
-@app.post("/upload")
-async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def cache_metrics():
+    """Sizes of the in-process caches and /insights/ai outcomes, read at scrape time"""
+    responses = response_cache.cache.stats()
+    classification = utils.classification_cache.stats()
+    insights = ai_insights.stats()
+    return [
+        ("ecoledger_cache_entries", "gauge", "Entries held by each cache", [
+            ({"cache": "responses"}, responses["size"]),
+            ({"cache": "classification"}, classification["size"]),
+            ({"cache": "insights"}, insights["cached"]),
+        ]),
+        ("ecoledger_cache_bytes", "gauge", "Bytes held by the response cache", [({"cache": "responses"}, responses["bytes"])]),
+        ("ecoledger_insights_events_total", "counter", "/insights/ai generations by outcome", [
+            ({"event": name}, insights[name])
+            for name in ("llm_calls", "cache_hits", "coalesced", "rate_limited", "timeouts", "errors")
+        ]),
+    ]
+
+metrics.collectors.append(cache_metrics)
+
+@app.post("/upload", status_code=202)
+async def upload_csv(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV.")
     
     try:
-        content = await file.read()
-        decoded = content.decode('utf-8')
-        reader = csv.DictReader(io.StringIO(decoded))
-        
-        # Validate CSV headers
-        if not reader.fieldnames:
-             raise HTTPException(status_code=400, detail="CSV file is empty or missing headers.")
-        
-        # Create a map of normalized (lowercase) headers to actual headers
-        header_map = {h.lower().strip(): h for h in reader.fieldnames}
-        normalized_headers = set(header_map.keys())
-             
-        required_headers = {'description', 'quantity', 'unit'}
-        if not required_headers.issubset(normalized_headers):
-             raise HTTPException(status_code=400, detail=f"Missing required headers (description, quantity, unit). Found: {reader.fieldnames}")
-
-        activities_created = []
-        rows = list(reader) # Convert to list to check length
-        
-        if not rows:
-             raise HTTPException(status_code=400, detail="CSV file contains no data rows.")
-
-        for row in rows:
-            try:
-                # Use header_map to get the actual key from the row
-                description = row.get(header_map.get('description'), 'Unknown')
-                
-                # safer float conversion
-                try:
-                    quantity_str = row.get(header_map.get('quantity'), 0)
-                    quantity = float(quantity_str) if quantity_str else 0.0
-                except ValueError:
-                    quantity = 0.0 # Default to 0 if invalid number
-                    
-                unit = row.get(header_map.get('unit'), 'items')
-                
-                # Handle date (optional)
-                date_key = header_map.get('date')
-                date_str = row.get(date_key, datetime.utcnow().strftime('%Y-%m-%d')) if date_key else datetime.utcnow().strftime('%Y-%m-%d')
-                
-                try:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                except ValueError:
-                    date_obj = datetime.utcnow() # Fallback to today
-
-                # Classification and Calculation
-                activity_type = utils.classify_activity(description)
-                co2e, factor, source, formula, confidence, unit_applied = utils.compute_emissions(activity_type, quantity)
-                
-                db_activity = models.Activity(
-                    description=description,
-                    quantity=quantity,
-                    unit=unit,
-                    date=date_obj,
-                    activity_type=activity_type,
-                    co2e=co2e,
-                    confidence_score=confidence
-                )
-                db.add(db_activity)
-                db.flush() # Get ID
-                
-                db_detail = models.EmissionDetail(
-                    activity_id=db_activity.id,
-                    emission_factor=factor,
-                    factor_source=source,
-                    formula=formula,
-                    calculation_notes=f"Calculated for {quantity} {unit}",
-                    unit_applied=unit_applied
-                )
-                db.add(db_detail)
-                activities_created.append(db_activity)
-                
-            except Exception as row_error:
-                print(f"Skipping row due to error: {row_error}")
-                continue
-                
-        db.commit()
-        return {"message": f"Successfully processed {len(activities_created)} activities"}
-        
-    except HTTPException:
-        raise
+        # Parsing, classification and inserts happen in the background; poll /jobs/{job_id}
+        job = await jobs.enqueue_async(db, file)
+    except ingest.IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
 
+    if job.duplicate_of:
+        message = f"{file.filename} was already uploaded; no rows were added"
+    else:
+        await run_in_threadpool(job_runner.submit, job.id)  # runs the job inline when INGEST_WORKERS=0
+        await db.refresh(job)
+        message = f"Upload accepted, processing {file.filename}"
+    # Final counts once the job has finished; while it is queued or running, poll /jobs/{job_id}
+    return {
+        "message": message,
+        "job_id": job.id,
+        "status": job.status,
+        "duplicate_of": job.duplicate_of,
+        "rows_processed": job.rows_processed or 0,
+        "rows_duplicate": job.rows_duplicate or 0,
+        "rows_rejected": job.rows_rejected or 0,
+    }
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobStatus)
+async def get_job(job_id: str, rejection_limit: int = Query(100, ge=0, le=10000), db: AsyncSession = Depends(get_async_db)):
+    status = await db.run_sync(jobs.job_status, job_id, rejection_limit)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
 @app.get("/summary", response_model=schemas.DashboardSummary)
-def get_summary(db: Session = Depends(get_db)):
+async def get_summary(
+    request: Request,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    period: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Dashboard totals, for the whole ledger or a date range / period (YYYY, YYYY-QN, YYYY-MM)"""
     try:
-        activities = db.query(models.Activity).all()
-        # Handle case with no activities
-        if not activities:
-             return {
-                "total_co2e": 0.0,
-                "category_distribution": [],
-                "hotspots": [],
-                "trend_data": []
-            }
-            
-        total_co2e = sum(a.co2e for a in activities)
-        
-        # Category Distribution
-        dist = {}
-        for a in activities:
-            dist[a.activity_type] = dist.get(a.activity_type, 0) + a.co2e
-        
-        category_distribution = [{"name": k, "value": v} for k, v in dist.items()]
-        
-        # Hotspots (Pareto logic: Top 5 contributors)
-        hotspots = sorted(activities, key=lambda x: x.co2e, reverse=True)[:5]
-        hotspot_data = [{"description": h.description, "co2e": h.co2e} for h in hotspots]
-        
-        # Trend Data (Monthly)
-        trends = {}
-        for a in activities:
-            month = a.date.strftime('%Y-%m')
-            trends[month] = trends.get(month, 0) + a.co2e
-        
-        trend_data = [{"date": k, "co2e": v} for k, v in sorted(trends.items())]
-        
-        return {
-            "total_co2e": total_co2e,
-            "category_distribution": category_distribution,
-            "hotspots": hotspot_data,
-            "trend_data": trend_data
-        }
+        start, end = ledger.date_bounds(start_date, end_date, period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start is not None or end is not None:
+        await run_in_threadpool(columnar.refresh)  # range edges read the snapshot; catching up may block
+    try:
+        return await response_cache.respond_async(
+            request, db, lambda s: analytics.summary(s, start, end), schemas.DashboardSummary
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching summary: {str(e)}")
 
-@app.get("/activities", response_model=List[schemas.ActivityResponse])
-def list_activities(db: Session = Depends(get_db)):
-    return db.query(models.Activity).order_by(models.Activity.date.desc()).all()
+@app.get("/activities", response_model=schemas.ActivityPage)
+async def list_activities(
+    request: Request,
+    category: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    period: Optional[str] = None,
+    confidence: Optional[str] = None,
+    min_co2e: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=ledger.MAX_PAGE_SIZE),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Newest-first activities, one keyset page at a time (pass back `next_cursor`).
+    format=ndjson streams every matching row instead, for bulk export.
+    """
+    try:
+        start, end = ledger.date_bounds(start_date, end_date, period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = dict(category=category, start=start, end=end, confidence=confidence, min_co2e=min_co2e)
+
+    if format == "ndjson":
+        return StreamingResponse(ledger.aiter_ndjson(async_engine, **filters), media_type="application/x-ndjson")
+
+    try:
+        return await response_cache.respond_async(
+            request, db, lambda s: ledger.fetch_page(s, cursor=cursor, limit=limit, **filters), schemas.ActivityPage,
+            stage="activities_page",
+        )
+    except ledger.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/activities/{activity_id}/category", response_model=schemas.ActivityResponse)
+async def correct_category(activity_id: int, req: schemas.CategoryCorrection, db: AsyncSession = Depends(get_async_db)):
+    """Correct an activity's category: co2e is recomputed, and the online model learns from it on its next update"""
+    import factors  # defers the NumPy import to the first request that needs factors
+    registry = factors.get_registry()
+    if req.activity_type not in set(registry.category.tolist()):
+        raise HTTPException(status_code=400, detail=f"Unknown category {req.activity_type!r}")
+    activity = await db.get(models.Activity, activity_id)
+    if not activity:
+        raise HTTPException(status_code=404, detail="Activity not found")
+
+    year = activity.date.year if activity.date else None
+    index, multiplier = registry.resolve([req.activity_type], [activity.unit], [year], [activity.region])
+    i = int(index[0])
+    activity.activity_type = req.activity_type
+    activity.co2e = float(registry.co2e([activity.quantity or 0.0], index, multiplier)[0])
+    activity.confidence_score = registry.confidence[i]
+    activity.factor_key = registry.keys[i]
+    activity.factor_version = registry.versions[i]
+    try:
+        # The flush bumps the ledger version, holding its row until commit: stamping the
+        # correction with it orders corrections by commit for online training
+        await db.flush()
+    except periods.PeriodClosed as e:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    labeled_version = await db.run_sync(rollups.current_version)
+    activities = models.Activity.__table__
+    await db.execute(
+        update(activities).where(activities.c.id == activity_id).values(labeled_version=labeled_version)
+    )
+    # A calculation stored before the registry no longer describes the value
+    await db.execute(delete(models.EmissionDetail).where(models.EmissionDetail.activity_id == activity_id))
+    await db.commit()
+    await columnar.settle(db)  # the correction is patched into the snapshot off the event loop
+    return activity
 
 @app.get("/explain/{activity_id}", response_model=schemas.FullActivityDetail)
-def explain_activity(activity_id: int, db: Session = Depends(get_db)):
-    activity = db.query(models.Activity).filter(models.Activity.id == activity_id).first()
+async def explain_activity(activity_id: int, db: AsyncSession = Depends(get_async_db)):
+    import factors  # defers the NumPy import to the first request that needs factors
+    activity = await db.get(models.Activity, activity_id)
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
-    detail = db.query(models.EmissionDetail).filter(models.EmissionDetail.activity_id == activity_id).first()
+    detail = None
+    if activity.factor_key is None:
+        # Ingested before the factor registry: the stored calculation is what produced co2e
+        detail = (await db.execute(
+            select(models.EmissionDetail).where(models.EmissionDetail.activity_id == activity_id)
+        )).scalars().first()
     
-    response = schemas.FullActivityDetail.from_orm(activity)
-    response.details = schemas.EmissionDetailResponse.from_orm(detail) if detail else None
+    response = schemas.FullActivityDetail.model_validate(activity)
+    if detail:
+        response.details = schemas.EmissionDetailResponse.model_validate(detail)
+    else:
+        response.details = schemas.EmissionDetailResponse(**factors.get_registry().explain(activity))
     return response
 
+@app.post("/factors/recalculate")
+async def recalculate_factors():
+    """Re-apply edited emission factors to the stored activities they affect"""
+    import recalculate  # defers the NumPy import to the first recalculation
+    return await run_in_threadpool(recalculate.recalculate, engine)
+
+@app.get("/periods")
+async def list_closed_periods(db: AsyncSession = Depends(get_async_db)):
+    """Closed months with the totals frozen when they were closed"""
+    return await db.run_sync(periods.status)
+
+@app.post("/periods/{month}/close")
+async def close_periods(month: str, db: AsyncSession = Depends(get_async_db)):
+    """Close every open month up to and including `month` (YYYY-MM), freezing its totals"""
+    try:
+        months = await db.run_sync(lambda s: periods.close_through(s, month))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    return {"closed": months, "closed_through": max(months) if months else await db.run_sync(periods.closed_through)}
+
+@app.post("/periods/{month}/reopen")
+async def reopen_periods(month: str, db: AsyncSession = Depends(get_async_db)):
+    """Reopen `month` (YYYY-MM) and every later closed month"""
+    try:
+        reopened = await db.run_sync(lambda s: periods.reopen_from(s, month))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    return {"reopened": reopened, "closed_through": await db.run_sync(periods.closed_through)}
+
 @app.post("/scenario", response_model=schemas.ScenarioResponse)
-def simulate_scenario(req: schemas.ScenarioRequest, db: Session = Depends(get_db)):
-    activity = db.query(models.Activity).filter(models.Activity.id == req.activity_id).first()
+async def simulate_scenario(req: schemas.ScenarioRequest, db: AsyncSession = Depends(get_async_db)):
+    activity = await db.get(models.Activity, req.activity_id)
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
     original_co2e = activity.co2e
     sim_quantity = req.new_quantity if req.new_quantity is not None else activity.quantity
     sim_type = req.new_type if req.new_type is not None else activity.activity_type
-    
-    sim_co2e, _, _, _, _, _ = utils.compute_emissions(sim_type, sim_quantity)
-    
+
+    # Price both sides with the activity's unit, region and year and apply the change to the
+    # stored co2e, so a request that changes nothing has a difference of exactly 0
+    year = activity.date.year if activity.date else None
+    price = lambda activity_type, quantity: utils.compute_co2e(
+        activity_type, quantity, activity.unit, activity.region, year
+    )
+    sim_co2e = original_co2e + (price(sim_type, sim_quantity) - price(activity.activity_type, activity.quantity))
+
     return {
         "original_co2e": original_co2e,
         "simulated_co2e": sim_co2e,
@@ -194,103 +272,86 @@ def simulate_scenario(req: schemas.ScenarioRequest, db: Session = Depends(get_db
         "reduction_percentage": ((original_co2e - sim_co2e) / original_co2e * 100) if original_co2e > 0 else 0
     }
 
+@app.post("/scenario/batch", response_model=List[schemas.BatchScenarioResult])
+async def simulate_scenarios(req: schemas.BatchScenarioRequest, db: AsyncSession = Depends(get_async_db)):
+    """Portfolio-wide what-if rule sets evaluated over the whole ledger"""
+    import scenarios  # defers the NumPy import to the first batch simulation
+    with metrics.timed("scenario_columns"):
+        await run_in_threadpool(columnar.refresh)
+        columns = await db.run_sync(scenarios.LedgerColumns.load)
+
+    def simulate():
+        with metrics.timed("scenario_simulation"):
+            return [scenarios.simulate(columns, s) for s in req.scenarios]
+
+    # The array work is CPU-bound; keep it off the event loop
+    return await run_in_threadpool(simulate)
+
+@app.get("/model")
+def classifier_model():
+    """Version, type and load time of the classifier in use"""
+    return utils.model_info()
+
+@app.post("/model/update")
+async def update_model():
+    """Teach the online model the category corrections made since its last update, then swap it in"""
+    import online_model  # defers the NumPy and scikit-learn imports to the first update
+
+    def update():
+        with database.SessionLocal() as db:
+            return online_model.update(db)
+
+    try:
+        return await run_in_threadpool(update)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/cache/classification")
+def classification_cache_stats():
+    """Hit/miss/eviction counters of the description classification cache"""
+    return utils.classification_cache.stats()
+
+@app.get("/cache/responses")
+def response_cache_stats():
+    """Hit/miss/304/eviction counters of the read endpoint response cache"""
+    return response_cache.cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Request latency, hot-path stage timings, row, query and cache counters in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/insights", response_model=List[schemas.Recommendation])
-def get_insights(db: Session = Depends(get_db)):
+async def get_insights(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Legacy rule-based insights"""
     try:
-        activities = db.query(models.Activity).all()
-        return utils.get_recommendations(activities)
+        return await response_cache.respond_async(
+            request, db, lambda s: utils.get_recommendations(analytics.category_totals(s)), List[schemas.Recommendation]
+        )
     except Exception as e:
         print(f"Error generating insights: {e}")
         return []
 
 @app.post("/insights/ai")
-async def generate_ai_insights(db: Session = Depends(get_db)):
+async def generate_ai_insights(db: AsyncSession = Depends(get_async_db)):
     """
     Generates advanced insights using Gemini API (if key present) or Smart Simulation.
     """
     try:
-        activities = db.query(models.Activity).all()
-        total_co2 = sum(a.co2e for a in activities)
-        
-        # Calculate Simulation Data (Fallback)
-        cat_totals = {}
-        for a in activities:
-            cat_totals[a.activity_type] = cat_totals.get(a.activity_type, 0) + a.co2e
-            
+        # The LLM call runs on a worker thread (see ai_insights.py)
+        cat_totals, key, fallback = await db.run_sync(ai_insights.ledger_state)
         if not cat_totals:
-            return {"content": "No data available to analyze. Please upload your emission records."}
-            
-        top_cat = max(cat_totals, key=cat_totals.get)
-        
-        # ---------------------------------------------------------
-        # OPTION 1: REAL AI (If GEMINI_API_KEY is set)
-        # ---------------------------------------------------------
-        api_key = os.getenv("GEMINI_API_KEY")
-        if api_key:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel('gemini-pro')
-                
-                # Construct a data context for the AI
-                context = f"Total CO2: {total_co2} tCO2e.\n"
-                context += "Breakdown:\n"
-                for cat, val in cat_totals.items():
-                    context += f"- {cat}: {val} tCO2e\n"
-                
-                prompt = f"""
-                You are the Chief Sustainability Officer for an enterprise. Analyze this carbon footprint data:
-                {context}
-                
-                Write a concise, professional executive summary.
-                1. State the critical hotspot.
-                2. Provide 1 high-impact strategic action.
-                3. Provide 1 immediate quick-win.
-                4. Project the future trend if no action is taken.
-                
-                Format with bold headers like **Executive Summary**, **Critical Hotspot**, etc. Keep it under 200 words.
-                """
-                
-                response = model.generate_content(prompt)
-                return {"content": response.text}
-                
-            except Exception as e:
-                print(f"Gemini API Error: {e} - Falling back to simulation.")
-                # Fallback continues below
-
-        # ---------------------------------------------------------
-        # OPTION 2: SMART SIMULATION (Fallback)
-        # ---------------------------------------------------------
-        top_val = cat_totals[top_cat]
-        percentage = (top_val / total_co2 * 100) if total_co2 > 0 else 0
-        
-        response_text = f"**Executive Summary:**\n"
-        response_text += f"Your organization's total carbon footprint is currently **{total_co2:.2f} tCO2e**.\n\n"
-        response_text += f"**Critical Hotspot Identified:**\n"
-        response_text += f"The **{top_cat}** sector matches **{percentage:.1f}%** of your total emissions.\n"
-        
-        if top_cat == 'transport':
-            response_text += "• **Strategic Action:** Transitioning last-mile logistics to EV could reduce this by up to 18%.\n"
-            response_text += "• **Immediate Win:** Optimize route planning to decrease fuel consumption by ~5%.\n"
-        elif top_cat == 'energy':
-            response_text += "• **Strategic Action:** Procure Renewable Energy Certificates (RECs) for your main facilities.\n"
-            response_text += "• **Immediate Win:** Audit HVAC systems in HQ; 10% reduction typically found in idle-time management.\n"
-        elif top_cat == 'supply_chain':
-            response_text += "• **Strategic Action:** Engage top 5 suppliers for Tier 1 emission data transparency.\n"
-            response_text += "• **Immediate Win:** Switch to local sourcing for high-volume, low-margin materials.\n"
-        else:
-            response_text += "• **Recommendation:** Conduct a granular audit of this sector to identify specific outlier activities.\n"
-        
-        response_text += "\n**Projected Trajectory:**\n"
-        response_text += "Based on current trends, Q4 emissions are projected to rise by 4.2% unless mitigation strategies are deployed immediately."
-        
-        return {"content": response_text}
-            
+            return {"content": ai_insights.NO_DATA}
+        return {"content": await ai_insights.generate(cat_totals, key, fallback)}
     except Exception as e:
         print(f"CRITICAL ERROR in /insights/ai: {e}")
         return JSONResponse(status_code=500, content={"content": "An error occurred generating insights."})
 
+@app.get("/cache/insights")
+def insight_cache_stats():
+    """LLM calls, cache hits, coalesced requests and rate-limit fallbacks of /insights/ai"""
+    return ai_insights.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
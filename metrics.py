@@ -0,0 +1,290 @@
+"""
+Prometheus metrics (GET /metrics) and opt-in request profiling.
+
+MetricsMiddleware times every request into a per-route latency histogram and counts the
+SQL statements it runs. Hot paths report their own stages with `timed(stage, rows)`: CSV
+parsing, classification, emission computation, duplicate lookups, database writes and
+commits, aggregation and serialization. The stage timings of a request are also returned
+in its Server-Timing header, so browser devtools show where a slow dashboard call spent
+its time.
+
+Ingestion runs in worker processes. Each job drains its process's metrics and returns
+them to the dispatcher, which merges them into the API's registry (see jobs.py).
+
+Profiling is off unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set. A request whose
+X-Profile header equals PROFILE_TOKEN, or a random PROFILE_SAMPLE_RATE fraction of all
+requests, runs under cProfile. The stats are dumped to PROFILE_DIR and named in the
+X-Profile-File response header. One request is profiled at a time. Work handed to
+threadpool threads is not captured, and other requests sharing the event loop may show up.
+"""
+import contextvars
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+# Seconds; from a cached 304 up to a large upload
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name, self.description, self.labelnames = name, description, tuple(labelnames)
+        self._values = {}  # label values -> total
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.description, self.labelnames = name, description, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    samples.append((self.name + "_bucket", _labels(self.labelnames, key, [("le", _number(bound))]), cumulative))
+                samples.append((self.name + "_sum", _labels(self.labelnames, key), series[-1]))
+                samples.append((self.name + "_count", _labels(self.labelnames, key), cumulative))
+        return samples
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, series in values.items():
+                mine = self._values.setdefault(key, [0] * len(series))
+                for i, value in enumerate(series):
+                    mine[i] += value
+
+
+REQUESTS = Counter("ecoledger_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("ecoledger_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+REQUEST_QUERIES = Histogram(
+    "ecoledger_http_request_db_queries", "SQL statements run by one request", ("method", "route"), QUERY_BUCKETS
+)
+STAGE_SECONDS = Histogram("ecoledger_stage_duration_seconds", "Time spent in instrumented hot paths", ("stage",))
+STAGE_ROWS = Counter("ecoledger_stage_rows_total", "Rows handled by instrumented hot paths", ("stage",))
+INGESTED_ROWS = Counter("ecoledger_ingested_rows_total", "Uploaded rows by outcome", ("result",))
+DB_QUERIES = Counter("ecoledger_db_queries_total", "SQL statements executed", ("operation",))
+CACHE_LOOKUPS = Counter("ecoledger_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+METRICS = [
+    REQUESTS, REQUEST_SECONDS, REQUEST_QUERIES, STAGE_SECONDS, STAGE_ROWS, INGESTED_ROWS, DB_QUERIES, CACHE_LOOKUPS,
+]
+
+# Callables returning [(name, kind, description, [(labels dict, value)])] at scrape time
+collectors = []
+
+# Per-request {"queries": n, "stages": {stage: seconds}}; None outside a request
+_request = contextvars.ContextVar("ecoledger_request_metrics", default=None)
+
+
+@contextmanager
+def timed(stage, rows=None):
+    """Time the block as `stage` (and count `rows` for it)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, rows)
+
+
+def observe(stage, seconds, rows=None):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if rows:
+        STAGE_ROWS.inc(rows, stage=stage)
+    current = _request.get()
+    if current is not None:
+        current["stages"][stage] = current["stages"].get(stage, 0.0) + seconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+    if operation not in ("select", "insert", "update", "delete", "with"):
+        operation = "other"
+    DB_QUERIES.inc(operation=operation)
+    current = _request.get()
+    if current is not None:
+        current["queries"] += 1
+
+
+def drain():
+    """Take this process's metric values, resetting them (a worker's share for merge())."""
+    return {metric.name: metric.drain() for metric in METRICS}
+
+
+def merge(values):
+    by_name = {metric.name: metric for metric in METRICS}
+    for name, metric_values in (values or {}).items():
+        if name in by_name:
+            by_name[name].merge(metric_values)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+    for collect in collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, kind, description, samples in families:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(
+                f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}" for labels, value in samples
+            )
+    return "\n".join(lines) + "\n"
+
+
+_profile_lock = threading.Lock()
+
+
+def _profile_requested(scope):
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if not PROFILE_TOKEN:
+        return False
+    return any(name == b"x-profile" and value.decode("latin-1") == PROFILE_TOKEN for name, value in scope["headers"])
+
+
+def _profile_path(scope):
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+    return os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{slug}-{os.getpid()}.prof")
+
+
+def _server_timing(current, total):
+    entries = [f"app;dur={total * 1000:.1f}", f'db;desc="{current["queries"]} queries"']
+    entries += [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in current["stages"].items()]
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency, status and query counts per route, Server-Timing, profiling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current = {"queries": 0, "stages": {}}
+        token = _request.set(current)
+        profiler = profile_path = None
+        if (PROFILE_TOKEN or PROFILE_SAMPLE_RATE) and _profile_requested(scope) and _profile_lock.acquire(blocking=False):
+            profiler, profile_path = cProfile.Profile(), _profile_path(scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(current, time.perf_counter() - started)))
+                if profiler is not None:
+                    headers.append((b"x-profile-file", os.path.basename(profile_path).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                try:
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    profiler.dump_stats(profile_path)
+                except OSError as e:
+                    print(f"Could not write profile {profile_path}: {e}")
+                finally:
+                    _profile_lock.release()
+            _request.reset(token)
+            # The route template, not the raw path, keeps label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUESTS.inc(method=scope["method"], route=route, status=status)
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route)
+            REQUEST_QUERIES.observe(current["queries"], method=scope["method"], route=route)
@@ -0,0 +1,86 @@
+"""
+Bring an existing ecoledger.db up to the current schema.
+
+create_all only adds missing tables, so columns and indexes added to existing tables,
+the rollup backfill, the row hashes of activities stored before deduplication and the
+initial applied factor state are applied here. Safe to run repeatedly; the API runs it
+at startup.
+
+Usage:
+    python migrations.py
+"""
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.orm import sessionmaker
+
+import ingest, models, rollups
+from database import engine as default_engine
+
+
+def add_missing_columns(engine):
+    """ALTER TABLE ... ADD COLUMN for model columns an existing table lacks (new columns are nullable)."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def backfill_row_hashes(db, chunk_size=20000):
+    """
+    Give activities stored before deduplication their content hash, committing per chunk.
+    Where the ledger already holds the same row more than once, the oldest copy gets the
+    hash and later copies get it suffixed with their id: they stay in the ledger, and
+    new uploads of the row still match the first copy.
+    """
+    activities = models.Activity.__table__
+    while True:
+        rows = db.execute(
+            select(activities.c.id, activities.c.description, activities.c.quantity, activities.c.unit, activities.c.date)
+            .where(activities.c.row_hash.is_(None))
+            .order_by(activities.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        hashes = [ingest.row_hash(description, quantity, unit, date) for _, description, quantity, unit, date in rows]
+        known = ingest.existing_hashes(db, set(hashes))
+        updates = []
+        for (activity_id, *_), content_hash in zip(rows, hashes):
+            if content_hash in known:
+                content_hash = f"{content_hash}:{activity_id}"
+            known.add(content_hash)
+            updates.append({"activity_id": activity_id, "hash": content_hash})
+        db.execute(
+            update(activities).where(activities.c.id == bindparam("activity_id")).values(row_hash=bindparam("hash")),
+            updates,
+        )
+        db.commit()
+
+
+def migrate(engine=default_engine):
+    models.Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+    # create_all skips indexes on tables that already exist
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    with sessionmaker(bind=engine)() as db:
+        rollups.ensure_built(db)
+        backfill_row_hashes(db)
+        if db.execute(select(models.AppliedFactor.factor_key).limit(1)).first() is None:
+            # First run with the factor registry: later edits are diffed against today's factors
+            import factors, recalculate  # loads NumPy, so only when there is no state yet
+            recalculate.save_state(db, factors.get_registry())
+            db.commit()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Database schema is up to date.")
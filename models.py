@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -7,16 +7,31 @@ class Activity(Base):
     __tablename__ = "activities"
 
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(DateTime, default=datetime.datetime.utcnow)
+    date = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     description = Column(String)
     quantity = Column(Float)
     unit = Column(String)
-    activity_type = Column(String)
+    activity_type = Column(String, index=True)
     co2e = Column(Float)
     confidence_score = Column(String) # High, Medium, Low
+    region = Column(String, nullable=True)  # factor region; NULL means factors.DEFAULT_REGION
+    factor_key = Column(String, nullable=True)  # registry factor that produced co2e (NULL before the registry)
+    factor_version = Column(String, nullable=True)  # that factor's version when co2e was computed
+    row_hash = Column(String, nullable=True)  # content hash (ingest.row_hash); repeated uploads of a row are skipped
+    labeled_version = Column(Integer, nullable=True)  # ledger version of a user's activity_type correction; online training learns from these
     
     emission_detail = relationship("EmissionDetail", back_populates="activity", uselist=False)
 
+    __table_args__ = (
+        Index("ix_activities_co2e", "co2e"),  # hotspots: ORDER BY co2e DESC LIMIT n
+        Index("ix_activities_type_date", "activity_type", "date"),  # per-category totals over a date range
+        Index("ix_activities_factor", "factor_key", "factor_version"),  # rows to recalculate after a factor change
+        Index("ux_activities_row_hash", "row_hash", unique=True),  # one row per content hash
+        Index("ix_activities_labeled_version", "labeled_version", "id"),  # corrections not yet learned by the online model
+    )
+
+# Calculation details stored per activity before the factor registry; /explain now
+# derives them from Activity.factor_key (see factors.py)
 class EmissionDetail(Base):
     __tablename__ = "emission_details"
 
@@ -29,3 +44,106 @@ class EmissionDetail(Base):
     unit_applied = Column(String)
 
     activity = relationship("Activity", back_populates="emission_detail")
+
+
+# Pre-aggregated totals kept in step with `activities` by rollups.py
+
+class CategoryRollup(Base):
+    __tablename__ = "rollup_category"
+
+    activity_type = Column(String, primary_key=True)
+    total_co2e = Column(Float, nullable=False, default=0.0)
+    activity_count = Column(Integer, nullable=False, default=0)
+
+class MonthRollup(Base):
+    __tablename__ = "rollup_month"
+
+    month = Column(String, primary_key=True)  # YYYY-MM
+    total_co2e = Column(Float, nullable=False, default=0.0)
+    activity_count = Column(Integer, nullable=False, default=0)
+
+class CategoryMonthRollup(Base):
+    __tablename__ = "rollup_category_month"
+
+    activity_type = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM
+    total_co2e = Column(Float, nullable=False, default=0.0)
+    activity_count = Column(Integer, nullable=False, default=0)
+
+# Closed accounting periods and their frozen per-category totals (see periods.py)
+
+class ClosedPeriod(Base):
+    __tablename__ = "closed_periods"
+
+    month = Column(String, primary_key=True)  # YYYY-MM
+    closed_at = Column(DateTime, default=datetime.datetime.utcnow)
+    total_co2e = Column(Float, nullable=False, default=0.0)
+    activity_count = Column(Integer, nullable=False, default=0)
+
+class ReopenedPeriod(Base):
+    __tablename__ = "reopened_periods"
+
+    month = Column(String, primary_key=True)  # YYYY-MM reopened since the last factor recalculation
+    reopened_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class PeriodRollup(Base):
+    __tablename__ = "period_rollups"
+
+    activity_type = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM, a closed month
+    total_co2e = Column(Float, nullable=False, default=0.0)
+    activity_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_period_rollups_month", "month"),  # range reads by month
+    )
+
+class LedgerVersion(Base):
+    __tablename__ = "ledger_version"
+
+    id = Column(Integer, primary_key=True)  # single row, id = 1
+    version = Column(Integer, nullable=False, default=0)  # bumped by every write to activities
+
+# Emission factors the stored co2e values were last reconciled with (see recalculate.py)
+
+class AppliedFactor(Base):
+    __tablename__ = "applied_factors"
+
+    factor_key = Column(String, primary_key=True)  # factor key, or "unit->to_unit" for a unit conversion
+    version = Column(String, nullable=False)  # factor version, or the conversion multiplier
+
+# Background CSV ingestion (see jobs.py)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    filename = Column(String)
+    path = Column(String)  # spooled upload on local disk
+    status = Column(String, index=True, default="queued")  # queued, running, completed, failed
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # refreshed by the worker after every batch
+    attempts = Column(Integer, default=0)  # times a worker has claimed the job; capped by jobs.MAX_ATTEMPTS
+    file_hash = Column(String, nullable=True, index=True)  # sha256 of the uploaded file
+    duplicate_of = Column(String, nullable=True)  # completed job that already ingested the same file
+    bytes_total = Column(Integer, default=0)
+    bytes_processed = Column(Integer, default=0)
+    rows_seen = Column(Integer, default=0)  # data rows consumed so far; the resume point after a restart
+    rows_processed = Column(Integer, default=0)  # rows inserted
+    rows_duplicate = Column(Integer, default=0)  # rows skipped because the ledger already had them
+    rows_rejected = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+
+    rejections = relationship("IngestionRejection", back_populates="job")
+
+class IngestionRejection(Base):
+    __tablename__ = "ingestion_rejections"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, ForeignKey("ingestion_jobs.id"), index=True)
+    line_number = Column(Integer)
+    reason = Column(String)
+
+    job = relationship("IngestionJob", back_populates="rejections")
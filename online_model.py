@@ -0,0 +1,183 @@
+"""
+Incrementally trainable activity classifier: HashingVectorizer + SGDClassifier.
+
+The TF-IDF + LogisticRegression pipeline (train_model.py) has to be refit on the whole
+training set whenever it should learn something. Hashing needs no vocabulary, so this
+model can keep learning with partial_fit instead. `update` streams the activities whose
+category a user corrected since the model last looked and folds only those in.
+Corrections are stamped with the ledger version of their transaction
+(Activity.labeled_version). The version is bumped under a row lock that is held until
+commit, so stamps follow commit order: a correction that commits after an update has
+read the table is always stamped higher than everything that update learned.
+
+Models are written over utils.MODEL_PATH atomically (temp file + os.replace). The API
+swaps a model it updated in at once, and every other process (ingestion workers, a
+second API instance) switches on its next classification, since utils.get_classifier
+reloads the model file when it changes.
+
+Training is reproducible: every shuffle is seeded, and corrections are read in
+(labeled_version, id) order.
+"""
+import copy
+import os
+import tempfile
+import threading
+
+import numpy as np
+from sqlalchemy import and_, or_, select
+
+import models
+
+N_FEATURES = 2 ** 18
+RANDOM_STATE = 42
+EPOCHS = 5  # passes over the training set, or over each batch of corrections
+CORRECTION_CHUNK = 5000
+
+activities = models.Activity.__table__
+
+_update_lock = threading.Lock()  # one in-process update at a time
+
+
+class OnlineClassifier:
+    """The predict_proba / classes_ interface of the sklearn pipeline, plus partial_fit."""
+
+    def __init__(self, classes, n_features=N_FEATURES, random_state=RANDOM_STATE):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+
+        self.classes_ = np.array(sorted(set(classes)), dtype=object)
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), stop_words="english", alternate_sign=False, norm="l2"
+        )
+        self.classifier = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=random_state)
+        self.random_state = random_state
+        self.samples_seen = 0
+        self.trained_through = None  # (labeled_version, id) of the last correction learned from
+
+    def __getstate__(self):
+        # Only hashed features that ever occurred have non-zero weights: pickle them sparse,
+        # which keeps the model file (and every hot-swap reload) small
+        state = self.__dict__.copy()
+        state.pop("_sparse", None)
+        if hasattr(self.classifier, "coef_"):
+            state["classifier"] = self._predictor()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if hasattr(self.classifier, "coef_"):
+            self.classifier.densify()  # partial_fit needs dense weights
+
+    def partial_fit(self, descriptions, labels, epochs=1):
+        """Learn from labeled descriptions; labels outside classes_ are skipped. Returns the rows used."""
+        known = set(self.classes_.tolist())
+        pairs = [(d, l) for d, l in zip(descriptions, labels) if l in known]
+        if not pairs:
+            return 0
+        X = self.vectorizer.transform([d for d, _ in pairs])
+        y = np.array([l for _, l in pairs], dtype=object)
+        rng = np.random.default_rng(self.random_state + self.samples_seen)
+        for _ in range(epochs):
+            order = rng.permutation(len(pairs))
+            self.classifier.partial_fit(X[order], y[order], classes=self.classes_)
+        self.samples_seen += len(pairs)
+        self._sparse = None
+        return len(pairs)
+
+    def _predictor(self):
+        """A copy of the classifier with sparse weights (scoring skips the 2**18 dense columns)."""
+        predictor = self.__dict__.get("_sparse")
+        if predictor is None:
+            predictor = self._sparse = copy.copy(self.classifier).sparsify()
+        return predictor
+
+    def predict_proba(self, descriptions):
+        # Columns follow SGDClassifier's classes_, which equal ours (both sorted)
+        return self._predictor().predict_proba(self.vectorizer.transform(descriptions))
+
+    def predict(self, descriptions):
+        return self.classes_[self.predict_proba(descriptions).argmax(axis=1)]
+
+
+def train(descriptions, labels, classes=(), epochs=EPOCHS):
+    """A fresh OnlineClassifier fit on labeled descriptions (plus any extra `classes` it may learn later)."""
+    model = OnlineClassifier(set(labels) | set(classes))
+    model.partial_fit(descriptions, labels, epochs=epochs)
+    return model
+
+
+def corrections(db, after=None, chunk_size=CORRECTION_CHUNK):
+    """
+    Yield lists of (description, activity_type, labeled_version, id) for activities whose
+    category was corrected after the (labeled_version, id) position `after`, oldest first.
+    """
+    while True:
+        stmt = (
+            select(activities.c.description, activities.c.activity_type, activities.c.labeled_version, activities.c.id)
+            .where(activities.c.labeled_version.is_not(None))
+            .order_by(activities.c.labeled_version, activities.c.id)
+            .limit(chunk_size)
+        )
+        if after is not None:
+            labeled_version, activity_id = after
+            stmt = stmt.where(or_(
+                activities.c.labeled_version > labeled_version,
+                and_(activities.c.labeled_version == labeled_version, activities.c.id > activity_id),
+            ))
+        rows = db.execute(stmt).all()
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1].labeled_version, rows[-1].id)
+
+
+def learn_corrections(model, db, epochs=EPOCHS):
+    """Fold every correction the model has not seen into it; returns (corrections read, rows learned)."""
+    read = learned = 0
+    for rows in corrections(db, model.trained_through):
+        read += len(rows)
+        learned += model.partial_fit([r.description or "" for r in rows], [r.activity_type for r in rows], epochs)
+        model.trained_through = (rows[-1].labeled_version, rows[-1].id)
+    return read, learned
+
+
+def save(model, path):
+    """Write the model next to `path` and rename it into place, so readers never see a partial file."""
+    import joblib
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".model-", suffix=".joblib", dir=directory)
+    os.close(fd)
+    try:
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def update(db):
+    """
+    Learn the corrections made since the active model's last update, then save the model and
+    swap it in. Raises ValueError if the active model cannot learn incrementally.
+    """
+    import utils
+
+    with _update_lock:
+        current = utils.get_classifier()
+        if not isinstance(current, OnlineClassifier):
+            raise ValueError(
+                "The active model cannot be updated incrementally; train one with `python train_model.py --online`"
+            )
+        model = copy.deepcopy(current)  # the active model keeps serving until the swap
+        read, learned = learn_corrections(model, db)
+        if read:
+            save(model, utils.MODEL_PATH)
+            utils.set_classifier(model, utils.file_version(utils.MODEL_PATH))
+    return {
+        "corrections_read": read,
+        "corrections_learned": learned,
+        "samples_seen": model.samples_seen,
+        "model_version": utils.model_info()["version"],
+    }
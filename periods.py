@@ -0,0 +1,252 @@
+"""
+Closed accounting periods.
+
+Closing a month freezes its figures. The month's per-category totals are computed from
+`activities` once and stored in period_rollups, and after that no activity dated in a
+closed month can be added, changed or removed:
+  - ingestion rejects such rows (the reason is recorded on the job),
+  - factor recalculation leaves them alone,
+  - ORM writes raise PeriodClosed.
+Reports over closed months read the frozen totals, so figures that have been reported do
+not drift when emission factors are edited later.
+
+Periods close in order. Closing 2024-06 also closes every earlier month, so the closed
+periods are everything up to one watermark month. Reopening a month reopens everything
+after it as well; the next close freezes those months again from the current ledger.
+Reopened months are recorded in reopened_periods until the next factor recalculation,
+which re-resolves their activities: it left them alone while they were closed.
+
+Usage:
+    python periods.py status
+    python periods.py close 2024-12
+    python periods.py reopen 2024-07
+"""
+import argparse
+import re
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+import models, rollups
+
+MONTH_PATTERN = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])$")
+PERIOD_PATTERN = re.compile(r"^(\d{4})(?:-(0[1-9]|1[0-2])|-Q([1-4]))?$")
+
+closed = models.ClosedPeriod.__table__
+frozen = models.PeriodRollup.__table__
+reopened_periods = models.ReopenedPeriod.__table__
+
+
+class PeriodClosed(ValueError):
+    """Raised when a write would change an activity dated in a closed period."""
+
+
+def parse_month(value):
+    """Validate a 'YYYY-MM' month and return it."""
+    if not MONTH_PATTERN.match(value or ""):
+        raise ValueError(f"Invalid month {value!r} (expected YYYY-MM)")
+    return value
+
+
+def month_start(month):
+    return datetime(int(month[:4]), int(month[5:7]), 1)
+
+
+def next_month(month):
+    year, m = int(month[:4]), int(month[5:7])
+    return f"{year + m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def bounds(period):
+    """
+    [start, end) datetimes of a 'YYYY', 'YYYY-QN' or 'YYYY-MM' period.
+    Raises ValueError for anything else.
+    """
+    match = PERIOD_PATTERN.match(period or "")
+    if not match:
+        raise ValueError(f"Invalid period {period!r} (expected YYYY, YYYY-QN or YYYY-MM)")
+    year, month, quarter = match.groups()
+    if month:
+        first, months = int(month), 1
+    elif quarter:
+        first, months = (int(quarter) - 1) * 3 + 1, 3
+    else:
+        first, months = 1, 12
+    start = f"{year}-{first:02d}"
+    end = start
+    for _ in range(months):
+        end = next_month(end)
+    return month_start(start), month_start(end)
+
+
+def closed_through(db):
+    """The last closed month ('YYYY-MM'), or None while every period is open."""
+    # Through the connection, so this can run inside a flush without autoflushing
+    return db.connection().execute(select(func.max(closed.c.month))).scalar()
+
+
+def open_from(db):
+    """Start of the first open month: activities dated before it are frozen (None if none are)."""
+    last = closed_through(db)
+    return month_start(next_month(last)) if last else None
+
+
+def close_through(db, month):
+    """
+    Close every open month up to and including `month` (the caller commits).
+    Returns the months closed, oldest first.
+    """
+    month = parse_month(month)
+    last = closed_through(db)
+    if last is not None and month <= last:
+        return []
+
+    conn = db.connection()
+    activities = models.Activity.__table__
+    if last is not None:
+        first = next_month(last)
+    else:
+        earliest = conn.execute(select(func.min(activities.c.date))).scalar()
+        first = min(rollups.month_key(earliest), month) if earliest else month
+
+    # Frozen from the ledger itself rather than copied from the incrementally kept rollups
+    start, end = month_start(first), month_start(next_month(month))
+    month_column = rollups.month_expr(activities.c.date, conn.dialect.name)
+    rows = conn.execute(
+        select(
+            activities.c.activity_type, month_column,
+            func.coalesce(func.sum(activities.c.co2e), 0.0), func.count(),
+        )
+        .where(activities.c.date >= start, activities.c.date < end, activities.c.activity_type.is_not(None))
+        .group_by(activities.c.activity_type, month_column)
+    ).all()
+    if rows:
+        conn.execute(insert(frozen), [
+            {"activity_type": a, "month": m, "total_co2e": t, "activity_count": c} for a, m, t, c in rows
+        ])
+
+    months = []
+    current = first
+    while current <= month:
+        months.append(current)
+        current = next_month(current)
+    totals = {m: [0.0, 0] for m in months}
+    for _, m, total, count in rows:
+        totals[m][0] += total
+        totals[m][1] += count
+    closed_at = datetime.utcnow()
+    conn.execute(insert(closed), [
+        {"month": m, "closed_at": closed_at, "total_co2e": t, "activity_count": c} for m, (t, c) in totals.items()
+    ])
+    rollups.bump_version(conn)
+    return months
+
+
+def reopen_from(db, month):
+    """Reopen `month` and every later closed month (the caller commits); returns how many were reopened."""
+    month = parse_month(month)
+    conn = db.connection()
+    months = conn.execute(select(closed.c.month).where(closed.c.month >= month)).scalars().all()
+    if not months:
+        return 0
+    conn.execute(delete(closed).where(closed.c.month >= month))
+    conn.execute(delete(frozen).where(frozen.c.month >= month))
+
+    # Factor recalculation skipped these months while they were closed; the next run catches up
+    pending = set(conn.execute(select(reopened_periods.c.month).where(reopened_periods.c.month.in_(months))).scalars())
+    reopened_at = datetime.utcnow()
+    fresh = [{"month": m, "reopened_at": reopened_at} for m in months if m not in pending]
+    if fresh:
+        conn.execute(insert(reopened_periods), fresh)
+    rollups.bump_version(conn)
+    return len(months)
+
+
+def reopened_months(db):
+    """Months reopened since the last factor recalculation, oldest first."""
+    return db.execute(select(reopened_periods.c.month).order_by(reopened_periods.c.month)).scalars().all()
+
+
+def forget_reopened(db, months):
+    """Clear the recalculation marks of `months` once a run has covered them (the caller commits)."""
+    if months:
+        db.execute(delete(reopened_periods).where(reopened_periods.c.month.in_(months)))
+
+
+def month_ranges(months):
+    """Merge sorted 'YYYY-MM' months into [start, end) datetime ranges."""
+    ranges = []
+    for month in months:
+        start, end = month_start(month), month_start(next_month(month))
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def status(db):
+    rows = db.execute(
+        select(closed.c.month, closed.c.closed_at, closed.c.total_co2e, closed.c.activity_count).order_by(closed.c.month)
+    ).all()
+    return {
+        "closed_through": rows[-1].month if rows else None,
+        "closed_periods": [
+            {"month": m, "closed_at": at.isoformat() if at else None, "total_co2e": t, "activity_count": c}
+            for m, at, t, c in rows
+        ],
+    }
+
+
+def _frozen_dates(obj):
+    """The dates an Activity write touches: its current date and, for an update, the one it had."""
+    dates = [obj.date]
+    history = inspect(obj).attrs["date"].history
+    dates.extend(history.deleted)
+    return [d for d in dates if d is not None]
+
+
+@event.listens_for(Session, "before_flush")
+def _reject_closed_writes(session, flush_context, instances):
+    """Refuse ORM inserts, updates and deletes of activities dated in a closed period."""
+    touched = [
+        obj for obj in list(session.new) + list(session.deleted) + list(session.dirty)
+        if isinstance(obj, models.Activity) and (obj not in session.dirty or session.is_modified(obj))
+    ]
+    if not touched:
+        return
+    boundary = open_from(session)
+    if boundary is None:
+        return
+    for obj in touched:
+        for d in _frozen_dates(obj):
+            if d < boundary:
+                raise PeriodClosed(f"Period {rollups.month_key(d)} is closed; activity {obj.id} cannot be changed")
+
+
+if __name__ == "__main__":
+    import json
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Close or reopen accounting periods")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="List the closed months")
+    close_parser = commands.add_parser("close", help="Close every month up to and including MONTH")
+    close_parser.add_argument("month", help="YYYY-MM")
+    reopen_parser = commands.add_parser("reopen", help="Reopen MONTH and every later month")
+    reopen_parser.add_argument("month", help="YYYY-MM")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "close":
+            months = close_through(db, args.month)
+            db.commit()
+            print(f"Closed {len(months)} month(s)" + (f": {months[0]} .. {months[-1]}" if months else ""))
+        elif args.command == "reopen":
+            n = reopen_from(db, args.month)
+            db.commit()
+            print(f"Reopened {n} month(s)")
+        else:
+            print(json.dumps(status(db), indent=2))
@@ -0,0 +1,250 @@
+"""
+Re-apply edited emission factors to activities already in the ledger.
+
+Every activity records the factor that produced its co2e (factor_key) and that factor's
+version. The applied_factors table holds the registry state the ledger was last
+reconciled with. A run diffs both against the current registry and only touches the
+activities a change can affect:
+  - rows whose factor changed or was removed (one DISTINCT scan of the
+    (factor_key, factor_version) index finds their keys),
+  - rows in a category that gained a factor or whose units' conversions changed, since
+    they may now match a different region, unit or year,
+  - rows ingested before the registry (no factor_key),
+  - rows dated in a month reopened since the last run, which were skipped while it was
+    closed and may be behind any of the changes above.
+Activities dated in a closed period (see periods.py) are never touched: their figures
+stay as they were reported.
+
+Their ids come from the factor_key index. They are re-resolved with
+FactorRegistry.resolve in chunks of RECALC_CHUNK rows, and only rows whose co2e, factor or
+confidence actually changed are written back, with one bulk UPDATE per chunk (COPY into a
+temporary table and UPDATE ... FROM on PostgreSQL). Each chunk commits together with its
+rollup adjustment and a ledger version bump, so readers never wait on a long
+transaction; the columnar snapshot is patched once, at the end. A rerun skips rows that
+are already current, so an interrupted run can simply be repeated.
+
+Usage:
+    python recalculate.py
+"""
+import os
+import time
+
+import numpy as np
+from sqlalchemy import and_, delete, insert, or_, select, table, text
+from sqlalchemy.orm import sessionmaker
+
+import columnar, factors, ingest, models, periods, rollups
+from database import engine as default_engine
+
+CHUNK_SIZE = int(os.getenv("RECALC_CHUNK", "20000"))
+
+activities = models.Activity.__table__
+applied = models.AppliedFactor.__table__
+
+
+def applied_state(db):
+    return dict(db.execute(select(applied.c.factor_key, applied.c.version)).all())
+
+
+def save_state(db, registry):
+    """Record `registry` as the state the ledger is reconciled with (the caller commits)."""
+    db.execute(delete(applied))
+    db.execute(insert(applied), [{"factor_key": k, "version": v} for k, v in registry.state().items()])
+
+
+def _is_conversion(key):
+    return "|" not in key
+
+
+def affected_keys(db, registry, previous):
+    """
+    Factor keys whose activities need re-resolving; None stands for activities without one.
+    `previous` is the applied state (an empty dict means the ledger was never reconciled).
+    """
+    current = registry.state()
+    stored = db.execute(select(activities.c.factor_key, activities.c.factor_version).distinct()).all()
+    keys = {key for key, version in stored if key is None or current.get(key) != version}
+
+    # Categories where a new factor or a changed conversion may now match rows differently
+    categories = set()
+    for key in current.keys() | previous.keys():
+        if current.get(key) == previous.get(key):
+            continue
+        if _is_conversion(key):
+            for unit in key.split("->"):
+                categories |= registry.categories_with_unit(unit)
+        elif key not in previous:
+            categories.add(key.split("|", 1)[0])
+    if categories:
+        keys |= {key for key, _ in stored if key is not None and key.split("|", 1)[0] in categories}
+    return keys
+
+
+def _key_filter(keys, open_from=None, reopened=()):
+    clauses = []
+    named = sorted(k for k in keys if k is not None)
+    if named:
+        clauses.append(activities.c.factor_key.in_(named))
+    if None in keys:
+        clauses.append(activities.c.factor_key.is_(None))
+    clauses.extend(and_(activities.c.date >= start, activities.c.date < end) for start, end in reopened)
+    if open_from is None:
+        return or_(*clauses)
+    return and_(or_(*clauses), or_(activities.c.date >= open_from, activities.c.date.is_(None)))
+
+
+def _write_updates(db, rows):
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE TEMP TABLE recalc_rows (activity_id integer PRIMARY KEY, co2e double precision, "
+            "confidence_score varchar, factor_key varchar, factor_version varchar) ON COMMIT DROP"
+        ))
+        ingest.copy_rows(conn, table("recalc_rows"), rows)
+        conn.execute(text(
+            "UPDATE activities AS a SET co2e = r.co2e, confidence_score = r.confidence_score, "
+            "factor_key = r.factor_key, factor_version = r.factor_version "
+            "FROM recalc_rows AS r WHERE a.id = r.activity_id"
+        ))
+    else:
+        # Straight to the driver's executemany: SQLAlchemy's per-row parameter processing
+        # would cost nearly as much as the UPDATE itself
+        conn.exec_driver_sql(
+            "UPDATE activities SET co2e = ?, confidence_score = ?, factor_key = ?, factor_version = ? WHERE id = ?",
+            [(r["co2e"], r["confidence_score"], r["factor_key"], r["factor_version"], r["activity_id"]) for r in rows],
+        )
+
+
+def _rollup_changes(types, dates, deltas):
+    """(activity_type, month, co2e delta) for each category x month a chunk changed."""
+    totals = {}
+    months = np.array(dates, dtype="datetime64[M]").tolist()  # datetime.date, or None for NaT
+    for key, delta in zip(zip(types, months), deltas.tolist()):
+        totals[key] = totals.get(key, 0.0) + delta
+    return [(t, m.strftime("%Y-%m") if m else None, delta) for (t, m), delta in totals.items()]
+
+
+def recalculate_chunk(db, registry, keys, first_id, last_id, open_from=None, reopened=()):
+    """
+    Re-resolve the affected activities with ids in [first_id, last_id] (the caller commits):
+    those with one of `keys` or dated in one of the `reopened` [start, end) ranges, leaving
+    out those dated before `open_from` (closed periods).
+    Returns (rows scanned, None or the updated rows' (ids, co2e, confidence) arrays).
+    """
+    rows = db.execute(
+        select(
+            activities.c.id, activities.c.activity_type, activities.c.unit, activities.c.region,
+            activities.c.date, activities.c.quantity, activities.c.co2e, activities.c.confidence_score,
+            activities.c.factor_key, activities.c.factor_version,
+        )
+        .where(activities.c.id.between(first_id, last_id), _key_filter(keys, open_from, reopened))
+        .order_by(activities.c.id)
+    ).all()
+    if not rows:
+        return 0, None
+
+    n = len(rows)
+    ids, types, units, regions, dates, quantities, co2es, confidences, keys_, versions = zip(*rows)
+    index, multiplier = registry.resolve(types, units, [d.year if d else None for d in dates], regions)
+    quantity = np.fromiter((q or 0.0 for q in quantities), dtype=np.float64, count=n)
+    old_co2e = np.fromiter((np.nan if c is None else c for c in co2es), dtype=np.float64, count=n)
+    new_co2e = registry.co2e(quantity, index, multiplier)
+    new_keys = registry.keys[index]
+    new_versions = registry.versions[index]
+    new_confidence = registry.confidence[index]
+
+    changed = (
+        (new_co2e != old_co2e)
+        | (new_keys != np.array(keys_, dtype=object))
+        | (new_versions != np.array(versions, dtype=object))
+        | (new_confidence != np.array(confidences, dtype=object))
+    )
+    positions = np.flatnonzero(changed)
+    if not len(positions):
+        return n, None
+
+    _write_updates(db, [
+        {
+            "activity_id": ids[i],
+            "co2e": co2e,
+            "confidence_score": new_confidence[i],
+            "factor_key": new_keys[i],
+            "factor_version": new_versions[i],
+        }
+        for i, co2e in zip(positions, new_co2e[positions].tolist())
+    ])
+    rollups.record_changes(db, _rollup_changes(
+        [types[i] for i in positions],
+        [dates[i] for i in positions],
+        new_co2e[positions] - np.nan_to_num(old_co2e[positions]),
+    ))
+
+    # Details stored before the registry no longer describe the value; /explain derives them now
+    legacy = [ids[i] for i in positions if keys_[i] is None]
+    if legacy:
+        db.execute(delete(models.EmissionDetail).where(models.EmissionDetail.activity_id.in_(legacy)))
+    return n, (np.array(ids)[positions], new_co2e[positions], new_confidence[positions])
+
+
+def recalculate(engine=default_engine, registry=None, chunk_size=CHUNK_SIZE):
+    """Bring stored co2e values in line with the current factor registry; returns run stats."""
+    started = time.perf_counter()
+    registry = registry or factors.get_registry()
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    with Session() as db:
+        keys = affected_keys(db, registry, applied_state(db))
+        open_from = periods.open_from(db)
+        reopened_months = periods.reopened_months(db)
+        reopened = periods.month_ranges(reopened_months)
+        ids = np.array([], dtype=np.int64)
+        if keys or reopened:
+            ids = np.fromiter(
+                db.execute(
+                    select(activities.c.id).where(_key_filter(keys, open_from, reopened)).order_by(activities.c.id)
+                ).scalars(),
+                dtype=np.int64,
+            )
+
+    scanned = updated = chunks = 0
+    patched = []  # (ids, co2e, confidence) of committed chunks, applied to the columnar snapshot at the end
+    try:
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            with Session() as db:
+                n, changes = recalculate_chunk(db, registry, keys, int(chunk[0]), int(chunk[-1]), open_from, reopened)
+                db.commit()
+            scanned += n
+            chunks += 1
+            if changes is not None:
+                patched.append(changes)
+                updated += len(changes[0])
+
+        with Session() as db:
+            save_state(db, registry)
+            periods.forget_reopened(db, reopened_months)
+            db.commit()
+    finally:
+        # bulk UPDATEs bypass the session hooks that keep the columnar snapshot current
+        if patched:
+            try:
+                columnar.patch(*(np.concatenate(column) for column in zip(*patched)))
+            except Exception:
+                columnar.mark_stale()
+                raise
+
+    elapsed = time.perf_counter() - started
+    return {
+        "registry_version": registry.version,
+        "affected_factor_keys": len(keys),
+        "reopened_months": len(reopened_months),
+        "rows_scanned": scanned,
+        "rows_updated": updated,
+        "chunks": chunks,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(scanned / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    print(recalculate())
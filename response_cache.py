@@ -0,0 +1,159 @@
+"""
+Server-side cache for the dashboard's read endpoints (/summary, /insights, /activities).
+
+Responses are keyed by path plus query string and tagged with the ledger version
+(rollups.current_version), which every committed write to `activities` bumps in the same
+transaction. An entry is only served while its version is current, so an upload
+invalidates everything at once without tracking which entries it touched.
+
+The ETag depends on nothing but the version and the key, so a matching If-None-Match is
+answered with 304 before the response is looked up, computed or serialized.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+import metrics, rollups
+
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+CACHE_MAX_BYTES = int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+class ResponseCache:
+    """LRU of serialized JSON bodies, bounded by entry count and total bytes."""
+
+    def __init__(self, maxsize=CACHE_SIZE, max_bytes=CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (version, body)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.CACHE_LOOKUPS.inc(cache="responses", result="hit")
+                return entry[1]
+            if entry is not None:
+                # Built before the last write; drop it now rather than waiting for eviction
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            metrics.CACHE_LOOKUPS.inc(cache="responses", result="miss")
+            return None
+
+    def put(self, key, version, body):
+        if self.maxsize <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+        metrics.CACHE_LOOKUPS.inc(cache="responses", result="not_modified")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses + self.not_modified
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                # Requests answered without recomputing (cached body or 304)
+                "hit_rate": ((self.hits + self.not_modified) / requests) if requests else 0.0,
+            }
+
+
+cache = ResponseCache()
+
+
+def cache_key(request):
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+
+def make_etag(version, key):
+    return f'"{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    # Weak comparison, as If-None-Match requires; proxies may add the W/ prefix
+    return "*" in candidates or any(t.removeprefix("W/") == etag for t in candidates)
+
+
+@lru_cache(maxsize=None)
+def _adapter(model):
+    return TypeAdapter(model)
+
+
+def serialize(data, model):
+    """JSON bytes of `data` validated against the endpoint's response model, as FastAPI would return."""
+    adapter = _adapter(model)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+def respond(request, db, build, model, stage="aggregation"):
+    """
+    Serve `build()` (the endpoint's uncached result) as JSON through the cache.
+    Exceptions from `build` propagate and nothing is cached. A miss times `build` as
+    `stage` and the JSON encoding as "serialization" (see metrics.py).
+    """
+    key = cache_key(request)
+    version = rollups.current_version(db)
+    etag = make_etag(version, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+
+    body = cache.get(key, version)
+    if body is None:
+        with metrics.timed(stage):
+            data = build()
+        with metrics.timed("serialization"):
+            body = serialize(data, model)
+        cache.put(key, version, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def respond_async(request, db, build, model, stage="aggregation"):
+    """respond() for an AsyncSession; `build` is called with the session's sync facade."""
+    return await db.run_sync(lambda session: respond(request, session, lambda: build(session), model, stage))
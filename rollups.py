@@ -0,0 +1,214 @@
+"""
+Incrementally maintained aggregates over the `activities` table.
+
+Every write to `activities` adds (or subtracts) its co2e into three rollup tables:
+per category, per month and per category x month. ORM inserts, updates and deletes are
+tracked by a session flush hook; bulk Core inserts (CSV ingestion) call `record_rows`
+and bulk updates (factor recalculation) call `record_changes` directly. Either way the rollup UPSERTs run in the same transaction as the write.
+
+The same hooks bump the ledger version, a single counter row that read caches compare
+against to know whether anything in `activities` has changed (see response_cache.py).
+"""
+from sqlalchemy import event, func, select, delete, insert, inspect, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+ROLLUP_TABLES = (
+    models.CategoryRollup.__table__,
+    models.MonthRollup.__table__,
+    models.CategoryMonthRollup.__table__,
+)
+
+
+def month_key(date):
+    return date.strftime('%Y-%m') if date is not None else None
+
+
+def month_expr(column, dialect_name):
+    """SQL expression giving the YYYY-MM month of a datetime column."""
+    if dialect_name == "postgresql":
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+class _Deltas:
+    """Accumulates co2e / count changes per rollup key before they are written."""
+
+    def __init__(self):
+        self.category = {}
+        self.month = {}
+        self.category_month = {}
+
+    def add(self, activity_type, date, co2e, sign=1):
+        self.add_month(activity_type, month_key(date), (co2e or 0.0) * sign, sign)
+
+    def add_month(self, activity_type, month, co2e, count):
+        for bucket, key in (
+            (self.category, activity_type),
+            (self.month, month),
+            (self.category_month, (activity_type, month)),
+        ):
+            total, n = bucket.get(key, (0.0, 0))
+            bucket[key] = (total + co2e, n + count)
+
+    def __bool__(self):
+        return bool(self.category)
+
+
+def _upsert(dialect_name, table, key_columns):
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(table)
+    else:
+        stmt = sqlite.insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            "total_co2e": table.c.total_co2e + stmt.excluded.total_co2e,
+            "activity_count": table.c.activity_count + stmt.excluded.activity_count,
+        },
+    )
+
+
+def _key_order(item):
+    return repr(item[0])
+
+
+def _write(conn, deltas):
+    dialect_name = conn.dialect.name
+    category, month, category_month = ROLLUP_TABLES
+
+    # Sorted, so concurrent writers lock rollup rows in the same order (no deadlocks on PostgreSQL)
+    rows = [{"activity_type": k, "total_co2e": t, "activity_count": c}
+            for k, (t, c) in sorted(deltas.category.items(), key=_key_order) if k is not None]
+    if rows:
+        conn.execute(_upsert(dialect_name, category, ["activity_type"]), rows)
+
+    rows = [{"month": k, "total_co2e": t, "activity_count": c}
+            for k, (t, c) in sorted(deltas.month.items(), key=_key_order) if k is not None]
+    if rows:
+        conn.execute(_upsert(dialect_name, month, ["month"]), rows)
+
+    rows = [{"activity_type": a, "month": m, "total_co2e": t, "activity_count": c}
+            for (a, m), (t, c) in sorted(deltas.category_month.items(), key=_key_order)
+            if a is not None and m is not None]
+    if rows:
+        conn.execute(_upsert(dialect_name, category_month, ["activity_type", "month"]), rows)
+
+
+def bump_version(conn):
+    """Advance the ledger version inside the transaction that writes to `activities`."""
+    table = models.LedgerVersion.__table__
+    bumped = conn.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1))
+    if bumped.rowcount == 0:
+        conn.execute(insert(table).values(id=1, version=1))
+
+
+def current_version(db):
+    """The committed ledger version (0 before the first write)."""
+    return db.execute(select(models.LedgerVersion.version).where(models.LedgerVersion.id == 1)).scalar() or 0
+
+
+def record_rows(db, rows, sign=1):
+    """
+    Fold a batch of activity dicts (as passed to a bulk INSERT) into the rollups.
+    Use sign=-1 for rows removed with a bulk DELETE.
+    """
+    deltas = _Deltas()
+    for row in rows:
+        deltas.add(row["activity_type"], row["date"], row["co2e"], sign)
+    if deltas:
+        conn = db.connection()
+        _write(conn, deltas)
+        bump_version(conn)
+
+
+def record_changes(db, changes):
+    """
+    Fold in-place co2e updates (a bulk UPDATE) into the rollups.
+    `changes` are (activity_type, month 'YYYY-MM', co2e delta) triples; counts are unchanged.
+    """
+    deltas = _Deltas()
+    for activity_type, month, co2e in changes:
+        deltas.add_month(activity_type, month, co2e, 0)
+    conn = db.connection()
+    if deltas:
+        _write(conn, deltas)
+    bump_version(conn)
+
+
+def _old_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), attr)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_orm_changes(session, flush_context):
+    """Keep rollups in step with Activity objects inserted, changed or deleted through the ORM."""
+    deltas = _Deltas()
+    changed = False
+    for obj in session.new:
+        if isinstance(obj, models.Activity):
+            deltas.add(obj.activity_type, obj.date, obj.co2e)
+    for obj in session.deleted:
+        if isinstance(obj, models.Activity):
+            deltas.add(obj.activity_type, obj.date, obj.co2e, -1)
+    for obj in session.dirty:
+        if not isinstance(obj, models.Activity) or not session.is_modified(obj):
+            continue
+        changed = True  # e.g. a description edit still changes what /activities returns
+        state = inspect(obj)
+        if not any(state.attrs[a].history.has_changes() for a in ("activity_type", "date", "co2e")):
+            continue
+        deltas.add(_old_value(state, "activity_type"), _old_value(state, "date"), _old_value(state, "co2e"), -1)
+        deltas.add(obj.activity_type, obj.date, obj.co2e)
+    if deltas:
+        _write(session.connection(), deltas)
+    if deltas or changed:
+        bump_version(session.connection())
+
+
+def rebuild(db):
+    """Recompute every rollup from `activities` (initial build or repair after drift)."""
+    conn = db.connection()
+    activity = models.Activity.__table__
+    month = month_expr(activity.c.date, conn.dialect.name)
+    category_table, month_table, category_month_table = ROLLUP_TABLES
+
+    for table in ROLLUP_TABLES:
+        conn.execute(delete(table))
+
+    conn.execute(insert(category_table).from_select(
+        ["activity_type", "total_co2e", "activity_count"],
+        select(activity.c.activity_type, func.coalesce(func.sum(activity.c.co2e), 0.0), func.count())
+        .where(activity.c.activity_type.is_not(None))
+        .group_by(activity.c.activity_type),
+    ))
+    conn.execute(insert(month_table).from_select(
+        ["month", "total_co2e", "activity_count"],
+        select(month, func.coalesce(func.sum(activity.c.co2e), 0.0), func.count())
+        .where(activity.c.date.is_not(None))
+        .group_by(month),
+    ))
+    conn.execute(insert(category_month_table).from_select(
+        ["activity_type", "month", "total_co2e", "activity_count"],
+        select(activity.c.activity_type, month, func.coalesce(func.sum(activity.c.co2e), 0.0), func.count())
+        .where(activity.c.activity_type.is_not(None), activity.c.date.is_not(None))
+        .group_by(activity.c.activity_type, month),
+    ))
+
+
+def ensure_built(db):
+    """Build the rollups once for a ledger that predates them, and seed the version row."""
+    has_rollups = db.execute(select(models.CategoryRollup.activity_type).limit(1)).first()
+    has_activities = db.execute(select(models.Activity.id).limit(1)).first()
+    if has_activities and not has_rollups:
+        rebuild(db)
+    if db.get(models.LedgerVersion, 1) is None:
+        db.add(models.LedgerVersion(id=1, version=0))
+    db.commit()
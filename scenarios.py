@@ -0,0 +1,206 @@
+"""
+Portfolio-wide what-if simulation for POST /scenario/batch.
+
+The ledger is read once as NumPy columns (category, unit and region codes, date, quantity,
+co2e), memory mapped from the columnar snapshot when it is enabled. Every scenario is then evaluated
+with vectorized masks and np.bincount, so each scenario costs a handful of array passes
+rather than a Python loop over activities.
+
+Rules within a scenario are applied in order. For the rows a rule matches it:
+  1. scales quantity (and co2e) by `quantity_multiplier`,
+  2. recategorizes to `new_type`, moving co2e by the difference between the factors
+     registry.resolve picks for the new and the current category (same unit, region and
+     year), so a rule that keeps a row's category leaves its co2e exactly as stored,
+  3. recomputes co2e with an explicit `new_factor` (kg CO2e per unit).
+With `share` < 1 only that fraction of each matched row's quantity is changed; the rest
+keeps its current category and emissions.
+"""
+import numpy as np
+from sqlalchemy import select
+
+import columnar, factors, models
+
+activities = models.Activity.__table__
+
+
+class LedgerColumns:
+    """Column arrays of the activities a batch of scenarios runs against."""
+
+    def __init__(self, categories, category_codes, dates, quantity, co2e, units, unit_codes, regions, region_codes):
+        self.categories = list(categories)
+        self.category_codes = category_codes
+        self.dates = dates
+        self.quantity = quantity
+        self.co2e = co2e
+        self.units = list(units)
+        self.unit_codes = unit_codes
+        self.regions = list(regions)
+        self.region_codes = region_codes
+        self.months, self.month_codes = np.unique(dates.astype('datetime64[M]'), return_inverse=True)
+        # Factor year of each row; -1 for undated rows, which take the latest factor
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        self.years = np.where(np.isnat(dates), -1, years)
+
+    def __len__(self):
+        return len(self.quantity)
+
+    @classmethod
+    def load(cls, db):
+        snapshot = columnar.snapshot(db)
+        if snapshot is not None:
+            # Memory-mapped columns: nothing is materialized until the masks touch it
+            return cls(
+                [str(c) for c in snapshot.categories],
+                snapshot.category,
+                snapshot.dates(),
+                snapshot.quantity,
+                snapshot.co2e,
+                snapshot.dictionaries["unit"],
+                snapshot.unit,
+                snapshot.dictionaries["region"],
+                snapshot.region,
+            )
+
+        rows = db.execute(select(
+            activities.c.activity_type, activities.c.date, activities.c.quantity, activities.c.co2e,
+            activities.c.unit, activities.c.region,
+        )).all()
+        n = len(rows)
+        types = [r[0] for r in rows]
+        categories, codes = np.unique(np.array(types, dtype=object).astype(str), return_inverse=True)
+        units, unit_codes = _encode([r[4] for r in rows])
+        regions, region_codes = _encode([r[5] for r in rows])
+        return cls(
+            categories,
+            codes.astype(np.int32),
+            np.array([r[1] for r in rows], dtype='datetime64[s]'),
+            np.fromiter((r[2] or 0.0 for r in rows), dtype=np.float64, count=n),
+            np.fromiter((r[3] or 0.0 for r in rows), dtype=np.float64, count=n),
+            units,
+            unit_codes,
+            regions,
+            region_codes,
+        )
+
+
+def _encode(values):
+    """(distinct values, int32 code per value); None is kept as a value of its own."""
+    distinct = {}
+    codes = np.fromiter((distinct.setdefault(v, len(distinct)) for v in values), dtype=np.int32, count=len(values))
+    return list(distinct), codes
+
+
+def _price(columns, categories, codes, unit_codes, region_codes, years, quantity):
+    """
+    kg CO2e of `quantity` with the factor registry.resolve matches for each row's category,
+    unit, region and year, computed in the same order as the co2e stored at ingest.
+    """
+    registry = factors.get_registry()
+    keys, inverse = np.unique(np.stack([codes, unit_codes, region_codes, years]), axis=1, return_inverse=True)
+    index, multiplier = registry.resolve(
+        [categories[c] for c in keys[0]],
+        [columns.units[u] for u in keys[1]],
+        [int(y) if y >= 0 else None for y in keys[3]],
+        [columns.regions[r] for r in keys[2]],
+    )
+    inverse = inverse.reshape(-1)
+    return registry.co2e(quantity, index[inverse], multiplier[inverse])
+
+
+def _rule_mask(categories, codes, dates, rule):
+    mask = np.ones(len(codes), dtype=bool)
+    if rule.category is not None:
+        if rule.category not in categories:
+            return np.zeros(len(codes), dtype=bool)
+        mask &= codes == categories.index(rule.category)
+    if rule.start_date is not None:
+        mask &= dates >= np.datetime64(rule.start_date, 's')
+    if rule.end_date is not None:
+        mask &= dates < np.datetime64(rule.end_date, 's') + np.timedelta64(1, 'D')
+    return mask
+
+
+def simulate(columns, scenario):
+    """Evaluate one scenario; returns totals plus per-category and per-month deltas."""
+    categories = list(columns.categories)
+    codes = columns.category_codes.copy()
+    dates = columns.dates
+    months = columns.month_codes
+    quantity = columns.quantity.copy()
+    co2e = columns.co2e.copy()
+    unit_codes = columns.unit_codes
+    region_codes = columns.region_codes
+    years = columns.years
+
+    for rule in scenario.rules:
+        mask = _rule_mask(categories, codes, dates, rule)
+        if not mask.any():
+            continue
+
+        idx = np.flatnonzero(mask)
+        share = min(max(rule.share, 0.0), 1.0)
+        q = quantity[idx] * share
+        c = co2e[idx] * share
+
+        if rule.quantity_multiplier is not None:
+            q = q * rule.quantity_multiplier
+            c = c * rule.quantity_multiplier
+        new_codes = codes[idx]
+        if rule.new_type is not None:
+            if rule.new_type not in categories:
+                categories.append(rule.new_type)
+            new_codes = np.full(len(idx), categories.index(rule.new_type), dtype=np.int32)
+            # Price both sides alike: rows already in new_type keep their co2e exactly
+            row_keys = (unit_codes[idx], region_codes[idx], years[idx])
+            c = c + (
+                _price(columns, categories, new_codes, *row_keys, q)
+                - _price(columns, categories, codes[idx], *row_keys, q)
+            )
+        if rule.new_factor is not None:
+            c = q * rule.new_factor
+
+        if share >= 1.0:
+            quantity[idx], co2e[idx], codes[idx] = q, c, new_codes
+        else:
+            # Split rows: the untouched remainder stays, the changed share becomes extra rows
+            keep = 1.0 - share
+            quantity[idx] *= keep
+            co2e[idx] *= keep
+            quantity = np.concatenate([quantity, q])
+            co2e = np.concatenate([co2e, c])
+            codes = np.concatenate([codes, new_codes])
+            dates = np.concatenate([dates, dates[idx]])
+            months = np.concatenate([months, months[idx]])
+            unit_codes = np.concatenate([unit_codes, unit_codes[idx]])
+            region_codes = np.concatenate([region_codes, region_codes[idx]])
+            years = np.concatenate([years, years[idx]])
+
+    n_categories = len(categories)
+    n_months = len(columns.months)
+    base_by_category = np.bincount(columns.category_codes, weights=columns.co2e, minlength=n_categories)
+    sim_by_category = np.bincount(codes, weights=co2e, minlength=n_categories)
+    base_by_month = np.bincount(columns.month_codes, weights=columns.co2e, minlength=n_months)
+    sim_by_month = np.bincount(months, weights=co2e, minlength=n_months)
+
+    baseline = float(base_by_category.sum())
+    simulated = float(sim_by_category.sum())
+    return {
+        "name": scenario.name,
+        "baseline_co2e": baseline,
+        "simulated_co2e": simulated,
+        "difference": baseline - simulated,
+        "reduction_percentage": ((baseline - simulated) / baseline * 100) if baseline > 0 else 0,
+        "by_category": [
+            {"name": name, "baseline": float(b), "simulated": float(s), "delta": float(s - b)}
+            for name, b, s in zip(categories, base_by_category, sim_by_category)
+        ],
+        "by_month": [
+            {"date": str(m), "baseline": float(b), "simulated": float(s), "delta": float(s - b)}
+            for m, b, s in zip(columns.months, base_by_month, sim_by_month)
+        ],
+    }
+
+
+def run_batch(db, scenarios):
+    columns = LedgerColumns.load(db)
+    return [simulate(columns, scenario) for scenario in scenarios]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
 class ActivityBase(BaseModel):
     description: str
@@ -20,6 +20,30 @@ class ActivityResponse(ActivityBase):
     class Config:
         from_attributes = True
 
+class ActivityPage(BaseModel):
+    items: List[ActivityResponse]
+    next_cursor: Optional[str] = None
+
+class RejectedRow(BaseModel):
+    line_number: int
+    reason: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    filename: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    progress: float
+    rows_processed: int
+    rows_duplicate: int = 0
+    rows_rejected: int
+    duplicate_of: Optional[str] = None
+    rows_per_second: Optional[float] = None
+    rejected_rows: List[RejectedRow]
+
 class EmissionDetailResponse(BaseModel):
     emission_factor: float
     factor_source: str
@@ -31,7 +55,10 @@ class EmissionDetailResponse(BaseModel):
         from_attributes = True
 
 class FullActivityDetail(ActivityResponse):
-    details: Optional[EmissionDetailResponse]
+    region: Optional[str] = None
+    factor_key: Optional[str] = None
+    factor_version: Optional[str] = None
+    details: Optional[EmissionDetailResponse] = None
 
 class DashboardSummary(BaseModel):
     total_co2e: float
@@ -45,6 +72,9 @@ class Recommendation(BaseModel):
     suggestion: str
     impact: str
 
+class CategoryCorrection(BaseModel):
+    activity_type: str
+
 class ScenarioRequest(BaseModel):
     activity_id: int
     new_quantity: Optional[float] = None
@@ -55,3 +85,39 @@ class ScenarioResponse(BaseModel):
     simulated_co2e: float
     difference: float
     reduction_percentage: float
+
+class ScenarioRule(BaseModel):
+    category: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    share: float = 1.0
+    quantity_multiplier: Optional[float] = None
+    new_type: Optional[str] = None
+    new_factor: Optional[float] = None
+
+class BatchScenario(BaseModel):
+    name: str
+    rules: List[ScenarioRule]
+
+class BatchScenarioRequest(BaseModel):
+    scenarios: List[BatchScenario]
+
+class ScenarioBreakdown(BaseModel):
+    baseline: float
+    simulated: float
+    delta: float
+
+class CategoryScenarioBreakdown(ScenarioBreakdown):
+    name: str
+
+class MonthScenarioBreakdown(ScenarioBreakdown):
+    date: str
+
+class BatchScenarioResult(BaseModel):
+    name: str
+    baseline_co2e: float
+    simulated_co2e: float
+    difference: float
+    reduction_percentage: float
+    by_category: List[CategoryScenarioBreakdown]
+    by_month: List[MonthScenarioBreakdown]
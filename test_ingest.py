@@ -0,0 +1,88 @@
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+# A throwaway ledger, configured before the app modules read their settings at import
+_workdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'ledger.db')}"
+os.environ["COLUMNAR_DIR"] = os.path.join(_workdir, "columnar")
+
+import database, ingest, migrations
+
+DATELESS_CSV = "description,quantity,unit\nTaxi to airport,12,km\nOffice electricity,40,kWh\n"
+RECURRING_CSV = "description,quantity,unit\nSoftware subscription,1,items\n"
+REPEATED_CSV = "date,description,quantity,unit\n2024-03-04,Coffee beans,2,kg\n2024-03-04,Coffee beans,2,kg\n"
+
+
+def _days_later(days):
+    class _Later(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=days)
+    return _Later
+
+
+def _upload(csv_text, **kwargs):
+    with database.SessionLocal() as db:
+        stats = ingest.ingest_csv(io.BytesIO(csv_text.encode()), db, **kwargs)
+        db.commit()
+    return stats
+
+
+class DatelessReuploadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        migrations.migrate(database.engine)
+
+    def test_hash_uses_ingest_day(self):
+        header_map = {"description": "description", "quantity": "quantity", "unit": "unit"}
+        row = {"description": "Taxi to airport", "quantity": "12", "unit": "km"}
+        first = ingest.parse_row(row, header_map, datetime(2024, 1, 1))
+        second = ingest.parse_row(row, header_map, datetime(2024, 2, 1))
+        self.assertNotEqual(first[5], second[5])
+        self.assertEqual(first[5], ingest.parse_row(row, header_map, datetime(2024, 1, 1))[5])
+
+    def test_reupload_on_the_same_day_is_deduplicated(self):
+        self.assertEqual(_upload(DATELESS_CSV)["rows_processed"], 2)
+        stats = _upload(DATELESS_CSV)
+        self.assertEqual(stats["rows_processed"], 0)
+        self.assertEqual(stats["rows_duplicate"], 2)
+
+    def test_recurring_charge_next_month_is_kept(self):
+        self.assertEqual(_upload(RECURRING_CSV)["rows_processed"], 1)
+        with mock.patch.object(ingest, "datetime", _days_later(31)):
+            stats = _upload(RECURRING_CSV)
+        self.assertEqual(stats["rows_processed"], 1)
+        self.assertEqual(stats["rows_duplicate"], 0)
+
+
+class RepeatedRowTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        migrations.migrate(database.engine)
+
+    def test_copies_within_a_file_match_copies_in_the_ledger(self):
+        stats = _upload(REPEATED_CSV, batch_size=1)  # the copies land in different batches
+        self.assertEqual(stats["rows_processed"], 2)
+        self.assertEqual(stats["rows_duplicate"], 0)
+
+        stats = _upload(REPEATED_CSV)
+        self.assertEqual(stats["rows_processed"], 0)
+        self.assertEqual(stats["rows_duplicate"], 2)
+
+        # In a longer export with four copies, the first two are already stored
+        stats = _upload(REPEATED_CSV + REPEATED_CSV.split("\n", 1)[1])
+        self.assertEqual(stats["rows_processed"], 2)
+        self.assertEqual(stats["rows_duplicate"], 2)
+
+    def test_resumed_file_keeps_the_numbering(self):
+        reader, header_map = ingest.open_reader(io.BytesIO(REPEATED_CSV.encode()))
+        (parsed, _, _), = ingest.iter_batches(reader, header_map, skip_rows=1)
+        self.assertTrue(parsed[0][-1].endswith("#2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
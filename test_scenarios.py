@@ -0,0 +1,67 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# A throwaway ledger, configured before the app modules read their settings at import
+_workdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'ledger.db')}"
+os.environ["COLUMNAR_DIR"] = os.path.join(_workdir, "columnar")
+
+from sqlalchemy import select
+
+import columnar, database, ingest, main, migrations, models, scenarios, schemas
+
+# Units and regions that the categories' default factors do not cover
+LEDGER_CSV = (
+    "date,description,quantity,unit,region\n"
+    "2024-02-03,Office electricity,2,MWh,GB\n"
+    "2024-02-04,Boiler natural gas,10,therms,\n"
+    "2024-02-05,Rental car to client site,100,miles,\n"
+    "2024-02-06,Warehouse electricity,1500,kWh,US\n"
+)
+
+
+def _run(coroutine_function, *args):
+    async def call():
+        async with database.AsyncSessionLocal() as db:
+            return await coroutine_function(*args, db)
+    return asyncio.run(call())
+
+
+class NoOpScenarioTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        migrations.migrate(database.engine)
+        with database.SessionLocal() as db:
+            ingest.ingest_csv(io.BytesIO(LEDGER_CSV.encode()), db)
+            db.commit()
+            cls.activities = db.execute(select(models.Activity)).scalars().all()
+
+    def test_single_scenario_without_changes(self):
+        for activity in self.activities:
+            for request in (
+                schemas.ScenarioRequest(activity_id=activity.id),
+                schemas.ScenarioRequest(activity_id=activity.id, new_type=activity.activity_type),
+            ):
+                result = _run(main.simulate_scenario, request)
+                self.assertEqual(result["difference"], 0)
+                self.assertEqual(result["simulated_co2e"], activity.co2e)
+
+    def test_batch_rule_into_the_same_category(self):
+        categories = sorted({a.activity_type for a in self.activities})
+        scenario = schemas.BatchScenario(name="no-op", rules=[
+            schemas.ScenarioRule(category=category, new_type=category) for category in categories
+        ])
+        for enabled in (True, False):
+            with mock.patch.object(columnar, "ENABLED", enabled), database.SessionLocal() as db:
+                columns = scenarios.LedgerColumns.load(db)
+            result = scenarios.simulate(columns, scenario)
+            self.assertEqual(result["difference"], 0)
+            self.assertTrue(all(c["delta"] == 0 for c in result["by_category"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,48 +1,119 @@
+"""
+Train the activity classifier and install it at utils.MODEL_PATH (MODEL_PATH in .env).
+
+    python train_model.py             # TF-IDF + LogisticRegression on training_data.csv
+    python train_model.py --online    # HashingVectorizer + SGDClassifier (see online_model.py),
+                                      # on training_data.csv plus the corrections in the ledger
+    python train_model.py --update    # teach the installed online model the corrections made since
+
+Running APIs and ingestion workers pick up the new model file without a restart.
+`python benchmark.py model` compares the two model types.
+"""
+import argparse
+import os
+import sqlite3
+
 import pandas as pd
-from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
 from sklearn.metrics import classification_report
-import joblib
-import os
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
 
-def train_and_export():
-    # 1. Load Data
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    data_path = os.path.join(script_dir, 'training_data.csv')
+from classification_cache import file_version, purge_stale_entries
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RANDOM_STATE = 42
+
+
+def build_pipeline():
+    # This is lightweight, fast, and highly effective for short text classification
+    return Pipeline([
+        ('tfidf', TfidfVectorizer(ngram_range=(1, 2), stop_words='english')),
+        ('clf', LogisticRegression(max_iter=1000))
+    ])
+
+
+def load_training_data(data_path=os.path.join(SCRIPT_DIR, 'training_data.csv')):
     if not os.path.exists(data_path):
         print(f"Error: {data_path} not found.")
-        return
-
+        return None
     df = pd.read_csv(data_path)
     print(f"Loaded {len(df)} samples for training.")
+    return df
+
+
+def train_and_export(online=False, output=None):
+    import online_model, utils
+
+    # 1. Load Data
+    df = load_training_data()
+    if df is None:
+        return
 
     # 2. Split Data
     X = df['description']
     y = df['label']
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    # 3. Build Pipeline (TF-IDF + Logistic Regression)
-    # This is lightweight, fast, and highly effective for short text classification
-    model_pipeline = Pipeline([
-        ('tfidf', TfidfVectorizer(ngram_range=(1, 2), stop_words='english')),
-        ('clf', LogisticRegression(max_iter=1000, multi_class='auto'))
-    ])
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
 
-    # 4. Train Model
+    # 3. Train Model
     print("Training model...")
-    model_pipeline.fit(X_train, y_train)
+    if online:
+        import factors
+        # Every category with emission factors, so corrections to any of them can be learned later
+        model = online_model.train(X_train.tolist(), y_train.tolist(), factors.get_registry().category.tolist())
+    else:
+        model = build_pipeline()
+        model.fit(X_train, y_train)
 
-    # 5. Evaluate
-    y_pred = model_pipeline.predict(X_test)
+    # 4. Evaluate
+    y_pred = model.predict(X_test.tolist())
     print("\nModel Performance:")
     print(classification_report(y_test, y_pred))
 
-    # 6. Export Model
-    model_filename = os.path.join(script_dir, '..', 'backend', 'activity_classifier_v1.joblib')
-    joblib.dump(model_pipeline, model_filename)
+    # 5. Learn the categories users corrected in the ledger
+    if online:
+        from database import SessionLocal
+        try:
+            with SessionLocal() as db:
+                read, learned = online_model.learn_corrections(model, db)
+            print(f"Learned {learned} of {read} ledger corrections.")
+        except Exception as e:
+            print(f"Skipping ledger corrections: {e}")
+
+    # 6. Export Model (written beside the API, not relative to the working directory)
+    model_filename = output or utils.MODEL_PATH
+    online_model.save(model, model_filename)
     print(f"\nModel exported successfully to {os.path.abspath(model_filename)}")
 
+    # 7. Invalidate cached classifications made by previous models
+    cache_db = os.getenv("CLASSIFICATION_CACHE_DB")
+    if cache_db and os.path.exists(cache_db):
+        conn = sqlite3.connect(cache_db)
+        try:
+            deleted = purge_stale_entries(conn, file_version(model_filename))
+            print(f"Invalidated {deleted} cached classifications from previous models.")
+        finally:
+            conn.close()
+
+
+def update_online_model():
+    import online_model
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        print(online_model.update(db))
+
+
 if __name__ == "__main__":
-    train_and_export()
+    parser = argparse.ArgumentParser(description="Train the activity classifier")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--online", action="store_true", help="train an incrementally updatable model")
+    mode.add_argument("--update", action="store_true", help="update the installed online model with new corrections")
+    parser.add_argument("--output", help="where to write a trained model (default: MODEL_PATH)")
+    args = parser.parse_args()
+
+    if args.update:
+        update_online_model()
+    else:
+        train_and_export(online=args.online, output=args.output)
@@ -1,84 +1,238 @@
-import joblib
+import hashlib
 import os
+import re
+import threading
+from datetime import datetime
 
-# Load ML Model if available
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "activity_classifier_v1.joblib")
-classifier = None
+import metrics
+from classification_cache import ClassificationCache, file_version, normalize_description
 
-if os.path.exists(MODEL_PATH):
+# ML model, loaded on first use so importing utils does not pull in joblib/sklearn/scipy/numpy
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "activity_classifier_v1.joblib"))
+
+# (classifier or None, version, model file stamp). Replaced as a whole, so a reader holds
+# one consistent model for a whole batch while another thread swaps in the next.
+_model = None
+_model_lock = threading.Lock()
+_loaded_at = None
+
+# Classification results keyed on normalized description + model file hash
+classification_cache = ClassificationCache(
+    file_version(MODEL_PATH),
+    maxsize=int(os.getenv("CLASSIFICATION_CACHE_SIZE", "100000")),
+    persist_path=os.getenv("CLASSIFICATION_CACHE_DB") or None,
+)
+
+def _model_stamp():
     try:
-        classifier = joblib.load(MODEL_PATH)
-        print(f"ML Model loaded successfully from {MODEL_PATH}")
-    except Exception as e:
-        print(f"Error loading ML model: {e}")
-
-# Mock Emission Factors (CO2e per unit)
-EMISSION_FACTORS = {
-    "Transport": {"factor": 0.21, "unit": "kg/km", "source": "DEFRA (2023) - Passenger vehicles"},
-    "Energy": {"factor": 0.35, "unit": "kg/kWh", "source": "EPA (2023) - Grid average"},
-    "Procurement": {"factor": 0.50, "unit": "kg/$", "source": "EEIO Model - General goods"},
-    "Cloud Services": {"factor": 0.08, "unit": "kg/GB", "source": "Cloud Carbon Footprint Methodology"},
-}
+        stat = os.stat(MODEL_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
-def classify_activity(description: str):
+def _install(classifier, version, stamp):
+    global _model, _loaded_at
+    _model = (classifier, version, stamp)
+    _loaded_at = datetime.utcnow()
+    if classification_cache.model_version != version:
+        classification_cache.reset(version)
+
+def _load(stamp):
+    classifier = None
+    if stamp is not None:
+        try:
+            import joblib
+            classifier = joblib.load(MODEL_PATH)
+            print(f"ML Model loaded successfully from {MODEL_PATH}")
+        except Exception as e:
+            print(f"Error loading ML model: {e}")
+    _install(classifier, file_version(MODEL_PATH) if classifier is not None else "heuristic", stamp)
+
+def _active_model():
+    model = _model
+    stamp = _model_stamp()
+    if model is None or model[2] != stamp:
+        with _model_lock:
+            model = _model
+            if model is None or model[2] != stamp:
+                _load(stamp)
+                model = _model
+    return model
+
+def get_classifier():
     """
-    Classify activity using ML model if available, otherwise fallback to heuristics.
+    Return the ML classifier, loading it on first call (None if unavailable).
+    The model file is reloaded whenever it changes, so a retrained or updated model
+    reaches every process without a restart.
+    """
+    return _active_model()[0]
+
+def set_classifier(model, version=None):
+    """
+    Atomically replace the in-process classifier; None forces the keyword heuristics.
+    `version` names the model in the classification cache (default: a hash of the pickled model).
+    The swap holds until the model file changes.
+    """
+    if version is None:
+        if model is None:
+            version = "heuristic"
+        else:
+            import pickle
+            version = hashlib.sha256(pickle.dumps(model)).hexdigest()[:16]
+    with _model_lock:
+        _install(model, version, _model_stamp())
+
+def model_info():
+    """Version, type and load time of the classifier currently in use."""
+    classifier, version, _ = _active_model()
+    info = {
+        "version": version,
+        "type": type(classifier).__name__ if classifier is not None else "heuristic",
+        "path": MODEL_PATH,
+        "loaded_at": _loaded_at.isoformat() if _loaded_at else None,
+        "incremental": hasattr(classifier, "partial_fit"),
+    }
+    if hasattr(classifier, "samples_seen"):
+        trained_through = classifier.trained_through
+        info["samples_seen"] = classifier.samples_seen
+        info["trained_through"] = trained_through[0] if trained_through else None  # ledger version
+    return info
+
+def warm_up():
+    """
+    Load the model and run one prediction so the first real request does not pay for it.
+    """
+    classify_activities(["warm up"], use_cache=False)
+
+def __getattr__(name):
+    # Keeps `utils.classifier` working without loading the model at import time
+    if name == "classifier":
+        return get_classifier()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Keyword heuristics, in priority order (first category wins when several match)
+KEYWORD_CATEGORIES = [
+    ("Transport", ["drive", "truck", "flight", "shipping", "km", "mile"]),
+    ("Energy", ["electricity", "power", "grid", "heating", "gas", "kwh"]),
+    ("Cloud Services", ["aws", "azure", "google cloud", "hosting", "server", "data center"]),
+]
+DEFAULT_CATEGORY = "Procurement"
+
+_KEYWORD_RANK = {}
+for _rank, (_category, _words) in enumerate(KEYWORD_CATEGORIES):
+    for _word in _words:
+        _KEYWORD_RANK.setdefault(_word, _rank)
+
+# One combined pattern scanned in a single pass. The lookahead reports every (overlapping)
+# keyword position, and alternatives are ordered by priority so a higher-priority keyword
+# is never hidden behind a lower-priority one starting at the same offset.
+_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(w) for w in sorted(_KEYWORD_RANK, key=lambda w: (_KEYWORD_RANK[w], -len(w)))) + "))"
+)
+
+def _heuristic_category(description: str):
+    best = len(KEYWORD_CATEGORIES)
+    for match in _KEYWORD_PATTERN.finditer(description.lower()):
+        rank = _KEYWORD_RANK[match.group(1)]
+        if rank < best:
+            best = rank
+            if rank == 0:
+                break
+    return KEYWORD_CATEGORIES[best][0] if best < len(KEYWORD_CATEGORIES) else DEFAULT_CATEGORY
+
+def _predict(descriptions, classifier):
+    """
+    Run the model (or heuristics) over descriptions.
+    Returns (labels, probabilities, from_model).
     """
     if classifier:
         try:
-            prediction = classifier.predict([description])[0]
-            return prediction
+            proba = classifier.predict_proba(descriptions)
+            best = proba.argmax(axis=1)
+            labels = classifier.classes_[best].tolist()
+            return labels, proba[range(len(descriptions)), best].tolist(), True
         except Exception:
             pass
 
     # Fallback to heuristics
-    desc = description.lower()
-    if any(word in desc for word in ["drive", "truck", "flight", "shipping", "km", "mile"]):
-        return "Transport"
-    elif any(word in desc for word in ["electricity", "power", "grid", "heating", "gas", "kwh"]):
-        return "Energy"
-    elif any(word in desc for word in ["aws", "azure", "google cloud", "hosting", "server", "data center"]):
-        return "Cloud Services"
-    else:
-        return "Procurement"
+    labels = [_heuristic_category(d) for d in descriptions]
+    return labels, [None] * len(labels), False
+
+def classify_activities(descriptions, return_proba=False, use_cache=True):
+    """
+    Classify a batch of descriptions with a single vectorized model call.
+    Falls back to the keyword heuristics if the model is unavailable or fails.
+    Repeated descriptions are classified once and served from the classification cache.
+    With return_proba=True, returns (labels, probabilities) where probabilities holds the
+    model's confidence in each label (None for heuristic results).
+    """
+    keys = [normalize_description(d) for d in descriptions]
+    if not keys:
+        return ([], []) if return_proba else []
+
+    # One model for the whole batch, even if another is swapped in meanwhile
+    classifier, version, _ = _active_model()
+    unique_keys = list(dict.fromkeys(keys))
+    results = classification_cache.get_many(unique_keys) if use_cache else {}
+
+    missing = [k for k in unique_keys if k not in results]
+    if use_cache:
+        metrics.CACHE_LOOKUPS.inc(len(results), cache="classification", result="hit")
+        metrics.CACHE_LOOKUPS.inc(len(missing), cache="classification", result="miss")
+    if missing:
+        labels, probas, from_model = _predict(missing, classifier)
+        computed = dict(zip(missing, zip(labels, probas)))
+        # Heuristic answers are only cached when there is no model to disagree with them
+        if use_cache and (from_model or classifier is None):
+            classification_cache.put_many(computed, version)
+        results.update(computed)
+
+    labels = [results[k][0] for k in keys]
+    if return_proba:
+        return labels, [results[k][1] for k in keys]
+    return labels
+
+def classify_activity(description: str):
+    """
+    Classify activity using ML model if available, otherwise fallback to heuristics.
+    """
+    return classify_activities([description])[0]
+
+def compute_co2e(activity_type: str, quantity, unit=None, region=None, year=None):
+    """
+    kg CO2e of one activity priced like ingest does (factors.FactorRegistry.resolve): the
+    factor matched on category, unit, region and year, with `quantity` converted to its unit.
+    Factors live in the registry (factors.py); importing it here would load NumPy with utils.
+    """
+    import factors
+    registry = factors.get_registry()
+    index, multiplier = registry.lookup(activity_type, unit, region, year)
+    return quantity * multiplier * float(registry.factor[index])
 
 def compute_emissions(activity_type: str, quantity: float):
     """
-    Calculate CO2e based on factor * quantity.
-    Returns (co2e, factor, source, formula, confidence)
+    Calculate CO2e for one activity with its category's default factor.
+    Returns (co2e, factor, source, formula, confidence, unit).
+    Batches should use factors.FactorRegistry.resolve, which also honours unit, region and year.
     """
-    factor_info = EMISSION_FACTORS.get(activity_type, EMISSION_FACTORS["Procurement"])
-    factor = factor_info["factor"]
-    source = factor_info["source"]
-    unit = factor_info["unit"]
-    
+    import factors
+    registry = factors.get_registry()
+    i = registry.default_index(activity_type)
+    factor = float(registry.factor[i])
+    factor_unit = registry.unit[i]
+
     co2e = quantity * factor
-    formula = f"CO2e = {quantity} {unit} * {factor} kg CO2e/{unit.split('/')[-1]}"
-    
-    # Confidence scoring logic
-    if activity_type == "Energy":
-        confidence = "High"
-    elif activity_type in ["Transport", "Cloud Services"]:
-        confidence = "Medium"
-    else:
-        confidence = "Low"
-        
-    return co2e, factor, source, formula, confidence, unit
+    formula = f"CO2e = {quantity} {factor_unit} * {factor} kg CO2e/{factor_unit}"
+    return co2e, factor, registry.source[i], formula, registry.confidence[i], f"kg/{factor_unit}"
 
-def get_recommendations(activities):
+def get_recommendations(category_totals):
     """
-    Generate mock recommendations based on activity data.
+    Generate mock recommendations from [(activity_type, total_co2e)] sorted largest first.
     """
-    if not activities:
+    if not category_totals:
         return []
     
-    # Aggregate by type
-    totals = {}
-    for a in activities:
-        totals[a.activity_type] = totals.get(a.activity_type, 0) + a.co2e
-        
-    sorted_totals = sorted(totals.items(), key=lambda x: x[1], reverse=True)
-    top_category = sorted_totals[0][0]
+    top_category = category_totals[0][0]
     
     recommendations = [
         {